@@ -0,0 +1,84 @@
+"""
+Community Chat Push
+Delivers new messages to members connected to a community's chat socket,
+instead of every client polling ``/messages/?since=...``.
+
+Each community is one realtime channel (see ribbits.realtime), so a message
+is fanned out to all of its open sockets by a single publish. Membership is
+checked once, when the socket connects; leaving or being removed is
+published on the channel and closes that member's socket. Clients connect
+to ``/ws/communities/<slug>/?token=<access token>`` and receive:
+
+    {"type": "message", "message": {...same fields as the messages list...}}
+    {"type": "message_deleted", "id": 12}
+    {"type": "member_removed", "user_id": 7}
+
+Slow consumers get ``{"type": "resync"}`` and are disconnected (see
+ribbits.websockets); they refetch with ``since`` and reconnect.
+"""
+from asgiref.sync import sync_to_async
+from django.db import transaction
+
+from ribbits.realtime import get_broker
+from ribbits.websockets import connect_user, stream_events, close, CLOSE_FORBIDDEN
+
+from .models import Membership
+from .serializers import MessageSerializer
+
+COMMUNITY_CHAT_WS_PATH = r'/ws/communities/(?P<slug>[-\w]+)/'
+
+
+def community_channel(community_id):
+    return f'community:{community_id}'
+
+
+def publish(community_id, build_event):
+    """Publish ``build_event()`` to the community's sockets once the current transaction commits"""
+    channel = community_channel(community_id)
+
+    def send():
+        broker = get_broker()
+        if broker.has_subscribers(channel):
+            broker.publish(channel, build_event())
+
+    transaction.on_commit(send)
+
+
+def publish_message(message):
+    publish(message.community_id, lambda: {'type': 'message', 'message': MessageSerializer(message).data})
+
+
+def publish_message_deleted(community_id, message_id):
+    publish(community_id, lambda: {'type': 'message_deleted', 'id': message_id})
+
+
+def publish_member_removed(community_id, user_id):
+    publish(community_id, lambda: {'type': 'member_removed', 'user_id': int(user_id)})
+
+
+@sync_to_async
+def member_community_id(user, slug):
+    """Id of the community ``slug`` if ``user`` is a member of it, else None"""
+    return (
+        Membership.objects
+        .filter(user=user, community__slug=slug)
+        .values_list('community_id', flat=True)
+        .first()
+    )
+
+
+async def community_chat_websocket(scope, receive, send, slug):
+    """Stream a community's chat events to one of its members"""
+    user = await connect_user(scope, receive, send)
+    if user is None:
+        return
+    community_id = await member_community_id(user, slug)
+    if community_id is None:
+        await close(send, CLOSE_FORBIDDEN)
+        return
+    await send({'type': 'websocket.accept'})
+
+    def removes_me(event):
+        return event['type'] == 'member_removed' and event['user_id'] == user.id
+
+    await stream_events(receive, send, community_channel(community_id), ends=removes_me)
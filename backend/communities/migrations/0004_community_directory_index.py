@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communities', '0003_alter_message_media'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='community',
+            index=models.Index(fields=['-member_count', '-id'], name='communities_member__1a2c4a_idx'),
+        ),
+    ]
@@ -20,6 +20,10 @@ class Community(models.Model):
     class Meta:
         verbose_name_plural = "Communities"
         ordering = ['-created_at']
+        indexes = [
+            # Community directory, largest first
+            models.Index(fields=['-member_count', '-id']),
+        ]
 
     def __str__(self):
         return self.name
@@ -0,0 +1,220 @@
+"""
+Community Pagination
+Keyset pagination for the community directory and for community chat history.
+
+Directory pages are cut by ``(member_count, id)`` positions. Counts tie and
+move as people join and leave, so the id breaks ties and every page starts
+strictly after the last community already shown: a join or leave between
+pages never shifts the communities not yet seen.
+
+Chat history pages are cut by ``(created_at, id)`` positions instead of offsets, so every
+page is a range scan of the (community, created_at) index however far back
+the client has scrolled, and messages arriving meanwhile never shift a page.
+Cursors are opaque; ``next`` goes back in time and ``previous`` forward.
+
+``?at=<ISO 8601 timestamp>`` jumps into the history: the page holds the
+messages sent at or before that moment, newest first, with cursors to keep
+scrolling either way.
+"""
+import base64
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+OLDER = 'o'
+NEWER = 'n'
+
+
+def encode_position(direction, created_at, pk=None):
+    raw = f"{direction}:{created_at.isoformat()}:{'' if pk is None else pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_position(cursor):
+    """``(direction, created_at, pk)`` of a cursor; pk is None for a bare timestamp"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        direction, _, rest = raw.partition(':')
+        timestamp, _, pk = rest.rpartition(':')
+        created_at = parse_datetime(timestamp)
+        if direction not in (OLDER, NEWER) or created_at is None:
+            raise ValueError(cursor)
+        return direction, created_at, int(pk) if pk else None
+    except (ValueError, UnicodeDecodeError):
+        raise NotFound('Invalid cursor')
+
+
+def parse_timestamp(value):
+    try:
+        moment = parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ValidationError({'at': 'Enter a valid ISO 8601 timestamp.'})
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def encode_directory_position(direction, member_count, pk):
+    raw = f"{direction}:{member_count}:{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_directory_position(cursor):
+    """``(direction, member_count, pk)`` of a directory cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        direction, member_count, pk = raw.split(':')
+        if direction not in (OLDER, NEWER):
+            raise ValueError(cursor)
+        return direction, int(member_count), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise NotFound('Invalid cursor')
+
+
+class KeysetPagination(BasePagination):
+    """Response shape shared by the keyset paginators: ``next``, ``previous`` and ``results``"""
+    next_position = previous_position = None
+
+    def _link(self, position):
+        raise NotImplementedError
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self._link(self.next_position)),
+            ('previous', self._link(self.previous_position)),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class CommunityDirectoryPagination(KeysetPagination):
+    """
+    Largest communities first; ``next`` goes to smaller ones, ``previous``
+    back to larger ones
+    """
+    page_size = 20
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.next_position = self.previous_position = None
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return self._smaller(queryset, None)
+        direction, member_count, pk = decode_directory_position(cursor)
+        if direction == OLDER:
+            return self._smaller(queryset, (member_count, pk))
+        return self._larger(queryset, (member_count, pk))
+
+    def _smaller(self, queryset, position):
+        if position is not None:
+            member_count, pk = position
+            queryset = queryset.filter(Q(member_count__lt=member_count) | Q(member_count=member_count, id__lt=pk))
+        rows = list(queryset.order_by('-member_count', '-id')[:self.page_size + 1])
+        page = rows[:self.page_size]
+        if len(rows) > self.page_size:
+            self.next_position = (OLDER, page[-1].member_count, page[-1].id)
+        if position is not None:
+            self.previous_position = (NEWER, page[0].member_count, page[0].id) if page else (NEWER, *position)
+        return page
+
+    def _larger(self, queryset, position):
+        member_count, pk = position
+        queryset = queryset.filter(Q(member_count__gt=member_count) | Q(member_count=member_count, id__gt=pk))
+        rows = list(queryset.order_by('member_count', 'id')[:self.page_size + 1])
+        page = rows[:self.page_size][::-1]
+        if len(rows) > self.page_size:
+            self.previous_position = (NEWER, page[0].member_count, page[0].id)
+        self.next_position = (OLDER, page[-1].member_count, page[-1].id) if page else (OLDER, *position)
+        return page
+
+    def _link(self, position):
+        if position is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, encode_directory_position(*position))
+
+
+class MessageHistoryPagination(KeysetPagination):
+    page_size = 30
+    cursor_query_param = 'cursor'
+    at_query_param = 'at'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.next_position = self.previous_position = None
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        at = request.query_params.get(self.at_query_param)
+        if cursor:
+            direction, created_at, pk = decode_position(cursor)
+            position = (created_at, pk)
+        elif at:
+            # Inclusive of messages sent exactly at the requested moment
+            direction, position = OLDER, (parse_timestamp(at), None)
+        else:
+            direction, position = OLDER, None
+
+        if direction == OLDER:
+            return self._older(queryset, position)
+        return self._newer(queryset, position)
+
+    def _older(self, queryset, position):
+        if position is not None:
+            created_at, pk = position
+            if pk is None:
+                queryset = queryset.filter(created_at__lte=created_at)
+            else:
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        rows = list(queryset.order_by('-created_at', '-id')[:self.page_size + 1])
+        page = rows[:self.page_size]
+        if len(rows) > self.page_size:
+            self.next_position = (OLDER, page[-1].created_at, page[-1].id)
+        if position is not None:
+            # Started somewhere in the history, so newer messages may follow
+            self.previous_position = (NEWER, page[0].created_at, page[0].id) if page else (NEWER, *position)
+        return page
+
+    def _newer(self, queryset, position):
+        created_at, pk = position
+        if pk is None:
+            queryset = queryset.filter(created_at__gt=created_at)
+        else:
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        rows = list(queryset.order_by('created_at', 'id')[:self.page_size + 1])
+        page = rows[:self.page_size][::-1]
+        if len(rows) > self.page_size:
+            self.previous_position = (NEWER, page[0].created_at, page[0].id)
+        self.next_position = (OLDER, page[-1].created_at, page[-1].id) if page else (OLDER, *position)
+        return page
+
+    def _link(self, position):
+        if position is None:
+            return None
+        url = remove_query_param(self.base_url, self.at_query_param)
+        return replace_query_param(url, self.cursor_query_param, encode_position(*position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self._link(self.next_position)),
+            ('previous', self._link(self.previous_position)),
+            ('results', data),
+        ]))
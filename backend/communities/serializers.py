@@ -30,19 +30,45 @@ class CommunitySerializer(serializers.ModelSerializer):
                   'icon', 'member_count', 'is_member', 'user_role']
         read_only_fields = ['slug', 'creator', 'created_at', 'member_count']
 
-    def get_is_member(self, obj):
+    def _role(self, obj):
+        """
+        The requesting user's role in ``obj``, or None if they are not a member
+
+        Read from the ``membership_roles`` map the views fill for a whole page
+        (see membership_roles); communities missing from it are looked up once.
+        """
         request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Membership.objects.filter(user=request.user, community=obj).exists()
-        return False
+        if not (request and request.user.is_authenticated):
+            return None
+        roles = self.context.get('membership_roles')
+        if roles is None:
+            roles = self.context['membership_roles'] = {}
+        if obj.id not in roles:
+            roles[obj.id] = (
+                Membership.objects
+                .filter(user=request.user, community=obj)
+                .values_list('role', flat=True)
+                .first()
+            )
+        return roles[obj.id]
+
+    def get_is_member(self, obj):
+        return self._role(obj) is not None
 
     def get_user_role(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            membership = Membership.objects.filter(user=request.user, community=obj).first()
-            if membership:
-                return membership.role
-        return None
+        return self._role(obj)
+
+
+def membership_roles(user, communities):
+    """``{community id: role or None}`` for ``user`` over ``communities``, in one query"""
+    roles = {community.id: None for community in communities}
+    if roles and user.is_authenticated:
+        roles.update(
+            Membership.objects
+            .filter(user=user, community_id__in=list(roles))
+            .values_list('community_id', 'role')
+        )
+    return roles
 
 
 class MessageSerializer(serializers.ModelSerializer):
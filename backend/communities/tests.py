@@ -109,6 +109,76 @@ class CommunityListTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
+class CommunityDirectoryTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = get_auth_client(self.user)
+        owner = create_user(username="owner", email="owner@test.com")
+        self.communities = [
+            create_community(owner, name=f"Pond {i}", description="lily pads" if i % 2 else "reeds")
+            for i in range(6)
+        ]
+        for count, community in enumerate(self.communities):
+            Community.objects.filter(pk=community.pk).update(member_count=count + 1)
+        Membership.objects.create(user=self.user, community=self.communities[2], role="moderator")
+
+    def test_list_loads_memberships_once_per_page(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/communities/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 6)
+        # The page (with creators), then the user's memberships in it
+        self.assertEqual(len(queries), 2)
+        roles = {item["name"]: (item["is_member"], item["user_role"]) for item in response.data["results"]}
+        self.assertEqual(roles["Pond 2"], (True, "moderator"))
+        self.assertEqual(roles["Pond 3"], (False, None))
+
+    def test_directory_orders_by_size_and_searches(self):
+        response = self.client.get("/api/communities/directory/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [item["name"] for item in response.data["results"]]
+        self.assertEqual(names, [f"Pond {i}" for i in range(5, -1, -1)])
+
+        response = self.client.get("/api/communities/directory/", {"q": "lily"})
+        names = [item["name"] for item in response.data["results"]]
+        self.assertEqual(names, ["Pond 5", "Pond 3", "Pond 1"])
+
+    def test_directory_pages_through_ties_and_membership_changes(self):
+        from unittest import mock
+        from .pagination import CommunityDirectoryPagination
+        Community.objects.update(member_count=3)
+        seen = []
+        with mock.patch.object(CommunityDirectoryPagination, "page_size", 2):
+            response = self.client.get("/api/communities/directory/")
+            seen += [item["id"] for item in response.data["results"]]
+            self.assertEqual(seen, [c.pk for c in self.communities[::-1][:2]])
+
+            # Someone joins a community already shown and leaves one not yet shown
+            Community.objects.filter(pk=seen[0]).update(member_count=4)
+            Community.objects.filter(pk=self.communities[0].pk).update(member_count=2)
+            while response.data["next"]:
+                response = self.client.get(response.data["next"])
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                seen += [item["id"] for item in response.data["results"]]
+
+            previous = self.client.get(response.data["previous"])
+        self.assertEqual(seen, [c.pk for c in self.communities[::-1]])
+        self.assertEqual([item["id"] for item in previous.data["results"]], seen[-4:-2])
+
+    def test_directory_rejects_bad_cursor(self):
+        response = self.client.get("/api/communities/directory/", {"cursor": "bm9wZQ=="})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_directory_anonymous(self):
+        response = APIClient().get("/api/communities/directory/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any(item["is_member"] for item in response.data["results"]))
+
+
 # ---------------------------------------------------------------------------
 # Membership (Join / Leave) Tests
 # ---------------------------------------------------------------------------
@@ -236,6 +306,184 @@ class MessageTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+# ---------------------------------------------------------------------------
+# Message History Tests
+# ---------------------------------------------------------------------------
+class MessageHistoryTests(TestCase):
+
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        self.creator = create_user()
+        self.outsider = create_user(username="outsider", email="outsider@test.com")
+        self.community = create_community(self.creator)
+        self.start = timezone.now() - timedelta(days=1)
+        # Pairs of messages share a timestamp, so pages must break ties by id
+        self.messages = Message.objects.bulk_create([
+            Message(
+                community=self.community, sender=self.creator, content=f"Croak {i}",
+                created_at=self.start + timedelta(minutes=i // 2),
+            )
+            for i in range(7)
+        ])
+        self.client = get_auth_client(self.creator)
+        self.url = "/api/communities/messages/"
+
+    def page(self, url=None, **params):
+        from unittest import mock
+        from communities.pagination import MessageHistoryPagination
+
+        with mock.patch.object(MessageHistoryPagination, "page_size", 3):
+            if url:
+                response = self.client.get(url)
+            else:
+                response = self.client.get(self.url, {"community_slug": self.community.slug, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def contents(self, data):
+        return [message["content"] for message in data["results"]]
+
+    def test_pages_walk_back_and_forth_without_gaps(self):
+        first = self.page()
+        self.assertEqual(self.contents(first), ["Croak 6", "Croak 5", "Croak 4"])
+        self.assertIsNone(first["previous"])
+        second = self.page(first["next"])
+        self.assertEqual(self.contents(second), ["Croak 3", "Croak 2", "Croak 1"])
+        third = self.page(second["next"])
+        self.assertEqual(self.contents(third), ["Croak 0"])
+        self.assertIsNone(third["next"])
+
+        back = self.page(third["previous"])
+        self.assertEqual(self.contents(back), ["Croak 3", "Croak 2", "Croak 1"])
+        newest = self.page(back["previous"])
+        self.assertEqual(self.contents(newest), ["Croak 6", "Croak 5", "Croak 4"])
+        self.assertIsNone(newest["previous"])
+
+    def test_jump_to_timestamp(self):
+        from datetime import timedelta
+
+        data = self.page(at=(self.start + timedelta(minutes=1)).isoformat())
+        self.assertEqual(self.contents(data), ["Croak 3", "Croak 2", "Croak 1"])
+        self.assertEqual(self.contents(self.page(data["previous"])), ["Croak 6", "Croak 5", "Croak 4"])
+        self.assertEqual(self.contents(self.page(data["next"])), ["Croak 0"])
+
+    def test_invalid_timestamp_and_cursor(self):
+        response = self.client.get(self.url, {"community_slug": self.community.slug, "at": "yesterday"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {"community_slug": self.community.slug, "cursor": "bogus"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_queries_do_not_grow_with_senders(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        for i in range(5):
+            sender = create_user(username=f"talker{i}", email=f"talker{i}@test.com")
+            Membership.objects.create(user=sender, community=self.community)
+            Message.objects.create(community=self.community, sender=sender, content=f"Hi {i}")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {"community_slug": self.community.slug})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 12)
+        # Membership (with community), then the page with its senders
+        self.assertEqual(len(queries), 2)
+
+    def test_outsider_and_unknown_community(self):
+        client = get_auth_client(self.outsider)
+        response = client.get(self.url, {"community_slug": self.community.slug})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = client.get(self.url, {"community_slug": "no-such-pond"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+# ---------------------------------------------------------------------------
+# Community Chat Push Tests
+# ---------------------------------------------------------------------------
+class CommunityChatPushTests(TestCase):
+
+    def setUp(self):
+        from ribbits.realtime import reset_broker
+        reset_broker()
+        self.addCleanup(reset_broker)
+        self.creator = create_user()
+        self.member = create_user(username="member", email="member@test.com")
+        self.outsider = create_user(username="outsider", email="outsider@test.com")
+        self.community = create_community(self.creator)
+        Membership.objects.create(user=self.member, community=self.community, role="member")
+
+    async def _connect(self, user):
+        import asyncio
+        from rest_framework_simplejwt.tokens import AccessToken
+        from croak.asgi import application
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        scope = {
+            "type": "websocket",
+            "path": f"/ws/communities/{self.community.slug}/",
+            "query_string": f"token={AccessToken.for_user(user)}".encode(),
+            "headers": [],
+        }
+        task = asyncio.ensure_future(application(scope, inbox.get, outbox.put))
+        await inbox.put({"type": "websocket.connect"})
+        return task, inbox, outbox
+
+    async def _next(self, outbox):
+        import asyncio
+        import json
+        message = await asyncio.wait_for(outbox.get(), timeout=5)
+        if message["type"] == "websocket.send":
+            return json.loads(message["text"])
+        return message
+
+    def _as(self, user, method, url, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(get_auth_client(user), method)(url, data, format="json")
+
+    async def test_outsider_is_refused(self):
+        task, _, outbox = await self._connect(self.outsider)
+        self.assertEqual(await self._next(outbox), {"type": "websocket.close", "code": 4403})
+        await task
+
+    async def test_members_receive_messages_until_removed(self):
+        from asgiref.sync import sync_to_async
+        task, _, outbox = await self._connect(self.member)
+        self.assertEqual(await self._next(outbox), {"type": "websocket.accept"})
+
+        await sync_to_async(self._as)(
+            self.creator, "post", "/api/communities/messages/",
+            {"community": self.community.pk, "content": "Hello pond!"},
+        )
+        event = await self._next(outbox)
+        self.assertEqual(event["type"], "message")
+        self.assertEqual((event["message"]["content"], event["message"]["sender"]["username"]), ("Hello pond!", "comuser"))
+
+        await sync_to_async(self._as)(
+            self.creator, "post", "/api/communities/membership/remove_member/",
+            {"community_slug": self.community.slug, "user_id": self.member.id},
+        )
+        self.assertEqual(await self._next(outbox), {"type": "member_removed", "user_id": self.member.id})
+        self.assertEqual(await self._next(outbox), {"type": "websocket.close", "code": 1000})
+        await task
+
+    async def test_slow_consumer_is_told_to_resync(self):
+        from unittest import mock
+        from ribbits.realtime import get_broker
+        from .chat import community_channel
+        with mock.patch("ribbits.realtime.SUBSCRIPTION_QUEUE_SIZE", 2):
+            task, inbox, outbox = await self._connect(self.member)
+            self.assertEqual(await self._next(outbox), {"type": "websocket.accept"})
+            for i in range(5):
+                get_broker().publish(community_channel(self.community.id), {"type": "message_deleted", "id": i})
+            events = [await self._next(outbox)]
+            while events[-1]["type"] != "websocket.close":
+                events.append(await self._next(outbox))
+        # Whatever was buffered is delivered, then the client is cut off
+        self.assertLess(len(events), 5)
+        self.assertEqual(events[-2:], [{"type": "resync"}, {"type": "websocket.close", "code": 4008}])
+        await task
+
+
 # ---------------------------------------------------------------------------
 # Community Slug Auto-Generation Tests
 # ---------------------------------------------------------------------------
@@ -2,10 +2,31 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from django.db.models import F
+from django.db.models import F, Q
 from django.utils.dateparse import parse_datetime
 from .models import Community, Membership, Message
-from .serializers import CommunitySerializer, MessageSerializer, MembershipSerializer
+from .serializers import CommunitySerializer, MessageSerializer, MembershipSerializer, membership_roles
+from .chat import publish_message, publish_message_deleted, publish_member_removed
+from .pagination import CommunityDirectoryPagination, MessageHistoryPagination
+
+
+def request_membership(request, **community):
+    """
+    The request user's Membership (with its community) matching ``community``
+    lookups, e.g. ``community_id=3`` or ``community__slug='pond'``, or None
+
+    Queried once per request, so permissions and views can both ask.
+    """
+    memberships = request.__dict__.setdefault('_community_memberships', {})
+    key = tuple(sorted(community.items()))
+    if key not in memberships:
+        memberships[key] = (
+            Membership.objects
+            .filter(user=request.user, **community)
+            .select_related('community')
+            .first()
+        )
+    return memberships[key]
 
 
 class IsMemberPermission(permissions.BasePermission):
@@ -19,18 +40,44 @@ class IsMemberPermission(permissions.BasePermission):
         if request.method == 'POST':
             community_id = request.data.get('community')
             if community_id:
-                return Membership.objects.filter(
-                    user=request.user,
-                    community_id=community_id
-                ).exists()
+                return request_membership(request, community_id=community_id) is not None
         return True
 
 
 class CommunityViewSet(viewsets.ModelViewSet):
-    queryset = Community.objects.all()
+    queryset = Community.objects.select_related('creator')
     serializer_class = CommunitySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     lookup_field = 'slug'
+    membership_roles = None
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.membership_roles is not None:
+            context['membership_roles'] = self.membership_roles
+        return context
+
+    def list_page(self, queryset):
+        """Paginated response for ``queryset``, with the user's memberships for the page loaded in one query"""
+        page = self.paginate_queryset(queryset)
+        communities = page if page is not None else list(queryset)
+        self.membership_roles = membership_roles(self.request.user, communities)
+        serializer = self.get_serializer(communities, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    def list(self, request, *args, **kwargs):
+        return self.list_page(self.filter_queryset(self.get_queryset()))
+
+    @action(detail=False, methods=['get'], pagination_class=CommunityDirectoryPagination)
+    def directory(self, request):
+        """Browse communities, largest first, optionally matching ``?q=`` against name and description"""
+        queryset = self.get_queryset()
+        query = request.query_params.get('q', '').strip()
+        if query:
+            queryset = queryset.filter(Q(name__icontains=query) | Q(description__icontains=query))
+        return self.list_page(queryset)
 
     def perform_create(self, serializer):
         # Create community and automatically add creator as admin member
@@ -132,6 +179,7 @@ class MembershipViewSet(viewsets.GenericViewSet):
         # Get membership
         membership = get_object_or_404(Membership, user=request.user, community=community)
         membership.delete()
+        publish_member_removed(community.id, request.user.id)
 
         # Decrement member count
         Community.objects.filter(id=community.id).update(member_count=F('member_count') - 1)
@@ -170,6 +218,7 @@ class MembershipViewSet(viewsets.GenericViewSet):
         # Get target membership
         target_membership = get_object_or_404(Membership, user_id=user_id, community=community)
         target_membership.delete()
+        publish_member_removed(community.id, user_id)
 
         # Decrement member count
         Community.objects.filter(id=community.id).update(member_count=F('member_count') - 1)
@@ -179,12 +228,16 @@ class MembershipViewSet(viewsets.GenericViewSet):
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated, IsMemberPermission]
+    pagination_class = MessageHistoryPagination
+    community = None
 
     def get_queryset(self):
         """Filter messages by community and optionally by timestamp, ordered newest first."""
-        queryset = Message.objects.all()
+        queryset = Message.objects.select_related('sender')
         community_slug = self.request.query_params.get('community_slug')
-        if community_slug:
+        if self.community is not None:
+            queryset = queryset.filter(community_id=self.community.id)
+        elif community_slug:
             queryset = queryset.filter(community__slug=community_slug)
         since = self.request.query_params.get('since')
         if since:
@@ -194,26 +247,34 @@ class MessageViewSet(viewsets.ModelViewSet):
                     queryset = queryset.filter(created_at__gt=since_datetime)
             except (ValueError, TypeError):
                 pass
-        return queryset.order_by('-created_at')
+        return queryset.order_by('-created_at', '-id')
 
     def perform_create(self, serializer):
-        """Create a message and set sender to current user."""
-        serializer.save(sender=self.request.user)
+        """Create a message, set sender to current user and push it to connected members."""
+        message = serializer.save(sender=self.request.user)
+        publish_message(message)
 
     def list(self, request, *args, **kwargs):
-        """List messages with required community_slug parameter and membership check."""
+        """
+        List messages with required community_slug parameter and membership check.
+
+        Pages are keyset-paginated newest first; ``at=<timestamp>`` jumps back to
+        the messages sent at or before that moment (see MessageHistoryPagination).
+        """
         community_slug = request.query_params.get('community_slug')
         if not community_slug:
             return Response(
                 {'error': 'community_slug query parameter is required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        community = get_object_or_404(Community, slug=community_slug)
-        if not Membership.objects.filter(user=request.user, community=community).exists():
+        membership = request_membership(request, community__slug=community_slug)
+        if membership is None:
+            get_object_or_404(Community, slug=community_slug)
             return Response(
                 {'error': 'You must be a member to view messages'},
                 status=status.HTTP_403_FORBIDDEN
             )
+        self.community = membership.community
         return super().list(request, *args, **kwargs)
 
     def destroy(self, request, *args, **kwargs):
@@ -222,14 +283,16 @@ class MessageViewSet(viewsets.ModelViewSet):
         
         # Check permissions: must be sender, or be an admin of the community
         is_sender = (message.sender_id == request.user.id)
-        try:
-            membership = Membership.objects.get(user=request.user, community=message.community)
-            is_admin = (membership.role == 'admin' or message.community.creator_id == request.user.id)
-        except Membership.DoesNotExist:
-            is_admin = False
+        membership = request_membership(request, community_id=message.community_id)
+        is_admin = membership is not None and (
+            membership.role == 'admin' or membership.community.creator_id == request.user.id
+        )
 
         if is_sender or is_admin:
-            return super().destroy(request, *args, **kwargs)
+            community_id, message_id = message.community_id, message.id
+            response = super().destroy(request, *args, **kwargs)
+            publish_message_deleted(community_id, message_id)
+            return response
             
         return Response(
             {'error': 'You do not have permission to delete this message'},
@@ -2,6 +2,9 @@
 ASGI config for croak project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Websocket connections (realtime notifications and community chat, see
+ribbits.websockets and communities.chat) are routed before Django, which
+handles everything else.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +16,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'croak.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after setup so the app registry is ready
+from ribbits.websockets import websocket_router, notifications_websocket, NOTIFICATIONS_WS_PATH  # noqa: E402
+from communities.chat import community_chat_websocket, COMMUNITY_CHAT_WS_PATH  # noqa: E402
+
+application = websocket_router(django_application, [
+    (NOTIFICATIONS_WS_PATH, notifications_websocket),
+    (COMMUNITY_CHAT_WS_PATH, community_chat_websocket),
+])
@@ -83,6 +83,12 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'croak.wsgi.application'
+# Serves the realtime notification websocket as well as the API
+ASGI_APPLICATION = 'croak.asgi.application'
+
+# Carries realtime events to websocket connections; the in-memory broker only
+# reaches connections on the same process (see ribbits.realtime)
+REALTIME_BROKER = os.getenv("REALTIME_BROKER", "ribbits.realtime.InMemoryBroker")
 
 
 # Database
@@ -220,3 +226,20 @@ DEFAULT_FROM_EMAIL = "sinhapunit323@gmail.com"
 
 # Notifications Service
 NOTIFICATIONS_SERVICE_URL = os.getenv("NOTIFICATIONS_SERVICE_URL", "https://croak-notifications.vercel.app")
+# Stop sending to the service for a cooldown after this many consecutive errors (ribbits.circuit_breaker)
+NOTIFICATIONS_CIRCUIT_THRESHOLD = int(os.getenv("NOTIFICATIONS_CIRCUIT_THRESHOLD", "5"))
+NOTIFICATIONS_CIRCUIT_COOLDOWN = int(os.getenv("NOTIFICATIONS_CIRCUIT_COOLDOWN", "60"))
+
+# Likes/comments/follows for the same recipient and post within this many seconds share one email
+EMAIL_COALESCE_WINDOW = int(os.getenv("EMAIL_COALESCE_WINDOW", "300"))
+
+# Queued email bodies (ribbits.email_bodies) are zlib-compressed above a small size
+EMAIL_BODY_COMPRESSION = os.getenv("EMAIL_BODY_COMPRESSION", "true").lower() == "true"
+
+# Deferred tasks (ribbits.tasks) run inline under the test runner
+DEFERRED_TASKS_INLINE = TESTING
+
+# Home timeline fan-out
+# Authors above this follower count are merged into timelines at read time instead of fanned out on write
+TIMELINE_FANOUT_MAX_FOLLOWERS = int(os.getenv("TIMELINE_FANOUT_MAX_FOLLOWERS", "5000"))
+TIMELINE_MERGE_WINDOW_DAYS = 7
@@ -0,0 +1,98 @@
+"""
+Circuit Breaker for the Notification Service
+Stops sending to a service host after repeated server errors.
+
+After NOTIFICATIONS_CIRCUIT_THRESHOLD consecutive 5xx responses or
+connection errors from a host, its circuit opens and sends are skipped for
+NOTIFICATIONS_CIRCUIT_COOLDOWN seconds. When the cooldown is over, one probe
+request goes through: success closes the circuit, failure opens it again.
+State is per process, like the bulk-route probe in notifications_client.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+DEFAULT_THRESHOLD = 5
+DEFAULT_COOLDOWN_SECONDS = 60
+
+CIRCUIT_OPEN_ERROR = "Circuit open"
+
+
+class CircuitBreaker:
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, cooldown=DEFAULT_COOLDOWN_SECONDS):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """True while sends should be held back (the probe slot is not taken)"""
+        with self._lock:
+            return self.opened_at is not None and (
+                self.probing or time.monotonic() - self.opened_at < self.cooldown
+            )
+
+    def retry_after(self):
+        """Seconds until the next probe is allowed (0 when closed)"""
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def allow(self):
+        """Whether a request may go out now; takes the probe slot when half-open"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def record_response(self, status_code):
+        """Count 5xx as failures; any other answer means the service is up"""
+        if status_code >= 500:
+            self.record_failure()
+        else:
+            self.record_success()
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def breaker_for(url):
+    """The circuit breaker for a service URL's host"""
+    host = urlsplit(url).netloc
+    with _lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                threshold=getattr(settings, 'NOTIFICATIONS_CIRCUIT_THRESHOLD', DEFAULT_THRESHOLD),
+                cooldown=getattr(settings, 'NOTIFICATIONS_CIRCUIT_COOLDOWN', DEFAULT_COOLDOWN_SECONDS),
+            )
+            _breakers[host] = breaker
+        return breaker
+
+
+def reset_breakers():
+    with _lock:
+        _breakers.clear()
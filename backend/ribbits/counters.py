@@ -0,0 +1,99 @@
+"""
+Denormalized Ribbit Counters
+Keeps Ribbit.like_count / Ribbit.comment_count in step with the Like and
+Comment tables, and repairs drift in batches.
+
+Counters are adjusted where likes and comments are added and removed
+(signals on create, likes.toggle_like and the comment delete view on
+removal) rather than from post_delete receivers, so cascades stay
+fast deletes: a deleted ribbit takes its likes and comments along without
+loading them, and a deleted user's likes and comments are subtracted in
+one grouped UPDATE per counter (release_user_counters).
+"""
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from .models import Ribbit, Like, Comment
+
+
+def adjust_ribbit_counter(ribbit_id, field, delta):
+    """Atomically add ``delta`` to a counter column, never going below zero"""
+    if delta >= 0:
+        expression = F(field) + delta
+    else:
+        expression = Greatest(F(field) + delta, Value(0))
+    Ribbit.objects.filter(pk=ribbit_id).update(**{field: expression})
+
+
+def release_user_counters(user):
+    """Subtract ``user``'s likes and comments from the counters of other people's ribbits, before the user is deleted"""
+    for model, user_field, field in ((Like, 'user', 'like_count'), (Comment, 'author', 'comment_count')):
+        owned = model.objects.filter(**{user_field: user})
+        counts = (
+            owned
+            .filter(ribbit=OuterRef('pk'))
+            .order_by()
+            .values('ribbit')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+        # The user's own ribbits go away with them, so their counters are left alone
+        (
+            Ribbit.objects
+            .filter(pk__in=owned.values('ribbit_id'))
+            .exclude(author=user)
+            .update(**{field: Greatest(F(field) - Subquery(counts), Value(0))})
+        )
+
+
+def _count_subquery(model):
+    counts = (
+        model.objects
+        .filter(ribbit=OuterRef('pk'))
+        .order_by()
+        .values('ribbit')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def recount_ribbit_counters(batch_size=1000, start_id=None, on_batch=None):
+    """
+    Recompute like/comment counters and fix rows that drifted
+
+    Walks the ribbit table in primary-key ranges of ``batch_size`` so each
+    statement only touches a bounded slice. Returns the number of rows fixed.
+    """
+    ribbits = Ribbit.objects.order_by('id')
+    if start_id is not None:
+        ribbits = ribbits.filter(id__gte=start_id)
+
+    fixed = 0
+    last_id = None
+    while True:
+        batch = ribbits if last_id is None else ribbits.filter(id__gt=last_id)
+        ids = list(batch.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        drifted = list(
+            Ribbit.objects
+            .filter(id__gte=ids[0], id__lte=last_id)
+            .annotate(
+                actual_likes=_count_subquery(Like),
+                actual_comments=_count_subquery(Comment),
+            )
+            .exclude(like_count=F('actual_likes'), comment_count=F('actual_comments'))
+            .only('id', 'like_count', 'comment_count')
+        )
+        for ribbit in drifted:
+            ribbit.like_count = ribbit.actual_likes
+            ribbit.comment_count = ribbit.actual_comments
+        Ribbit.objects.bulk_update(drifted, ['like_count', 'comment_count'])
+        fixed += len(drifted)
+
+        if on_batch:
+            on_batch(last_id, len(drifted))
+
+    return fixed
@@ -6,18 +6,12 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from django.conf import settings
-from ribbits.email_queue import get_pending_emails, send_email_via_service
-from ribbits.models import EmailPreferences, EmailQueue
-from django.contrib.auth import get_user_model
+from ribbits.email_worker import process_queue_batch
+from ribbits.digests import queue_daily_digests
+from ribbits.models import EmailQueue, EmailDeadLetter
 from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Count
-from ribbits.models import Ribbit, Like, Comment
-from ribbits.email_queue import queue_daily_digest
 import os
 
-User = get_user_model()
-
 
 def verify_cron_secret(request):
     """Verify the cron secret to prevent unauthorized access"""
@@ -40,38 +34,26 @@ def process_email_queue_endpoint(request):
         return Response({'error': 'Unauthorized'}, status=403)
     
     try:
-        # Get pending emails
-        pending_emails = get_pending_emails(limit=100)
-        total = len(pending_emails)
+        # Claim and send one batch; safe to run alongside run_email_worker
+        result = process_queue_batch(batch_size=100)
         
-        if total == 0:
+        if result.claimed == 0:
             return Response({
                 'status': 'success',
                 'message': 'No pending emails',
                 'sent': 0,
-                'failed': 0
+                'failed': 0,
+                'reclaimed': result.reclaimed,
+                'paused': result.paused
             })
         
-        # Process emails
-        sent_count = 0
-        failed_count = 0
-        
-        for email in pending_emails:
-            try:
-                success = send_email_via_service(email)
-                if success:
-                    sent_count += 1
-                else:
-                    failed_count += 1
-            except Exception as e:
-                failed_count += 1
-                print(f"Error sending email {email.id}: {str(e)}")
-        
         return Response({
             'status': 'success',
-            'total_processed': total,
-            'sent': sent_count,
-            'failed': failed_count,
+            'total_processed': result.claimed,
+            'sent': result.sent,
+            'failed': result.failed,
+            'deferred': result.deferred,
+            'reclaimed': result.reclaimed,
             'timestamp': timezone.now().isoformat()
         })
         
@@ -87,7 +69,8 @@ def process_email_queue_endpoint(request):
 def send_daily_digests_endpoint(request):
     """
     Generate and queue daily digest emails
-    Called by cron job once per day (e.g., 9 AM)
+    Called by cron job every hour; each run queues the users whose local
+    digest time falls in the coming hour
     
     Usage:
     POST /api/ribbit/cron/daily-digest?secret=YOUR_SECRET
@@ -96,81 +79,13 @@ def send_daily_digests_endpoint(request):
         return Response({'error': 'Unauthorized'}, status=403)
     
     try:
-        # Get users who want daily digests
-        users = User.objects.filter(
-            email_preferences__daily_digest=True,
-            email_preferences__email_enabled=True
-        ).exclude(email='')
-        
-        total_users = users.count()
-        queued_count = 0
-        skipped_count = 0
-        
-        # Yesterday's date range
-        yesterday = timezone.now() - timedelta(days=1)
-        yesterday_start = yesterday.replace(hour=0, minute=0, second=0, microsecond=0)
-        yesterday_end = yesterday.replace(hour=23, minute=59, second=59, microsecond=999999)
-        
-        for user in users:
-            try:
-                # Get user's stats from yesterday
-                new_followers = user.followers.filter(
-                    created_at__gte=yesterday_start,
-                    created_at__lte=yesterday_end
-                ).count() if hasattr(user, 'followers') else 0
-                
-                total_likes = Like.objects.filter(
-                    ribbit__author=user,
-                    created_at__gte=yesterday_start,
-                    created_at__lte=yesterday_end
-                ).count()
-                
-                total_comments = Comment.objects.filter(
-                    ribbit__author=user,
-                    created_at__gte=yesterday_start,
-                    created_at__lte=yesterday_end
-                ).count()
-                
-                # Trending posts
-                trending_posts = Ribbit.objects.filter(
-                    created_at__gte=yesterday_start,
-                    created_at__lte=yesterday_end
-                ).annotate(
-                    engagement=Count('likes') + Count('comments')
-                ).order_by('-engagement')[:3]
-                
-                trending_posts_data = [
-                    {
-                        'author': post.author.username,
-                        'text': post.text,
-                        'likes': post.likes.count(),
-                        'comments': post.comments.count(),
-                    }
-                    for post in trending_posts
-                ]
-                
-                digest_data = {
-                    'new_followers': new_followers,
-                    'total_likes': total_likes,
-                    'total_comments': total_comments,
-                    'trending_posts': trending_posts_data,
-                }
-                
-                # Only send if there's activity
-                if (new_followers > 0 or total_likes > 0 or total_comments > 0 or len(trending_posts_data) > 0):
-                    queue_daily_digest(user, digest_data)
-                    queued_count += 1
-                else:
-                    skipped_count += 1
-                    
-            except Exception as e:
-                print(f"Error for user {user.username}: {str(e)}")
+        result = queue_daily_digests()
         
         return Response({
             'status': 'success',
-            'total_users': total_users,
-            'queued': queued_count,
-            'skipped': skipped_count,
+            'total_users': result.total_users,
+            'queued': result.queued,
+            'skipped': result.skipped,
             'timestamp': timezone.now().isoformat()
         })
         
@@ -197,6 +112,7 @@ def email_queue_stats(request):
         pending = EmailQueue.objects.filter(status='pending').count()
         processing = EmailQueue.objects.filter(status='processing').count()
         failed = EmailQueue.objects.filter(status='failed').count()
+        dead_letters = EmailDeadLetter.objects.count()
         
         # Sent today
         today = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -209,6 +125,7 @@ def email_queue_stats(request):
             'pending': pending,
             'processing': processing,
             'failed': failed,
+            'dead_letters': dead_letters,
             'sent_today': sent_today,
             'timestamp': timezone.now().isoformat()
         })
@@ -0,0 +1,83 @@
+"""
+Dead-Letter Queue for Emails
+Emails that fail every send attempt are moved out of EmailQueue into
+EmailDeadLetter, where they can be inspected and replayed.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailQueue, EmailDeadLetter
+
+REPLAY_BATCH_SIZE = 1000
+
+DEAD_LETTER_FIELDS = [
+    'id', 'recipient_id', 'email_type', 'subject', 'body_id', 'body_vars',
+    'body_html', 'body_text', 'event_count', 'priority', 'retry_count', 'created_at',
+]
+
+
+def move_to_dead_letters(errors, now=None, queryset=None):
+    """
+    Move emails to the dead-letter table, counting this last failure
+
+    Args:
+        errors: dict of email id -> error message
+        queryset: EmailQueue rows the move is limited to (e.g. those still
+            claimed by the calling worker); rows are locked while they move
+    """
+    if not errors:
+        return 0
+    now = now or timezone.now()
+    queryset = EmailQueue.objects.all() if queryset is None else queryset
+    with transaction.atomic():
+        rows = list(queryset.filter(id__in=list(errors)).select_for_update().values(*DEAD_LETTER_FIELDS))
+        EmailDeadLetter.objects.bulk_create(
+            [
+                EmailDeadLetter(
+                    **dict(row, retry_count=row['retry_count'] + 1),
+                    error_message=errors[row['id']] or '',
+                    failed_at=now,
+                )
+                for row in rows
+            ],
+            ignore_conflicts=True,
+        )
+        EmailQueue.objects.filter(id__in=[row['id'] for row in rows]).delete()
+    return len(rows)
+
+
+def replay_dead_letters(dead_letters, batch_size=REPLAY_BATCH_SIZE, now=None):
+    """
+    Queue dead letters again with fresh attempts and remove them from the dead-letter table
+
+    Args:
+        dead_letters: EmailDeadLetter queryset to replay
+        batch_size: rows moved per transaction
+    """
+    now = now or timezone.now()
+    replayed = 0
+    while True:
+        with transaction.atomic():
+            batch = list(dead_letters.order_by('id')[:batch_size])
+            if not batch:
+                break
+            EmailQueue.objects.bulk_create([
+                EmailQueue(
+                    recipient_id=letter.recipient_id,
+                    email_type=letter.email_type,
+                    subject=letter.subject,
+                    body_id=letter.body_id,
+                    body_vars=letter.body_vars,
+                    body_html=letter.body_html,
+                    body_text=letter.body_text,
+                    event_count=letter.event_count,
+                    priority=letter.priority,
+                    scheduled_for=now,
+                )
+                for letter in batch
+            ])
+            EmailDeadLetter.objects.filter(id__in=[letter.id for letter in batch]).delete()
+        replayed += len(batch)
+        if len(batch) < batch_size:
+            break
+    return replayed
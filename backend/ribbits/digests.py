@@ -0,0 +1,315 @@
+"""
+Daily Digest Generation
+Builds and queues digest emails for opted-in users in a handful of
+set-based queries.
+
+Digests are scheduled in each recipient's own timezone. Users are bucketed
+by their (timezone, digest_time) preference; every run (hourly) only handles
+the buckets whose local digest time falls in the coming window, and sends
+within a bucket are spread across DIGEST_SPREAD_SECONDS so the queue worker
+and notification service see a steady trickle instead of one spike.
+Users who already have a daily email for the slot are skipped, so a rerun
+of the same hour (a retried cron, an overlapping run) queues nothing twice.
+
+Per-user stats (new followers, likes and comments received) come from one
+grouped aggregate per stat for a whole chunk of recipients, trending posts
+are computed once per run, and each chunk of emails is written with a single
+bulk insert.
+"""
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_time
+
+from .email_queue import generate_digest_email, next_digest_slot, RECIPIENT_NAME_SLOT
+from .email_bodies import store_bodies
+from .models import Ribbit, Like, Comment, EmailQueue, EmailHistory, EmailPreferences
+
+User = get_user_model()
+
+DIGEST_CHUNK_SIZE = 1000
+DIGEST_WINDOW = timedelta(hours=1)
+DIGEST_SPREAD_SECONDS = 3600
+TRENDING_POSTS_LIMIT = 3
+# A daily email scheduled this soon before a run's window means the user
+# already has today's; yesterday's is always further back, DST and spread included
+DIGEST_REPEAT_GUARD = timedelta(hours=20)
+
+# Users who never changed a setting have no EmailPreferences row and get the model defaults
+DEFAULT_BUCKET = (
+    EmailPreferences._meta.get_field('timezone').default,
+    parse_time(EmailPreferences._meta.get_field('digest_time').default),
+)
+
+
+@dataclass
+class DigestRunResult:
+    total_users: int = 0
+    queued: int = 0
+    skipped: int = 0
+
+
+def get_run_window(now=None, window=DIGEST_WINDOW):
+    """The slot window a run is responsible for, starting at the top of the hour"""
+    start = (now or timezone.now()).replace(minute=0, second=0, microsecond=0)
+    return start, start + window
+
+
+def get_digest_window(window_start):
+    """The 24 hours a digest sent in this run reports on"""
+    return window_start - timedelta(days=1), window_start
+
+
+def get_due_buckets(window_start, window_end):
+    """
+    Digest buckets whose next local digest time falls in ``[window_start, window_end)``
+
+    Returns a dict of ``(timezone, digest_time)`` -> slot (UTC). One query
+    over the distinct preference pairs, however many users share them. The
+    default bucket is always considered, since users without a preferences
+    row belong to it.
+    """
+    buckets = (
+        EmailPreferences.objects
+        .filter(daily_digest=True, email_enabled=True)
+        .order_by()
+        .values_list('timezone', 'digest_time')
+        .distinct()
+    )
+    due = {}
+    for tz_name, digest_time in {DEFAULT_BUCKET, *buckets}:
+        slot = next_digest_slot(digest_time, tz_name, after=window_start)
+        if slot < window_end:
+            due[(tz_name, digest_time)] = slot
+    return due
+
+
+def bucket_filter(buckets, prefix='email_preferences__'):
+    """
+    Q matching users (or, with ``prefix=''``, preferences) in any of ``buckets``
+
+    Users without a preferences row match the default bucket.
+    """
+    condition = Q(pk__in=[])
+    for tz_name, digest_time in buckets:
+        condition |= Q(**{f'{prefix}timezone': tz_name, f'{prefix}digest_time': digest_time})
+    if prefix and DEFAULT_BUCKET in buckets:
+        condition |= Q(**{f'{prefix}isnull': True})
+    return condition
+
+
+def user_bucket(tz_name, digest_time):
+    """Bucket of a recipient row; no preferences row means the default bucket"""
+    if tz_name is None:
+        return DEFAULT_BUCKET
+    return tz_name, digest_time
+
+
+def already_emailed(window_start):
+    """
+    Q matching users who already have a daily email (digest or reminder) for the run starting at ``window_start``
+
+    Looks at queued rows by their scheduled time and at archived ones by
+    their send time.
+    """
+    since = window_start - DIGEST_REPEAT_GUARD
+    queued = EmailQueue.objects.filter(email_type='digest', scheduled_for__gte=since)
+    archived = EmailHistory.objects.filter(email_type='digest', sent_at__gte=since)
+    return Q(id__in=queued.values('recipient_id')) | Q(id__in=archived.values('recipient_id'))
+
+
+def spread_offset(user_id, spread_seconds=DIGEST_SPREAD_SECONDS):
+    """Stable per-user delay that spreads a bucket evenly over ``spread_seconds``"""
+    if spread_seconds <= 0:
+        return timedelta(0)
+    # Knuth multiplicative hash so consecutive ids don't land in consecutive seconds
+    return timedelta(seconds=(user_id * 2654435761) % spread_seconds)
+
+
+def digest_recipients(usernames=None):
+    """Users opted in to daily digests (the default) who have an email address"""
+    users = User.objects.filter(
+        Q(email_preferences__isnull=True) |
+        Q(email_preferences__daily_digest=True, email_preferences__email_enabled=True)
+    ).exclude(email='')
+    if usernames:
+        users = users.filter(username__in=usernames)
+    return users
+
+
+def get_trending_posts(start_date, end_date, limit=TRENDING_POSTS_LIMIT):
+    """Top posts created in the window, ranked by the denormalized counters"""
+    posts = (
+        Ribbit.objects
+        .filter(created_at__gte=start_date, created_at__lt=end_date)
+        .order_by((F('like_count') + F('comment_count')).desc(), '-created_at')
+        .values('author__username', 'text', 'like_count', 'comment_count')[:limit]
+    )
+    return [
+        {
+            'author': post['author__username'],
+            'text': post['text'],
+            'likes': post['like_count'],
+            'comments': post['comment_count'],
+        }
+        for post in posts
+    ]
+
+
+def _counts_by(queryset, key):
+    return dict(
+        queryset
+        .order_by()
+        .values(key)
+        .annotate(total=Count('id'))
+        .values_list(key, 'total')
+    )
+
+
+def get_digest_stats(user_ids, start_date, end_date):
+    """
+    Per-user digest stats for ``user_ids`` with one grouped query per stat
+
+    Returns a dict of user id -> ``(new_followers, total_likes, total_comments)``.
+    Users with no activity are absent.
+    """
+    followers = _counts_by(
+        User.following.through.objects.filter(
+            to_user_id__in=user_ids,
+            created_at__gte=start_date,
+            created_at__lt=end_date,
+        ),
+        'to_user_id',
+    )
+    likes = _counts_by(
+        Like.objects.filter(
+            ribbit__author_id__in=user_ids,
+            created_at__gte=start_date,
+            created_at__lt=end_date,
+        ),
+        'ribbit__author_id',
+    )
+    comments = _counts_by(
+        Comment.objects.filter(
+            ribbit__author_id__in=user_ids,
+            created_at__gte=start_date,
+            created_at__lt=end_date,
+        ),
+        'ribbit__author_id',
+    )
+    return {
+        user_id: (followers.get(user_id, 0), likes.get(user_id, 0), comments.get(user_id, 0))
+        for user_id in set(followers) | set(likes) | set(comments)
+    }
+
+
+def has_activity(digest_data):
+    """Check if there's any activity worth sending a digest for"""
+    return (
+        digest_data['new_followers'] > 0 or
+        digest_data['total_likes'] > 0 or
+        digest_data['total_comments'] > 0 or
+        len(digest_data['trending_posts']) > 0
+    )
+
+
+def queue_daily_digests(usernames=None, now=None, window=DIGEST_WINDOW,
+                        spread_seconds=DIGEST_SPREAD_SECONDS, chunk_size=DIGEST_CHUNK_SIZE,
+                        on_chunk=None):
+    """
+    Generate and queue digest emails for the users whose local digest time is coming up
+
+    Only buckets due in the run window are generated (see get_due_buckets),
+    and users who already have a daily email for it are left out.
+    Recipients are streamed in id order, ``chunk_size`` at a time. Each chunk
+    costs one query for the recipients, three grouped aggregates for their
+    stats, a bulk store of the distinct bodies and one bulk insert; trending
+    posts are fetched once per run.
+
+    Args:
+        usernames: optional list restricting the run to these users; they are
+            queued for their next local digest time regardless of the window
+        now: reference time (defaults to timezone.now())
+        window: how far ahead of the top of the hour this run covers
+        spread_seconds: sends in a bucket are spread over this many seconds
+        chunk_size: number of recipients handled per batch
+        on_chunk: optional callback receiving the running DigestRunResult
+    """
+    now = now or timezone.now()
+    window_start, window_end = get_run_window(now, window)
+    start_date, end_date = get_digest_window(window_start)
+
+    recipients = digest_recipients(usernames).exclude(already_emailed(window_start))
+    if usernames:
+        due = None
+    else:
+        due = get_due_buckets(window_start, window_end)
+        if not due:
+            return DigestRunResult()
+        recipients = recipients.filter(bucket_filter(due))
+    recipients = recipients.order_by('id').values_list(
+        'id', 'first_name', 'username',
+        'email_preferences__timezone', 'email_preferences__digest_time'
+    )
+
+    trending_posts = get_trending_posts(start_date, end_date)
+
+    result = DigestRunResult()
+    last_id = 0
+
+    while True:
+        chunk = list(recipients.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        result.total_users += len(chunk)
+
+        stats = get_digest_stats([row[0] for row in chunk], start_date, end_date)
+
+        emails = []
+        contents = []
+        for user_id, first_name, username, tz_name, digest_time in chunk:
+            tz_name, digest_time = user_bucket(tz_name, digest_time)
+            new_followers, total_likes, total_comments = stats.get(user_id, (0, 0, 0))
+            digest_data = {
+                'new_followers': new_followers,
+                'total_likes': total_likes,
+                'total_comments': total_comments,
+                'trending_posts': trending_posts,
+            }
+            if not has_activity(digest_data):
+                result.skipped += 1
+                continue
+
+            # Render with a name slot so users with the same stats share one stored body
+            recipient = User(id=user_id, first_name=RECIPIENT_NAME_SLOT)
+            subject, html_body, text_body = generate_digest_email(digest_data, recipient)
+            contents.append((html_body, text_body))
+
+            if due is None:
+                slot = next_digest_slot(digest_time, tz_name, after=now)
+            else:
+                slot = due[(tz_name, digest_time)]
+            scheduled_time = slot + spread_offset(user_id, spread_seconds)
+
+            emails.append(EmailQueue(
+                recipient_id=user_id,
+                email_type='digest',
+                subject=subject,
+                body_vars={'recipient_name': first_name or username},
+                priority=5,  # Lower priority for digests
+                scheduled_for=scheduled_time
+            ))
+
+        for email, body in zip(emails, store_bodies(contents)):
+            email.body = body
+        EmailQueue.objects.bulk_create(emails)
+        result.queued += len(emails)
+
+        if on_chunk:
+            on_chunk(result)
+
+    return result
@@ -0,0 +1,209 @@
+"""
+Email Body Store
+Content-addressed storage for queued email bodies.
+
+Emails that only differ by a few per-recipient values (the same new post
+going to every follower, the same reminder text) are rendered once with
+slots in place of those values. The rendered html/text is stored once in
+EmailBody, keyed by its sha256, and every EmailQueue row points at it with
+its own values in ``body_vars``. The values are merged back in at send time.
+
+Coalesced notifications keep their first actor in ``body_vars['actors']``;
+the "Alice and N others" phrase is built from ``event_count`` at send time,
+so merging another event into a pending row only bumps a counter.
+
+Unused bodies are collected in primary-key batches. Each batch's DELETE
+repeats the "old and unreferenced" conditions itself, so a body that
+store_body() reused after the scan (and touched, see _touch) survives.
+"""
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .email_templates import describe_actors
+from .models import EmailBody, EmailQueue, EmailDeadLetter
+
+COMPRESS_MIN_BYTES = 512
+BODY_GC_GRACE = timedelta(hours=1)
+BODY_GC_BATCH_SIZE = 1000
+DECODED_CACHE_SIZE = 256
+
+_decoded = OrderedDict()
+_lock = threading.Lock()
+
+
+def body_slot(name):
+    """Marker left in a shared body where ``body_vars[name]`` goes"""
+    return f"\x1a{name}\x1a"
+
+
+def body_digest(html, text):
+    digest = hashlib.sha256()
+    digest.update(html.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _encode(html, text):
+    html_bytes = html.encode('utf-8')
+    text_bytes = text.encode('utf-8')
+    compress = (
+        getattr(settings, 'EMAIL_BODY_COMPRESSION', True)
+        and len(html_bytes) + len(text_bytes) >= COMPRESS_MIN_BYTES
+    )
+    if compress:
+        return zlib.compress(html_bytes), zlib.compress(text_bytes), True
+    return html_bytes, text_bytes, False
+
+
+def _new_body(digest, html, text):
+    html_data, text_data, compressed = _encode(html, text)
+    return EmailBody(digest=digest, html=html_data, text=text_data, compressed=compressed)
+
+
+def _touch(bodies):
+    """Refresh last_used_at (at most once per grace period) so reused bodies survive GC"""
+    now = timezone.now()
+    stale = [body.id for body in bodies if body.last_used_at < now - BODY_GC_GRACE / 2]
+    if stale:
+        EmailBody.objects.filter(id__in=stale).update(last_used_at=now)
+
+
+def store_body(html, text):
+    """Stored EmailBody for this content, inserting it if it is new"""
+    digest = body_digest(html, text)
+    body = EmailBody.objects.filter(digest=digest).first()
+    if body is None:
+        try:
+            with transaction.atomic():
+                body = _new_body(digest, html, text)
+                body.save()
+            return body
+        except IntegrityError:
+            # Stored concurrently by another writer
+            body = EmailBody.objects.get(digest=digest)
+    _touch([body])
+    return body
+
+
+def store_bodies(contents):
+    """
+    Store many ``(html, text)`` pairs; returns their EmailBody rows in order
+
+    One query for the bodies that already exist, one bulk insert for the
+    rest and one to read back the new ids.
+    """
+    digests = [body_digest(html, text) for html, text in contents]
+    existing = {body.digest: body for body in EmailBody.objects.filter(digest__in=set(digests))}
+    _touch(existing.values())
+
+    new = {}
+    for digest, (html, text) in zip(digests, contents):
+        if digest not in existing and digest not in new:
+            new[digest] = _new_body(digest, html, text)
+    if new:
+        EmailBody.objects.bulk_create(new.values(), ignore_conflicts=True)
+        existing.update(
+            (body.digest, body) for body in EmailBody.objects.filter(digest__in=list(new))
+        )
+    return [existing[digest] for digest in digests]
+
+
+def decode_body(body):
+    """``(html, text)`` of a stored body; decoded bodies are cached since they never change"""
+    with _lock:
+        decoded = _decoded.get(body.digest)
+        if decoded is not None:
+            _decoded.move_to_end(body.digest)
+            return decoded
+
+    html, text = bytes(body.html), bytes(body.text)
+    if body.compressed:
+        html, text = zlib.decompress(html), zlib.decompress(text)
+    decoded = html.decode('utf-8'), text.decode('utf-8')
+
+    with _lock:
+        _decoded[body.digest] = decoded
+        while len(_decoded) > DECODED_CACHE_SIZE:
+            _decoded.popitem(last=False)
+    return decoded
+
+
+def merge_vars(content, body_vars):
+    for name, value in body_vars.items():
+        content = content.replace(body_slot(name), str(value))
+    return content
+
+
+def email_vars(email):
+    """``body_vars`` of a queued email, with the actor phrase of a coalesced notification filled in"""
+    body_vars = email.body_vars
+    if 'actors' in body_vars:
+        body_vars = dict(body_vars, actors=describe_actors(body_vars['actors'], email.event_count))
+    return body_vars
+
+
+def email_subject(email):
+    return merge_vars(email.subject, email_vars(email))
+
+
+def email_bodies(email):
+    """
+    Final ``(html, text)`` for a queued email
+
+    Merges ``body_vars`` into the shared body; rows queued before the body
+    store keep their own copies in body_html/body_text.
+    """
+    if email.body_id is None:
+        return email.body_html, email.body_text
+    html, text = decode_body(email.body)
+    body_vars = email_vars(email)
+    return merge_vars(html, body_vars), merge_vars(text, body_vars)
+
+
+def _delete_unused(body_ids, cutoff):
+    """Delete those of ``body_ids`` that are still old and unreferenced, checked by the DELETE itself"""
+    quote = connection.ops.quote_name
+    bodies = quote(EmailBody._meta.db_table)
+    placeholders = ", ".join(["%s"] * len(body_ids))
+    referenced = " ".join(
+        f"AND NOT EXISTS (SELECT 1 FROM {quote(model._meta.db_table)} r WHERE r.{quote('body_id')} = {bodies}.{quote('id')})"
+        for model in (EmailQueue, EmailDeadLetter)
+    )
+    sql = f"""
+        DELETE FROM {bodies}
+        WHERE {quote('id')} IN ({placeholders}) AND {quote('last_used_at')} < %s {referenced}
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, [*body_ids, cutoff])
+        return cursor.rowcount
+
+
+def collect_unused_bodies(grace=BODY_GC_GRACE, batch_size=BODY_GC_BATCH_SIZE):
+    """Delete bodies no queued or dead-lettered email points at anymore; returns the number deleted"""
+    cutoff = timezone.now() - grace
+    unused = (
+        EmailBody.objects
+        .filter(emails__isnull=True, dead_letters__isnull=True, last_used_at__lt=cutoff)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    deleted = 0
+    last_id = 0
+    while True:
+        body_ids = list(unused.filter(id__gt=last_id)[:batch_size])
+        if not body_ids:
+            return deleted
+        last_id = body_ids[-1]
+        try:
+            deleted += _delete_unused(body_ids, cutoff)
+        except IntegrityError:
+            # An email picked one of these up mid-batch; the rest go next run
+            pass
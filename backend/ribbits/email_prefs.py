@@ -0,0 +1,142 @@
+"""
+Cached Email Preferences
+Read-mostly lookups of EmailPreferences without touching the database.
+
+Lookups go through a small process-local LRU, then the Django cache, then
+one query for whatever is still missing. Users without a row are cached as
+"defaults" and get an unsaved EmailPreferences with the model defaults, so
+the common case costs no DB work at all; rows are only created when a user
+actually changes a setting (get_or_create_prefs).
+
+Saves and deletes write through to the Django cache after commit (see
+signals). Process-local copies live for PREFS_LOCAL_TTL seconds so other
+processes pick up changes quickly.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from .models import EmailPreferences
+
+PREFS_CACHE_TIMEOUT = 60 * 60
+PREFS_LOCAL_TTL = 30
+PREFS_LOCAL_SIZE = 10000
+
+# Cached value for users who have no preferences row
+_DEFAULTS = 'defaults'
+
+_local = OrderedDict()
+_lock = threading.Lock()
+
+
+def _cache_key(user_id):
+    return f'email_prefs:{user_id}'
+
+
+def _local_get(user_id):
+    with _lock:
+        entry = _local.get(user_id)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del _local[user_id]
+            return None
+        _local.move_to_end(user_id)
+        return value
+
+
+def _local_set(user_id, value):
+    with _lock:
+        _local[user_id] = (time.monotonic() + PREFS_LOCAL_TTL, value)
+        _local.move_to_end(user_id)
+        while len(_local) > PREFS_LOCAL_SIZE:
+            _local.popitem(last=False)
+
+
+def _serialize(prefs):
+    return {field.attname: getattr(prefs, field.attname) for field in prefs._meta.concrete_fields}
+
+
+def _build(user_id, value):
+    if value == _DEFAULTS:
+        return EmailPreferences(user_id=user_id)
+    return EmailPreferences(**value)
+
+
+def get_many_prefs(user_ids):
+    """
+    Preferences for every id in ``user_ids`` as a dict of user id -> EmailPreferences
+
+    Costs at most one cache round trip and one query for ids that are in
+    neither cache. Instances for users without a row are unsaved defaults
+    and must not be saved; use get_or_create_prefs to change settings.
+    """
+    values = {}
+    missing = []
+    for user_id in user_ids:
+        value = _local_get(user_id)
+        if value is None:
+            missing.append(user_id)
+        else:
+            values[user_id] = value
+
+    if missing:
+        cached = cache.get_many([_cache_key(user_id) for user_id in missing])
+        still_missing = []
+        for user_id in missing:
+            value = cached.get(_cache_key(user_id))
+            if value is None:
+                still_missing.append(user_id)
+            else:
+                values[user_id] = value
+                _local_set(user_id, value)
+
+        if still_missing:
+            found = {
+                prefs.user_id: _serialize(prefs)
+                for prefs in EmailPreferences.objects.filter(user_id__in=still_missing)
+            }
+            fetched = {user_id: found.get(user_id, _DEFAULTS) for user_id in still_missing}
+            cache.set_many(
+                {_cache_key(user_id): value for user_id, value in fetched.items()},
+                PREFS_CACHE_TIMEOUT
+            )
+            for user_id, value in fetched.items():
+                values[user_id] = value
+                _local_set(user_id, value)
+
+    return {user_id: _build(user_id, value) for user_id, value in values.items()}
+
+
+def get_prefs(user_id):
+    """Preferences for one user (see get_many_prefs)"""
+    return get_many_prefs([user_id])[user_id]
+
+
+def get_or_create_prefs(user):
+    """Saved preferences row for ``user``, created on first write"""
+    prefs, created = EmailPreferences.objects.get_or_create(user=user)
+    return prefs
+
+
+def cache_prefs(prefs):
+    """Write a saved row through to both caches"""
+    value = _serialize(prefs)
+    cache.set(_cache_key(prefs.user_id), value, PREFS_CACHE_TIMEOUT)
+    _local_set(prefs.user_id, value)
+
+
+def invalidate_prefs(user_id):
+    """Forget a user's cached preferences"""
+    with _lock:
+        _local.pop(user_id, None)
+    cache.delete(_cache_key(user_id))
+
+
+def clear_local_prefs_cache():
+    """Drop every process-local copy (the Django cache is left alone)"""
+    with _lock:
+        _local.clear()
@@ -4,18 +4,80 @@ Handles queueing, sending, and managing email notifications
 """
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from .models import EmailQueue, EmailPreferences, Notification
-from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import F, Case, When, Value, TextField, DateTimeField
+from .models import EmailQueue, Notification, Ribbit
+from .email_prefs import get_prefs, get_many_prefs
+from .email_templates import TEMPLATES, REMINDER_MESSAGES, render_email, get_daily_digest_email
+from .email_bodies import body_slot, store_body, email_bodies, email_subject
+from .email_retention import archive_and_purge
+from .dead_letters import move_to_dead_letters
+from .circuit_breaker import breaker_for, CIRCUIT_OPEN_ERROR
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import random
 import requests
 from django.conf import settings
 
 User = get_user_model()
 
+# Placeholder rendered into shared bodies and filled from body_vars at send time
+RECIPIENT_NAME_SLOT = body_slot('recipient_name')
+# "Alice and N others" in coalesced notifications (see email_bodies.email_vars)
+ACTORS_SLOT = body_slot('actors')
+
+# Instant notifications of these types are merged per recipient and target
+COALESCED_NOTIFICATION_TYPES = ('like', 'comment', 'follow')
+DEFAULT_COALESCE_WINDOW_SECONDS = 5 * 60
+
+# Links in emails point at the web app
+FRONTEND_URL = 'https://croak-green-shine.vercel.app'
+
+NEW_POST_FANOUT_CHUNK_SIZE = 1000
+
+# Attempts before an email is moved to the dead-letter table
+MAX_SEND_ATTEMPTS = 3
+# Retry backoff in seconds: doubles per failed attempt, up to the max
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 6 * 60 * 60
+
+# Error recorded for an email whose body or recipient could not be loaded
+UNBUILDABLE_EMAIL_ERROR = "Could not build email"
+
 
 def get_user_email_prefs(user):
-    """Get or create email preferences for a user"""
-    prefs, created = EmailPreferences.objects.get_or_create(user=user)
-    return prefs
+    """Cached email preferences for a user (unsaved defaults if they never changed any)"""
+    return get_prefs(user.id)
+
+
+def get_user_timezone(tz_name):
+    """ZoneInfo for an EmailPreferences.timezone value, falling back to UTC"""
+    try:
+        return ZoneInfo(tz_name or 'UTC')
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo('UTC')
+
+
+def next_digest_slot(digest_time, tz_name, after=None):
+    """
+    Next moment (in UTC) at or after ``after`` when the recipient's local clock shows ``digest_time``
+    
+    Args:
+        digest_time: EmailPreferences.digest_time
+        tz_name: EmailPreferences.timezone
+        after: aware datetime (defaults to timezone.now())
+    """
+    after = after or timezone.now()
+    if isinstance(digest_time, str):
+        # Unsaved defaults are still the raw string
+        digest_time = time.fromisoformat(digest_time)
+    zone = get_user_timezone(tz_name)
+    local_date = after.astimezone(zone).date()
+    for days in range(3):
+        slot = datetime.combine(local_date + timedelta(days=days), digest_time, tzinfo=zone)
+        if slot >= after:
+            return slot.astimezone(dt_timezone.utc)
+    raise ValueError(f"No digest slot after {after} for {digest_time} {tz_name}")
 
 
 def should_send_email(user, notification_type):
@@ -36,10 +98,25 @@ def should_send_email(user, notification_type):
     return type_map.get(notification_type, False)
 
 
+def get_coalesce_window():
+    return timedelta(seconds=getattr(settings, 'EMAIL_COALESCE_WINDOW', DEFAULT_COALESCE_WINDOW_SECONDS))
+
+
+def coalesce_key(notification_type, context):
+    """Events with the same key for the same recipient share one email (e.g. every like on one post)"""
+    return f"{notification_type}:{context.get('post_url', '')}"[:255]
+
+
 def queue_notification_email(recipient, notification_type, context):
     """
     Queue an instant notification email
     
+    Likes, comments and follows are coalesced: the first event queues an
+    email that waits out the coalescing window, and later events for the same
+    recipient and target only bump its event_count (one UPDATE), so a viral
+    post sends its author "Alice and 240 others liked your post" once
+    instead of 241 emails. Returns the queued (or merged into) email.
+    
     Args:
         recipient: User object
         notification_type: 'like', 'comment', 'follow', 'mention', 'reply'
@@ -52,6 +129,9 @@ def queue_notification_email(recipient, notification_type, context):
     if not recipient.email:
         return None
     
+    if notification_type in COALESCED_NOTIFICATION_TYPES:
+        return queue_coalesced_email(recipient, notification_type, context)
+    
     # Generate email content
     subject, html_body, text_body = generate_notification_email(notification_type, context)
     
@@ -60,8 +140,7 @@ def queue_notification_email(recipient, notification_type, context):
         recipient=recipient,
         email_type='instant',
         subject=subject,
-        body_html=html_body,
-        body_text=text_body,
+        body=store_body(html_body, text_body),
         priority=3, 
         scheduled_for=timezone.now()
     )
@@ -69,6 +148,45 @@ def queue_notification_email(recipient, notification_type, context):
     return email
 
 
+def queue_coalesced_email(recipient, notification_type, context):
+    """
+    Merge the event into the recipient's waiting email for the same target, or queue a new one
+
+    Any row still 'pending' takes the event, including one whose window is
+    over but that no worker has claimed yet; claimed rows are left alone. The
+    unique_pending_coalesce_key constraint allows one pending row per
+    recipient and key, so when two events race to queue the first email the
+    loser's INSERT fails and it merges into the winner's row instead.
+    """
+    key = coalesce_key(notification_type, context)
+    pending = EmailQueue.objects.filter(recipient=recipient, coalesce_key=key, status='pending')
+    body = None
+    while True:
+        if pending.update(event_count=F('event_count') + 1):
+            return pending.first()
+
+        if body is None:
+            subject, html_body, text_body = generate_notification_email(
+                notification_type, dict(context, actors=ACTORS_SLOT)
+            )
+            body = store_body(html_body, text_body)
+        try:
+            with transaction.atomic():
+                return EmailQueue.objects.create(
+                    recipient=recipient,
+                    email_type='instant',
+                    subject=subject,
+                    body=body,
+                    body_vars={'actors': context.get('sender', 'Someone')},
+                    coalesce_key=key,
+                    priority=3,
+                    scheduled_for=timezone.now() + get_coalesce_window()
+                )
+        except IntegrityError:
+            # Another event queued the row first; merge into it
+            continue
+
+
 def queue_daily_digest(recipient, digest_data):
     """
     Queue a daily digest email
@@ -94,20 +212,14 @@ def queue_daily_digest(recipient, digest_data):
     # Generate digest email
     subject, html_body, text_body = generate_digest_email(digest_data, recipient)
     
-    # Queue for tomorrow at user's preferred time
-    scheduled_time = timezone.now().replace(
-        hour=prefs.digest_time.hour,
-        minute=prefs.digest_time.minute,
-        second=0,
-        microsecond=0
-    ) + timedelta(days=1)
+    # Queue for the user's next local digest time
+    scheduled_time = next_digest_slot(prefs.digest_time, prefs.timezone)
     
     email = EmailQueue.objects.create(
         recipient=recipient,
         email_type='digest',
         subject=subject,
-        body_html=html_body,
-        body_text=text_body,
+        body=store_body(html_body, text_body),
         priority=5,  # Lower priority for digests
         scheduled_for=scheduled_time
     )
@@ -115,89 +227,209 @@ def queue_daily_digest(recipient, digest_data):
     return email
 
 
-def get_pending_emails(limit=100):
-    """Get pending emails ready to be sent"""
+def due_emails(now=None):
+    """Pending emails whose scheduled time has come"""
     return EmailQueue.objects.filter(
         status='pending',
-        scheduled_for__lte=timezone.now(),
-        retry_count__lt=3  # Max 3 retries
-    ).order_by('priority', 'scheduled_for')[:limit]
+        scheduled_for__lte=now or timezone.now(),
+        retry_count__lt=MAX_SEND_ATTEMPTS
+    ).order_by('priority', 'scheduled_for')
+
+
+def get_pending_emails(limit=100):
+    """Get pending emails ready to be sent"""
+    return due_emails()[:limit]
 
 
 def mark_email_sent(email_id):
     """Mark an email as successfully sent"""
-    EmailQueue.objects.filter(id=email_id).update(
-        status='sent',
-        sent_at=timezone.now()
-    )
+    mark_emails_sent([email_id])
 
 
 def mark_email_failed(email_id, error_message):
     """Mark an email as failed and increment retry count"""
-    email = EmailQueue.objects.get(id=email_id)
-    email.status = 'failed' if email.retry_count >= 2 else 'pending'
-    email.error_message = error_message
-    email.retry_count += 1
-    email.save()
+    mark_emails_failed({email_id: error_message})
 
 
-def send_email_via_service(email):
+def claimed_emails(email_ids, worker_id=None):
     """
-    Send email via FastAPI notification service
+    EmailQueue rows for ``email_ids``, limited to those ``worker_id`` still holds
+
+    A worker whose lease ran out may still be sending; once its rows have been
+    reclaimed (and maybe claimed by someone else) its results must not land.
+    Without a worker id the rows are not filtered (single sends outside a claim).
+    """
+    emails = EmailQueue.objects.filter(id__in=list(email_ids))
+    if worker_id:
+        emails = emails.filter(status='processing', locked_by=worker_id)
+    return emails
+
+
+def mark_emails_sent(email_ids, worker_id=None):
+    """Mark emails as sent with a single UPDATE"""
+    if not email_ids:
+        return 0
+    return claimed_emails(email_ids, worker_id).update(
+        status='sent',
+        sent_at=timezone.now(),
+        locked_at=None,
+        locked_by='',
+    )
+
+
+def retry_delay(retry_count):
+    """
+    How long to wait before retrying an email that has failed ``retry_count`` times before
+    
+    Exponential backoff from RETRY_BASE_DELAY, capped at RETRY_MAX_DELAY,
+    with "equal jitter" (half fixed, half random) so emails that failed
+    together during an outage do not all come back at the same moment.
+    """
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** retry_count)
+    return timedelta(seconds=delay / 2 + delay / 2 * random.random())
+
+
+def mark_emails_failed(errors, now=None, worker_id=None):
+    """
+    Record failed sends
+    
+    Emails with attempts left go back to 'pending', scheduled after an
+    exponential backoff (one UPDATE). Emails on their last attempt are
+    moved to the dead-letter table.
     
     Args:
-        email: EmailQueue object
+        errors: dict of email id -> error message
+        worker_id: only record results for rows this worker still holds
+    """
+    if not errors:
+        return 0
+    now = now or timezone.now()
+    
+    retry_counts = dict(claimed_emails(errors, worker_id).values_list('id', 'retry_count'))
+    exhausted = {
+        email_id: errors[email_id]
+        for email_id, retry_count in retry_counts.items()
+        if retry_count + 1 >= MAX_SEND_ATTEMPTS
+    }
+    retry = [email_id for email_id in retry_counts if email_id not in exhausted]
+    
+    updated = 0
+    if retry:
+        ids_by_error = {}
+        for email_id in retry:
+            ids_by_error.setdefault(errors[email_id] or '', []).append(email_id)
+        if len(ids_by_error) == 1:
+            error_message = Value(next(iter(ids_by_error)))
+        else:
+            error_message = Case(
+                *[When(id__in=ids, then=Value(error)) for error, ids in ids_by_error.items()],
+                default=F('error_message'),
+                output_field=TextField(),
+            )
+        scheduled_for = Case(
+            *[
+                When(id=email_id, then=Value(now + retry_delay(retry_counts[email_id])))
+                for email_id in retry
+            ],
+            default=F('scheduled_for'),
+            output_field=DateTimeField(),
+        )
+        updated = claimed_emails(retry, worker_id).update(
+            status='pending',
+            error_message=error_message,
+            scheduled_for=scheduled_for,
+            retry_count=F('retry_count') + 1,
+            locked_at=None,
+            locked_by='',
+        )
+    
+    return updated + move_to_dead_letters(exhausted, now=now, queryset=claimed_emails(exhausted, worker_id))
+
+
+def mark_emails_deferred(email_ids, until, worker_id=None):
+    """
+    Put claimed emails back without counting an attempt (e.g. the service's circuit is open)
+    """
+    if not email_ids:
+        return 0
+    return claimed_emails(email_ids, worker_id).update(
+        status='pending',
+        scheduled_for=until,
+        locked_at=None,
+        locked_by='',
+    )
+
+
+def get_service_url():
+    return getattr(settings, 'NOTIFICATIONS_SERVICE_URL', 'https://croak-notifications.vercel.app')
+
+
+def deliver_email(email, session=None):
+    """
+    Post one email to the notification service without touching the database
+    
+    Safe to call from worker threads. Returns ``(ok, error_message)``;
+    nothing is sent while the service's circuit breaker is open. The email is
+    built before the breaker is asked, so an unreadable body fails that email
+    without taking (and never releasing) a half-open breaker's probe slot.
+    
+    Args:
+        email: EmailQueue object (with recipient and body loaded)
+        session: optional requests.Session to reuse keep-alive connections
     """
     try:
-        # Get notification service URL from settings
-        service_url = getattr(settings, 'NOTIFICATIONS_SERVICE_URL', 'https://croak-notifications.vercel.app')
-        
-        response = requests.post(
-            f"{service_url}/send-queued-email",
-            json={
-                "to": email.recipient.email,
-                "subject": email.subject,
-                "html": email.body_html,
-                "text": email.body_text
-            },
+        html_body, text_body = email_bodies(email)
+        payload = {
+            "to": email.recipient.email,
+            "subject": email_subject(email),
+            "html": html_body,
+            "text": text_body
+        }
+    except Exception as e:
+        return False, f"{UNBUILDABLE_EMAIL_ERROR}: {e}"
+
+    breaker = breaker_for(get_service_url())
+    if not breaker.allow():
+        return False, CIRCUIT_OPEN_ERROR
+    client = session or requests
+    try:
+        response = client.post(
+            f"{get_service_url()}/send-queued-email",
+            json=payload,
             timeout=10
         )
-        
-        if response.status_code == 200:
-            mark_email_sent(email.id)
-            return True
-        else:
-            mark_email_failed(email.id, f"Service returned {response.status_code}")
-            return False
-            
     except Exception as e:
-        mark_email_failed(email.id, str(e))
-        return False
+        breaker.record_failure()
+        return False, str(e)
+    
+    breaker.record_response(response.status_code)
+    if response.status_code == 200:
+        return True, ''
+    return False, f"Service returned {response.status_code}"
+
+
+def send_email_via_service(email):
+    """
+    Send email via FastAPI notification service
+    
+    Args:
+        email: EmailQueue object
+    """
+    ok, error = deliver_email(email)
+    if ok:
+        mark_email_sent(email.id)
+    elif error == CIRCUIT_OPEN_ERROR:
+        retry_after = breaker_for(get_service_url()).retry_after()
+        mark_emails_deferred([email.id], timezone.now() + timedelta(seconds=retry_after))
+    else:
+        mark_email_failed(email.id, error)
+    return ok
 
 
 def generate_notification_email(notification_type, context):
     """Generate email content for instant notifications"""
-    from .email_templates import (
-        get_like_email,
-        get_comment_email,
-        get_follow_email,
-        get_mention_email,
-        get_reply_email,
-        get_new_post_from_following_email
-    )
-    
-    templates = {
-        'like': get_like_email,
-        'comment': get_comment_email,
-        'follow': get_follow_email,
-        'mention': get_mention_email,
-        'reply': get_reply_email,
-        'new_post_from_following': get_new_post_from_following_email,
-    }
-    
-    template_func = templates.get(notification_type)
-    if template_func:
-        return template_func(context)
+    if notification_type in TEMPLATES:
+        return render_email(notification_type, context)
     
     # Fallback
     return (
@@ -209,67 +441,93 @@ def generate_notification_email(notification_type, context):
 
 def generate_digest_email(digest_data, recipient):
     """Generate daily digest email"""
-    from .email_templates import get_daily_digest_email
     return get_daily_digest_email(digest_data, recipient)
 
 
 def cleanup_old_emails(days=30):
-    """Delete sent emails older than specified days"""
-    cutoff_date = timezone.now() - timedelta(days=days)
-    deleted_count = EmailQueue.objects.filter(
-        status='sent',
-        sent_at__lt=cutoff_date
-    ).delete()[0]
-    return deleted_count
+    """
+    Delete sent emails older than specified days, then the bodies nothing uses anymore
+    
+    Rows are archived to EmailHistory and deleted in bounded batches (see
+    email_retention) rather than in one statement.
+    """
+    return archive_and_purge(days=days, statuses=('sent',)).purged
 
 
-def queue_new_post_notification(post, followers):
+def queue_new_post_notification(post_id, chunk_size=NEW_POST_FANOUT_CHUNK_SIZE):
     """
     Queue email notifications to followers when someone they follow creates a new post
     
+    Runs as a deferred job (see signals.notify_followers_on_new_post). Followers
+    are streamed in id order, ``chunk_size`` at a time; each chunk costs one
+    query for the followers, a cached preferences lookup and one bulk insert.
+    The email is rendered and stored once per post (see email_bodies); each
+    row only carries the recipient's name.
+    
     Args:
-        post: Ribbit object (the new post)
-        followers: QuerySet or list of User objects who follow the post author
+        post_id: id of the new Ribbit
+        chunk_size: number of followers handled per batch
     """
-    from django.contrib.auth import get_user_model
-    User = get_user_model()
+    post = Ribbit.objects.select_related('author').filter(pk=post_id).first()
+    if post is None:
+        return 0
+    
+    # Render once, leaving a slot for the recipient's name
+    context = {
+        'author_name': post.author.first_name or post.author.username,
+        'author_username': post.author.username,
+        'post_text': post.text,
+        'post_url': f'{FRONTEND_URL}/post/{post.id}',
+        'has_media': bool(post.media),
+        'recipient_name': RECIPIENT_NAME_SLOT,
+    }
+    subject, html_body, text_body = generate_notification_email('new_post_from_following', context)
+    body = store_body(html_body, text_body)
+    
+    followers = (
+        User.objects
+        .filter(following=post.author)
+        .exclude(email='')
+        .order_by('id')
+        .values_list('id', 'first_name', 'username')
+    )
     
     queued_count = 0
+    last_id = 0
     
-    for follower in followers:
-        # Check if user wants these emails
-        prefs = get_user_email_prefs(follower)
-        if not prefs.email_enabled or not prefs.email_on_new_post_from_following:
-            continue
-            
-        if not follower.email:
-            continue
+    while True:
+        chunk = list(followers.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
         
-        # Prepare context for email template
-        context = {
-            'author_name': post.author.first_name or post.author.username,
-            'author_username': post.author.username,
-            'post_text': post.text,
-            'post_url': f'https://croak-green-shine.vercel.app/post/{post.id}',
-            'has_media': bool(post.media),
-            'recipient_name': follower.first_name or follower.username,
+        # Users without a preferences row get the defaults (opted in)
+        prefs = get_many_prefs([follower_id for follower_id, _, _ in chunk])
+        opted_out = {
+            user_id for user_id, user_prefs in prefs.items()
+            if not (user_prefs.email_enabled and user_prefs.email_on_new_post_from_following)
         }
         
-        # Generate email content
-        subject, html_body, text_body = generate_notification_email('new_post_from_following', context)
+        now = timezone.now()
+        emails = []
+        for follower_id, first_name, username in chunk:
+            if follower_id in opted_out:
+                continue
+            emails.append(EmailQueue(
+                recipient_id=follower_id,
+                email_type='instant',
+                subject=subject,
+                body=body,
+                body_vars={'recipient_name': first_name or username},
+                priority=4,  # Medium-low priority
+                scheduled_for=now
+            ))
         
-        # Queue the email
-        EmailQueue.objects.create(
-            recipient=follower,
-            email_type='instant',
-            subject=subject,
-            body_html=html_body,
-            body_text=text_body,
-            priority=4,  # Medium-low priority
-            scheduled_for=timezone.now()
-        )
-        
-        queued_count += 1
+        EmailQueue.objects.bulk_create(emails)
+        queued_count += len(emails)
+    
+    if queued_count > 0:
+        print(f"Queued {queued_count} email notifications for new post by @{post.author.username}")
     
     return queued_count
 
@@ -290,28 +548,21 @@ def queue_daily_reminder(recipient):
     if not recipient.email:
         return None
     
-    # Generate reminder email
-    from .email_templates import get_daily_reminder_email
-    subject, html_body, text_body = get_daily_reminder_email(recipient)
-    
-    # Schedule for user's preferred digest time
-    scheduled_time = timezone.now().replace(
-        hour=prefs.digest_time.hour,
-        minute=prefs.digest_time.minute,
-        second=0,
-        microsecond=0
+    # Generate reminder email; the few reminder texts are stored once and shared
+    selected = random.choice(REMINDER_MESSAGES)
+    subject, html_body, text_body = render_email(
+        'daily_reminder', dict(selected, recipient_name=RECIPIENT_NAME_SLOT)
     )
     
-    # If the time has passed today, schedule for tomorrow
-    if scheduled_time <= timezone.now():
-        scheduled_time += timedelta(days=1)
+    # Schedule for the user's next local digest time
+    scheduled_time = next_digest_slot(prefs.digest_time, prefs.timezone)
     
     email = EmailQueue.objects.create(
         recipient=recipient,
         email_type='digest',
         subject=subject,
-        body_html=html_body,
-        body_text=text_body,
+        body=store_body(html_body, text_body),
+        body_vars={'recipient_name': recipient.first_name or recipient.username},
         priority=5,  # Low priority
         scheduled_for=scheduled_time
     )
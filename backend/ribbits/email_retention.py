@@ -0,0 +1,117 @@
+"""
+Email Queue Retention
+Archives finished emails to EmailHistory and purges them from EmailQueue in
+small batches.
+
+Each batch selects at most ``batch_size`` finished rows through the
+(status, sent_at) index, copies them to the history table and deletes them
+by primary key, all in one short transaction. EmailQueue has no dependent
+rows or delete signals, so Django issues a single ``DELETE ... WHERE id IN``
+without loading the rows. An optional pause between batches keeps the purge
+from competing with the queue workers.
+"""
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .email_bodies import collect_unused_bodies
+from .models import EmailQueue, EmailHistory
+
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_PURGE_BATCH_SIZE = 1000
+
+HISTORY_FIELDS = [
+    'id', 'recipient_id', 'email_type', 'subject', 'status',
+    'retry_count', 'error_message', 'created_at', 'sent_at',
+]
+
+
+@dataclass
+class PurgeResult:
+    archived: int = 0
+    purged: int = 0
+    batches: int = 0
+    bodies_collected: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.purged / self.elapsed if self.elapsed else 0.0
+
+
+def finished_emails(days=DEFAULT_RETENTION_DAYS, now=None, statuses=('sent', 'failed')):
+    """Sent or permanently failed emails older than ``days``"""
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    condition = Q(pk__in=[])
+    if 'sent' in statuses:
+        condition |= Q(status='sent', sent_at__lt=cutoff)
+    if 'failed' in statuses:
+        # Failed rows never get a sent_at
+        condition |= Q(status='failed', created_at__lt=cutoff)
+    return EmailQueue.objects.filter(condition)
+
+
+def purge_batch(queryset, batch_size=DEFAULT_PURGE_BATCH_SIZE, archive=True):
+    """
+    Archive and delete up to ``batch_size`` rows of ``queryset``
+
+    Returns ``(archived, purged)``.
+    """
+    with transaction.atomic():
+        rows = list(queryset.order_by().values(*HISTORY_FIELDS)[:batch_size])
+        if not rows:
+            return 0, 0
+        archived = 0
+        if archive:
+            now = timezone.now()
+            # ignore_conflicts makes a batch that was archived but not deleted safe to redo
+            EmailHistory.objects.bulk_create(
+                [EmailHistory(archived_at=now, **row) for row in rows],
+                ignore_conflicts=True,
+            )
+            archived = len(rows)
+        purged = EmailQueue.objects.filter(id__in=[row['id'] for row in rows]).delete()[0]
+    return archived, purged
+
+
+def archive_and_purge(days=DEFAULT_RETENTION_DAYS, batch_size=DEFAULT_PURGE_BATCH_SIZE,
+                      pause=0.0, max_batches=None, archive=True, statuses=('sent', 'failed'),
+                      on_batch=None):
+    """
+    Move finished emails older than ``days`` out of the queue, batch by batch
+
+    Args:
+        days: keep finished emails this many days
+        batch_size: rows per transaction
+        pause: seconds to sleep between batches (throttling)
+        max_batches: stop after this many batches (None for all)
+        archive: copy rows to EmailHistory before deleting them
+        statuses: which finished states to purge
+        on_batch: optional callback receiving the running PurgeResult
+    """
+    result = PurgeResult()
+    queryset = finished_emails(days, statuses=statuses)
+    start = time.monotonic()
+
+    while max_batches is None or result.batches < max_batches:
+        archived, purged = purge_batch(queryset, batch_size, archive)
+        if not purged:
+            break
+        result.archived += archived
+        result.purged += purged
+        result.batches += 1
+        result.elapsed = time.monotonic() - start
+        if on_batch:
+            on_batch(result)
+        if purged < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    result.bodies_collected = collect_unused_bodies()
+    result.elapsed = time.monotonic() - start
+    return result
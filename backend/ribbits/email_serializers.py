@@ -3,6 +3,7 @@ Email Preferences Serializer and ViewSet
 """
 from rest_framework import serializers, viewsets, permissions
 from .models import EmailPreferences
+from .email_prefs import get_prefs, get_or_create_prefs
 
 
 class EmailPreferencesSerializer(serializers.ModelSerializer):
@@ -32,9 +33,10 @@ class EmailPreferencesViewSet(viewsets.ModelViewSet):
         return EmailPreferences.objects.filter(user=self.request.user)
     
     def get_object(self):
-        # Get or create preferences for the current user
-        prefs, created = EmailPreferences.objects.get_or_create(user=self.request.user)
-        return prefs
+        # Reads come from the cache; a row is only created when the user changes something
+        if self.request.method in permissions.SAFE_METHODS:
+            return get_prefs(self.request.user.id)
+        return get_or_create_prefs(self.request.user)
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -0,0 +1,182 @@
+"""
+Email Queue Worker
+Claims pending emails with row locks and sends them concurrently.
+
+Claiming uses SELECT ... FOR UPDATE SKIP LOCKED and flips rows to
+'processing', so any number of worker processes (and the cron endpoint) can
+drain the queue at the same time without sending an email twice. Claims that
+are not finished within the lease are handed back to 'pending' as a used
+attempt (or dead-lettered after the last one), and a worker only writes
+results for rows it still holds, so a late worker cannot overwrite a row
+that was reclaimed from it.
+
+Claimed emails go to the service in bulk requests (see notifications_client)
+and results are written back with one UPDATE per outcome. Failed emails are
+retried with exponential backoff and dead-lettered after their last attempt;
+while the service's circuit breaker is open nothing is claimed, and emails
+that were refused by the breaker are put back without using up an attempt.
+"""
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .circuit_breaker import breaker_for, CIRCUIT_OPEN_ERROR
+from .dead_letters import move_to_dead_letters
+from .email_queue import (
+    due_emails, mark_emails_sent, mark_emails_failed, mark_emails_deferred, get_service_url,
+    MAX_SEND_ATTEMPTS,
+)
+from .models import EmailQueue
+from .notifications_client import send_batch, get_bulk_batch_size
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_CONCURRENCY = 8
+DEFAULT_LEASE_SECONDS = 300
+
+LEASE_EXPIRED_ERROR = "Lease expired before the send finished"
+
+_session = None
+
+
+@dataclass
+class BatchResult:
+    claimed: int = 0
+    sent: int = 0
+    failed: int = 0
+    reclaimed: int = 0
+    deferred: int = 0
+    paused: bool = False
+
+
+def get_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_session(pool_size=DEFAULT_CONCURRENCY):
+    """Process-wide keep-alive session shared by the sender threads"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def claim_pending_emails(batch_size=DEFAULT_BATCH_SIZE, worker_id=None):
+    """
+    Lock up to ``batch_size`` due emails for this worker and mark them 'processing'
+
+    Rows locked by another worker's claim are skipped rather than waited on.
+    Claimed rows drop their coalesce key: nothing merges into them any more,
+    and a failed send going back to 'pending' cannot clash with the newer
+    email that has taken the key meanwhile.
+    Returns the claimed EmailQueue objects with their recipients and bodies loaded.
+    """
+    worker_id = worker_id or get_worker_id()
+    now = timezone.now()
+
+    with transaction.atomic():
+        ids = list(
+            due_emails(now)
+            .select_for_update(skip_locked=True)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        EmailQueue.objects.filter(id__in=ids, status='pending').update(
+            status='processing',
+            coalesce_key='',
+            locked_at=now,
+            locked_by=worker_id,
+        )
+
+    return list(
+        EmailQueue.objects
+        .filter(id__in=ids, status='processing', locked_by=worker_id)
+        .select_related('recipient', 'body')
+        .order_by('priority', 'scheduled_for')
+    )
+
+
+def reclaim_stale_emails(lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Return emails stuck in 'processing' past their lease to the queue
+
+    The lost send counts as an attempt, so an email that keeps taking its
+    worker down is dead-lettered once it runs out of attempts instead of
+    being claimed forever.
+    """
+    now = timezone.now()
+    stale = EmailQueue.objects.filter(status='processing', locked_at__lt=now - timedelta(seconds=lease_seconds))
+    exhausted = stale.filter(retry_count__gte=MAX_SEND_ATTEMPTS - 1).values_list('id', flat=True)
+    dead = move_to_dead_letters(dict.fromkeys(exhausted, LEASE_EXPIRED_ERROR), now=now, queryset=stale)
+    return dead + stale.update(
+        status='pending',
+        error_message=LEASE_EXPIRED_ERROR,
+        retry_count=F('retry_count') + 1,
+        locked_at=None,
+        locked_by='',
+    )
+
+
+def send_claimed_emails(emails, concurrency=DEFAULT_CONCURRENCY, bulk_size=None, worker_id=None):
+    """
+    Send claimed emails in bulk requests through a bounded thread pool
+
+    Threads only do HTTP; results are written back from the calling thread
+    with one UPDATE for the sent emails and one for the failures, each
+    limited to the rows ``worker_id`` still holds.
+    """
+    worker_id = worker_id or get_worker_id()
+    session = get_session(concurrency)
+    result = BatchResult(claimed=len(emails))
+    if not emails:
+        return result
+
+    bulk_size = bulk_size or get_bulk_batch_size()
+    chunks = [emails[i:i + bulk_size] for i in range(0, len(emails), bulk_size)]
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(chunks))) as pool:
+        for chunk_outcomes in pool.map(lambda chunk: send_batch(chunk, session), chunks):
+            outcomes.update(chunk_outcomes)
+
+    sent_ids = [email_id for email_id, (ok, _) in outcomes.items() if ok]
+    deferred_ids = [
+        email_id for email_id, (ok, error) in outcomes.items() if error == CIRCUIT_OPEN_ERROR
+    ]
+    errors = {
+        email_id: error for email_id, (ok, error) in outcomes.items()
+        if not ok and error != CIRCUIT_OPEN_ERROR
+    }
+    mark_emails_sent(sent_ids, worker_id)
+    mark_emails_failed(errors, worker_id=worker_id)
+    if deferred_ids:
+        retry_after = breaker_for(get_service_url()).retry_after()
+        mark_emails_deferred(deferred_ids, timezone.now() + timedelta(seconds=retry_after), worker_id)
+
+    result.sent = len(sent_ids)
+    result.failed = len(errors)
+    result.deferred = len(deferred_ids)
+    return result
+
+
+def process_queue_batch(batch_size=DEFAULT_BATCH_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                        lease_seconds=DEFAULT_LEASE_SECONDS, worker_id=None):
+    """Reclaim stale rows, claim one batch and send it (nothing is claimed while the circuit is open)"""
+    reclaimed = reclaim_stale_emails(lease_seconds)
+    if breaker_for(get_service_url()).is_open():
+        return BatchResult(reclaimed=reclaimed, paused=True)
+    worker_id = worker_id or get_worker_id()
+    emails = claim_pending_emails(batch_size, worker_id)
+    result = send_claimed_emails(emails, concurrency, worker_id=worker_id)
+    result.reclaimed = reclaimed
+    return result
@@ -0,0 +1,55 @@
+"""
+Likes
+Toggles likes with as little work as a heart click needs, and answers
+"which of these ribbits did I like?" for many ribbits at once.
+
+Ribbit.like_count moves with every Like row (see counters), so the toggle
+never counts likes and never renders the ribbit.
+"""
+from django.db import IntegrityError, transaction
+
+from .counters import adjust_ribbit_counter
+from .models import Ribbit, Like
+from .notifications import notify, retract
+
+# Most ribbits a single like-state lookup may ask about
+LIKE_STATE_MAX_IDS = 100
+
+
+def toggle_like(user, ribbit_id):
+    """
+    Like the ribbit, or unlike it if ``user`` already does
+
+    Returns ``(liked, like_count)`` after the toggle, or None if the ribbit
+    does not exist. The count is the one read before the toggle moved by
+    one, which is what the client shows until its next refresh.
+    """
+    ribbit = Ribbit.objects.filter(pk=ribbit_id).values_list('author_id', 'like_count').first()
+    if ribbit is None:
+        return None
+    author_id, like_count = ribbit
+
+    with transaction.atomic():
+        unliked = Like.objects.filter(ribbit_id=ribbit_id, user=user).delete()[0]
+        if unliked:
+            adjust_ribbit_counter(ribbit_id, 'like_count', -1)
+    if unliked:
+        retract(user.id, author_id, 'like', post_id=ribbit_id)
+        return False, max(like_count - 1, 0)
+    try:
+        with transaction.atomic():
+            Like.objects.create(ribbit_id=ribbit_id, user=user)
+    except IntegrityError:
+        # Liked by a concurrent request of the same user
+        return True, like_count
+    notify(user.id, author_id, 'like', post_id=ribbit_id)
+    return True, like_count + 1
+
+
+def liked_ribbit_ids(user, ribbit_ids):
+    """Subset of ``ribbit_ids`` that ``user`` likes, in one query"""
+    if not user.is_authenticated or not ribbit_ids:
+        return set()
+    return set(
+        Like.objects.filter(user=user, ribbit_id__in=ribbit_ids).values_list('ribbit_id', flat=True)
+    )
@@ -0,0 +1,61 @@
+"""
+Repost Chain Loader
+Loads every ancestor of a page of ribbits up front so nested reposts can be
+serialized from memory instead of one query per level.
+"""
+from django.db import connection
+from django.db.models import Exists, OuterRef, Value, BooleanField
+from .models import Ribbit, Like
+
+
+def collect_ancestor_ids(ribbit_ids):
+    """
+    Return the ids of the given ribbits and every ribbit up their parent chains
+
+    A single recursive CTE walks the chains, so the cost does not grow with
+    chain depth. UNION (not UNION ALL) stops on cycles.
+    """
+    ribbit_ids = list(ribbit_ids)
+    if not ribbit_ids:
+        return set()
+
+    table = connection.ops.quote_name(Ribbit._meta.db_table)
+    placeholders = ", ".join(["%s"] * len(ribbit_ids))
+    sql = f"""
+        WITH RECURSIVE ancestors(id, parent_id) AS (
+            SELECT id, parent_id FROM {table} WHERE id IN ({placeholders})
+            UNION
+            SELECT r.id, r.parent_id FROM {table} r
+            INNER JOIN ancestors a ON r.id = a.parent_id
+        )
+        SELECT id FROM ancestors
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, ribbit_ids)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def load_repost_map(ribbits, user=None):
+    """
+    Build ``{id: Ribbit}`` for every ancestor of ``ribbits``
+
+    Ancestors come back with their author and an ``is_liked`` annotation for
+    ``user``; like and comment counts are plain columns. Two queries in total.
+    """
+    parent_ids = {ribbit.parent_id for ribbit in ribbits if ribbit.parent_id}
+    ancestor_ids = collect_ancestor_ids(parent_ids)
+    if not ancestor_ids:
+        return {}
+
+    if user is not None and user.is_authenticated:
+        is_liked = Exists(Like.objects.filter(ribbit=OuterRef("pk"), user=user))
+    else:
+        is_liked = Value(False, output_field=BooleanField())
+
+    ancestors = (
+        Ribbit.objects
+        .filter(id__in=ancestor_ids)
+        .select_related("author")
+        .annotate(is_liked=is_liked)
+    )
+    return {ancestor.id: ancestor for ancestor in ancestors}
@@ -0,0 +1,67 @@
+"""
+Django management command to backfill materialized home timelines
+Run once after deploying the timeline store, or to repair a user's timeline
+"""
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from ribbits.timeline import backfill_timeline
+from datetime import timedelta
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Backfill home timelines from existing ribbits and follow relationships'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=str,
+            help='Backfill only this user (username)'
+        )
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Only include ribbits from the last N days (0 for all)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=500,
+            help='Maximum number of entries written per user'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of users loaded per query'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"[{timezone.now()}] Starting timeline backfill...")
+
+        users = User.objects.order_by('id')
+        if options.get('user'):
+            users = users.filter(username=options['user'])
+
+        since = None
+        if options['days'] > 0:
+            since = timezone.now() - timedelta(days=options['days'])
+
+        user_count = 0
+        entry_count = 0
+
+        for user in users.only('id').iterator(chunk_size=options['batch_size']):
+            entry_count += backfill_timeline(user, since=since, limit=options['limit'])
+            user_count += 1
+
+            if user_count % options['batch_size'] == 0:
+                self.stdout.write(f"  ... {user_count} users, {entry_count} entries")
+
+        # Summary
+        self.stdout.write("\n" + "="*50)
+        self.stdout.write(self.style.SUCCESS(f"✓ Users backfilled: {user_count}"))
+        self.stdout.write(f"Entries written: {entry_count}")
+        self.stdout.write("="*50)
@@ -0,0 +1,41 @@
+"""
+Django management command to benchmark email template rendering
+Prints renders per second for each template type
+"""
+from django.core.management.base import BaseCommand
+from ribbits.email_templates import TEMPLATES, benchmark_templates
+
+
+class Command(BaseCommand):
+    help = 'Measure email template renders per second for each type'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=10000,
+            help='Renders per template type (default: 10000)'
+        )
+        parser.add_argument(
+            '--type',
+            action='append',
+            choices=sorted(TEMPLATES),
+            help='Only benchmark this type (repeatable)'
+        )
+        parser.add_argument(
+            '--cached',
+            action='store_true',
+            help='Go through the render cache (measures cache hits)'
+        )
+
+    def handle(self, *args, **options):
+        results = benchmark_templates(
+            iterations=options['iterations'],
+            use_cache=options['cached'],
+            email_types=options.get('type')
+        )
+        
+        mode = 'cached' if options['cached'] else 'uncached'
+        self.stdout.write(f"Email template renders per second ({mode}, {options['iterations']} iterations):")
+        for email_type, rate in results.items():
+            self.stdout.write(f"  {email_type:<26} {rate:>12,.0f}/s")
@@ -1,11 +1,10 @@
 """
 Django management command to process the email queue
-Run this every 5 minutes via cron job
+Run this every 5 minutes via cron job, or use run_email_worker for a long-running worker
 """
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from ribbits.email_queue import get_pending_emails, send_email_via_service
-import time
+from ribbits.email_worker import process_queue_batch, DEFAULT_CONCURRENCY, DEFAULT_LEASE_SECONDS
 
 
 class Command(BaseCommand):
@@ -19,56 +18,43 @@ class Command(BaseCommand):
             help='Maximum number of emails to process in one run'
         )
         parser.add_argument(
-            '--delay',
-            type=float,
-            default=0.5,
-            help='Delay between emails in seconds (to avoid rate limiting)'
+            '--concurrency',
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help='Number of emails sent in parallel'
+        )
+        parser.add_argument(
+            '--lease-seconds',
+            type=int,
+            default=DEFAULT_LEASE_SECONDS,
+            help='Reclaim emails stuck in processing for longer than this'
         )
 
     def handle(self, *args, **options):
-        limit = options['limit']
-        delay = options['delay']
-        
         self.stdout.write(f"[{timezone.now()}] Starting email queue processor...")
         
-        # Get pending emails
-        pending_emails = get_pending_emails(limit=limit)
-        total = len(pending_emails)
-        
-        if total == 0:
-            self.stdout.write(self.style.SUCCESS("No pending emails to process."))
-            return
+        result = process_queue_batch(
+            batch_size=options['limit'],
+            concurrency=options['concurrency'],
+            lease_seconds=options['lease_seconds'],
+        )
         
-        self.stdout.write(f"Found {total} pending emails to process.")
+        if result.reclaimed:
+            self.stdout.write(self.style.WARNING(f"Reclaimed {result.reclaimed} stale emails."))
         
-        # Process each email
-        sent_count = 0
-        failed_count = 0
+        if result.paused:
+            self.stdout.write(self.style.WARNING("Notification service circuit is open; nothing claimed."))
+            return
         
-        for email in pending_emails:
-            try:
-                self.stdout.write(f"Sending {email.email_type} email to {email.recipient.email}...")
-                
-                success = send_email_via_service(email)
-                
-                if success:
-                    sent_count += 1
-                    self.stdout.write(self.style.SUCCESS(f"  ✓ Sent successfully"))
-                else:
-                    failed_count += 1
-                    self.stdout.write(self.style.ERROR(f"  ✗ Failed to send"))
-                
-                # Delay to avoid rate limiting
-                if delay > 0:
-                    time.sleep(delay)
-                    
-            except Exception as e:
-                failed_count += 1
-                self.stdout.write(self.style.ERROR(f"  ✗ Error: {str(e)}"))
+        if result.claimed == 0:
+            self.stdout.write(self.style.SUCCESS("No pending emails to process."))
+            return
         
         # Summary
         self.stdout.write("\n" + "="*50)
-        self.stdout.write(self.style.SUCCESS(f"✓ Sent: {sent_count}"))
-        self.stdout.write(self.style.ERROR(f"✗ Failed: {failed_count}"))
-        self.stdout.write(f"Total processed: {sent_count + failed_count}/{total}")
+        self.stdout.write(self.style.SUCCESS(f"✓ Sent: {result.sent}"))
+        self.stdout.write(self.style.ERROR(f"✗ Failed: {result.failed}"))
+        if result.deferred:
+            self.stdout.write(self.style.WARNING(f"Deferred (circuit open): {result.deferred}"))
+        self.stdout.write(f"Total processed: {result.sent + result.failed}/{result.claimed}")
         self.stdout.write("="*50)
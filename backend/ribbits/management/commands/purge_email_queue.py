@@ -0,0 +1,67 @@
+"""
+Django management command to archive and purge finished emails
+Run this daily via cron job; moves old sent/failed emails to EmailHistory in small batches
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ribbits.email_retention import archive_and_purge, DEFAULT_RETENTION_DAYS, DEFAULT_PURGE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Archive sent and failed emails older than the retention period and remove them from the queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=DEFAULT_RETENTION_DAYS,
+            help=f'Keep finished emails this many days (default: {DEFAULT_RETENTION_DAYS})'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_PURGE_BATCH_SIZE,
+            help=f'Rows archived and deleted per transaction (default: {DEFAULT_PURGE_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.1,
+            help='Seconds to sleep between batches (default: 0.1)'
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            help='Stop after this many batches'
+        )
+        parser.add_argument(
+            '--no-archive',
+            action='store_true',
+            help='Delete without copying rows to EmailHistory'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"[{timezone.now()}] Purging emails older than {options['days']} days...")
+        
+        def report(progress):
+            self.stdout.write(
+                f"  ✓ batch {progress.batches}: {progress.purged} purged "
+                f"({progress.rows_per_second:,.0f} rows/s)"
+            )
+        
+        result = archive_and_purge(
+            days=options['days'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            max_batches=options.get('max_batches'),
+            archive=not options['no_archive'],
+            on_batch=report
+        )
+        
+        # Summary
+        self.stdout.write("\n" + "="*50)
+        self.stdout.write(self.style.SUCCESS(f"✓ Purged: {result.purged}"))
+        self.stdout.write(f"Archived: {result.archived}")
+        self.stdout.write(f"Unused bodies collected: {result.bodies_collected}")
+        self.stdout.write(f"Rate: {result.rows_per_second:,.0f} rows/s over {result.elapsed:.2f}s")
+        self.stdout.write("="*50)
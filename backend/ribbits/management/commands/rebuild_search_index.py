@@ -0,0 +1,42 @@
+"""
+Django management command to rebuild the full-text search index
+Run after deploying the search vectors, or whenever the index needs repair
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ribbits.search import rebuild_index, uses_postgres
+
+
+class Command(BaseCommand):
+    help = 'Rebuild search vectors for ribbits and users in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            choices=['ribbits', 'users', 'all'],
+            default='all',
+            help='Which index to rebuild'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows updated per statement'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"[{timezone.now()}] Rebuilding search index...")
+
+        if not uses_postgres():
+            self.stdout.write(self.style.WARNING(
+                "Not running on Postgres: only this process's in-memory index is rebuilt."
+            ))
+
+        models = ['ribbits', 'users'] if options['model'] == 'all' else [options['model']]
+
+        for model in models:
+            def report(last_id, processed, model=model):
+                self.stdout.write(f"  ... {model}: {processed} rows (up to id {last_id})")
+
+            processed = rebuild_index(model, batch_size=options['batch_size'], on_batch=report)
+            self.stdout.write(self.style.SUCCESS(f"✓ {model}: {processed} rows indexed"))
@@ -0,0 +1,39 @@
+"""
+Django management command to repair denormalized like/comment counters
+Safe to run at any time; only rows whose stored counts drifted are rewritten
+"""
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ribbits.counters import recount_ribbit_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount like_count and comment_count on ribbits in chunked batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of ribbits checked per batch'
+        )
+        parser.add_argument(
+            '--start-id',
+            type=int,
+            help='Resume from this ribbit id'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"[{timezone.now()}] Recounting ribbit counters...")
+
+        def report(last_id, fixed):
+            if fixed:
+                self.stdout.write(f"  ✓ Fixed {fixed} ribbits up to id {last_id}")
+
+        fixed = recount_ribbit_counters(
+            batch_size=options['batch_size'],
+            start_id=options.get('start_id'),
+            on_batch=report,
+        )
+
+        self.stdout.write(self.style.SUCCESS(f"✓ Done. {fixed} ribbits repaired."))
@@ -0,0 +1,58 @@
+"""
+Django management command to replay dead-lettered emails
+Run it after the notification service has recovered; replayed emails get a fresh set of attempts
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ribbits.dead_letters import replay_dead_letters
+from ribbits.models import EmailDeadLetter
+
+
+class Command(BaseCommand):
+    help = 'Move dead-lettered emails back into the email queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--id',
+            type=int,
+            action='append',
+            dest='ids',
+            help='Replay this dead letter (can be repeated)'
+        )
+        parser.add_argument(
+            '--email-type',
+            type=str,
+            help='Only replay emails of this type'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='Replay at most this many dead letters (oldest failures first)'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Replay every dead letter matching the other filters'
+        )
+
+    def handle(self, *args, **options):
+        if not (options['ids'] or options['email_type'] or options['all']):
+            raise CommandError("Pass --id, --email-type or --all to choose what to replay")
+
+        dead_letters = EmailDeadLetter.objects.all()
+        if options['ids']:
+            dead_letters = dead_letters.filter(id__in=options['ids'])
+        if options['email_type']:
+            dead_letters = dead_letters.filter(email_type=options['email_type'])
+        if options.get('limit'):
+            ids = list(dead_letters.order_by('failed_at').values_list('id', flat=True)[:options['limit']])
+            dead_letters = EmailDeadLetter.objects.filter(id__in=ids)
+
+        self.stdout.write(f"[{timezone.now()}] Replaying dead-lettered emails...")
+        replayed = replay_dead_letters(dead_letters)
+
+        # Summary
+        self.stdout.write("\n" + "="*50)
+        self.stdout.write(self.style.SUCCESS(f"✓ Replayed: {replayed}"))
+        self.stdout.write(f"Still dead-lettered: {EmailDeadLetter.objects.count()}")
+        self.stdout.write("="*50)
@@ -0,0 +1,91 @@
+"""
+Django management command that runs a long-lived email queue worker
+Several workers can run at once; rows are claimed with SKIP LOCKED so none is sent twice
+"""
+import signal
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from ribbits.email_worker import (
+    process_queue_batch, get_worker_id,
+    DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY, DEFAULT_LEASE_SECONDS,
+)
+
+
+class Command(BaseCommand):
+    help = 'Continuously claim and send queued emails'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Number of emails claimed per batch'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=DEFAULT_CONCURRENCY,
+            help='Number of emails sent in parallel'
+        )
+        parser.add_argument(
+            '--lease-seconds',
+            type=int,
+            default=DEFAULT_LEASE_SECONDS,
+            help='Reclaim emails stuck in processing for longer than this'
+        )
+        parser.add_argument(
+            '--idle-sleep',
+            type=float,
+            default=5.0,
+            help='Seconds to wait when the queue is empty or the service circuit is open'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Process a single batch and exit'
+        )
+
+    def handle(self, *args, **options):
+        worker_id = get_worker_id()
+        self.stopping = False
+        previous = {sig: signal.signal(sig, self._stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+
+        self.stdout.write(f"[{timezone.now()}] Email worker {worker_id} started")
+
+        try:
+            while not self.stopping:
+                close_old_connections()
+                result = process_queue_batch(
+                    batch_size=options['batch_size'],
+                    concurrency=options['concurrency'],
+                    lease_seconds=options['lease_seconds'],
+                    worker_id=worker_id,
+                )
+
+                if result.reclaimed:
+                    self.stdout.write(self.style.WARNING(f"Reclaimed {result.reclaimed} stale emails"))
+                if result.paused:
+                    self.stdout.write(self.style.WARNING(
+                        f"[{timezone.now()}] Notification service circuit open, not claiming"
+                    ))
+                if result.claimed:
+                    self.stdout.write(
+                        f"[{timezone.now()}] Batch of {result.claimed}: "
+                        f"{result.sent} sent, {result.failed} failed, {result.deferred} deferred"
+                    )
+
+                if options['once']:
+                    break
+                if not result.claimed:
+                    time.sleep(options['idle_sleep'])
+        finally:
+            for sig, handler in previous.items():
+                signal.signal(sig, handler)
+
+        self.stdout.write(f"[{timezone.now()}] Email worker {worker_id} stopped")
+
+    def _stop(self, signum, frame):
+        # Finish the current batch, then exit
+        self.stopping = True
@@ -6,7 +6,7 @@ from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from ribbits.email_queue import queue_daily_reminder
-from datetime import datetime, time
+from ribbits.digests import get_run_window, get_due_buckets, bucket_filter, digest_recipients, already_emailed
 
 User = get_user_model()
 
@@ -21,44 +21,35 @@ class Command(BaseCommand):
             help='Run in test mode (only queue for users with email starting with "test")',
         )
 
-    def handle_self(self, *args, **options):
+    def handle(self, *args, **options):
         test_mode = options.get('test', False)
         
         if test_mode:
             self.stdout.write(self.style.WARNING('Running in TEST mode'))
         
-        # Get all users with email_enabled=True and daily_digest=True
-        from ribbits.models import EmailPreferences
+        # Users with email_enabled=True and daily_digest=True, including users on default preferences
+        eligible_users = digest_recipients()
         
-        eligible_prefs = EmailPreferences.objects.filter(
-            email_enabled=True,
-            daily_digest=True,
-            user__email__isnull=False
-        ).exclude(user__email='').select_related('user')
-        
-        total_users = eligible_prefs.count()
+        total_users = eligible_users.count()
         self.stdout.write(f'Found {total_users} users with daily reminders enabled')
         
+        # Only users whose local digest time falls in the coming hour and who have no daily email for it yet
+        window_start, window_end = get_run_window()
+        due_users = (
+            eligible_users
+            .filter(bucket_filter(get_due_buckets(window_start, window_end)))
+            .exclude(already_emailed(window_start))
+        )
+        
         queued_count = 0
-        skipped_count = 0
+        skipped_count = total_users - due_users.count()
         error_count = 0
         
-        current_hour = timezone.now().hour
-        
-        for pref in eligible_prefs:
-            user = pref.user
-            
+        for user in due_users:
             # In test mode, only process test users
             if test_mode and not user.email.startswith('test'):
                 continue
             
-            # Check if it's time to send for this user
-            # Allow +/- 1 hour window to accommodate the cron job running hourly
-            user_hour = pref.digest_time.hour
-            if abs(current_hour - user_hour) > 1:
-                skipped_count += 1
-                continue
-            
             try:
                 email = queue_daily_reminder(user)
                 if email:
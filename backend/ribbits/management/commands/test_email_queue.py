@@ -5,6 +5,7 @@ Run this to create test emails and verify the system works
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from ribbits.email_queue import queue_notification_email
+from ribbits.email_bodies import email_subject
 from ribbits.models import EmailQueue, EmailPreferences
 
 User = get_user_model()
@@ -59,7 +60,7 @@ class Command(BaseCommand):
             self.stdout.write(self.style.SUCCESS(f"✓ Email queued successfully! ID: {email.id}"))
             self.stdout.write(f"  Status: {email.status}")
             self.stdout.write(f"  Priority: {email.priority}")
-            self.stdout.write(f"  Subject: {email.subject}")
+            self.stdout.write(f"  Subject: {email_subject(email)}")
         else:
             self.stdout.write(self.style.WARNING("Email not queued (user preferences might be disabled)"))
         
@@ -0,0 +1,629 @@
+"""
+Media Probing
+Reads the kind, duration and dimensions of an uploaded file from its
+container headers, so uploads are validated before anything is sent to
+Cloudinary.
+
+Only headers and index structures are read: MP4/MOV/3GP/M4A boxes up to
+``moov``, Matroska/WebM elements up to the first cluster (or block headers
+when a recorder left the duration out), RIFF (WAV, AVI) and AIFF chunks, the
+ASF header of WMV/WMA, FLAC stream info, the first MP3 frame and its
+Xing/VBRI header, the first and last Ogg pages, the last FLV tag and the
+7-byte headers of raw AAC frames. Images go through Pillow, which also stops
+after the header. Nothing is decoded.
+"""
+import io
+import struct
+from dataclasses import dataclass
+
+from PIL import Image, UnidentifiedImageError
+
+# Largest metadata structure (moov box, Matroska Info/Tracks) read into memory
+MAX_HEADER_BYTES = 16 * 1024 * 1024
+OGG_TAIL_BYTES = 64 * 1024
+
+
+class UnsupportedMedia(ValueError):
+    """Raised when a file is not a media format that can be probed"""
+
+
+@dataclass
+class MediaInfo:
+    media_type: str  # 'image', 'video' or 'audio'
+    format: str
+    duration: float = 0.0
+    width: int = None
+    height: int = None
+
+
+def _read_exact(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise UnsupportedMedia("Truncated media file")
+    return data
+
+
+def _file_size(file):
+    position = file.tell()
+    file.seek(0, io.SEEK_END)
+    size = file.tell()
+    file.seek(position)
+    return size
+
+
+# ---------------------------------------------------------------------------
+# MP4 / MOV (ISO base media file format)
+# ---------------------------------------------------------------------------
+def _boxes(data, offset=0, end=None):
+    """``(type, payload start, payload end)`` of the boxes in ``data[offset:end]``"""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size, = struct.unpack_from('>Q', data, offset + 8)
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            raise UnsupportedMedia("Corrupt MP4 box")
+        yield box_type, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _parse_moov(moov):
+    duration = None
+    width = height = None
+    handlers = set()
+    for box_type, start, end in _boxes(moov):
+        if box_type == b'mvhd':
+            if moov[start] == 1:
+                timescale, length = struct.unpack_from('>IQ', moov, start + 20)
+            else:
+                timescale, length = struct.unpack_from('>II', moov, start + 12)
+            duration = length / timescale if timescale else None
+        elif box_type == b'trak':
+            track_width = track_height = None
+            handler = None
+            for trak_type, trak_start, trak_end in _boxes(moov, start, end):
+                if trak_type == b'tkhd':
+                    offset = trak_start + (88 if moov[trak_start] == 1 else 76)
+                    track_width, track_height = (value >> 16 for value in struct.unpack_from('>II', moov, offset))
+                elif trak_type == b'mdia':
+                    for mdia_type, mdia_start, _ in _boxes(moov, trak_start, trak_end):
+                        if mdia_type == b'hdlr':
+                            handler = moov[mdia_start + 8:mdia_start + 12]
+            handlers.add(handler)
+            if handler == b'vide' and width is None:
+                width, height = track_width, track_height
+    return duration, width, height, handlers
+
+
+def probe_mp4(file):
+    brand = None
+    size = _file_size(file)
+    offset = 0
+    while offset + 8 <= size:
+        file.seek(offset)
+        box_size, box_type = struct.unpack('>I4s', _read_exact(file, 8))
+        header = 8
+        if box_size == 1:
+            box_size, = struct.unpack('>Q', _read_exact(file, 8))
+            header = 16
+        elif box_size == 0:
+            box_size = size - offset
+        if box_size < header:
+            raise UnsupportedMedia("Corrupt MP4 box")
+        if box_type == b'ftyp':
+            brand = _read_exact(file, 4)
+        elif box_type == b'moov':
+            if box_size - header > MAX_HEADER_BYTES:
+                raise UnsupportedMedia("MP4 metadata too large")
+            duration, width, height, handlers = _parse_moov(_read_exact(file, box_size - header))
+            if duration is None:
+                raise UnsupportedMedia("MP4 without a movie header")
+            media_type = 'video' if b'vide' in handlers else 'audio' if b'soun' in handlers else None
+            if media_type is None:
+                raise UnsupportedMedia("MP4 without audio or video tracks")
+            return MediaInfo(media_type, 'mov' if brand in (None, b'qt  ') else 'mp4', duration, width, height)
+        offset += box_size
+    raise UnsupportedMedia("MP4 without a movie header")
+
+
+# ---------------------------------------------------------------------------
+# Matroska / WebM (EBML)
+# ---------------------------------------------------------------------------
+EBML_HEADER = 0x1A45DFA3
+EBML_DOCTYPE = 0x4282
+MKV_SEGMENT = 0x18538067
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_CLUSTER = 0x1F43B675
+MKV_CLUSTER_TIMECODE = 0xE7
+MKV_BLOCK_GROUP = 0xA0
+MKV_BLOCK = 0xA1
+MKV_SIMPLE_BLOCK = 0xA3
+
+
+def _vint(read, keep_marker):
+    """Variable-length EBML integer; None as the value for 'unknown size'"""
+    first = read(1)
+    if not first:
+        return None, 0
+    first = first[0]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise UnsupportedMedia("Corrupt EBML element")
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in read(length - 1):
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def _element_header(read):
+    """``(id, size, header length)`` of the next element, or None at the end"""
+    element_id, id_length = _vint(read, keep_marker=True)
+    if element_id is None:
+        return None
+    size, size_length = _vint(read, keep_marker=False)
+    return element_id, size, id_length + size_length
+
+
+def _elements(data):
+    """``(id, payload)`` of the elements in a fully read master element"""
+    stream = io.BytesIO(data)
+    while True:
+        header = _element_header(stream.read)
+        if header is None:
+            return
+        element_id, size, _ = header
+        yield element_id, stream.read(len(data) if size is None else size)
+
+
+def _uint(data):
+    return int.from_bytes(data, 'big')
+
+
+def _float(data):
+    return struct.unpack('>f' if len(data) == 4 else '>d', data)[0]
+
+
+def probe_matroska(file):
+    read = file.read
+    header = _element_header(read)
+    if header is None or header[0] != EBML_HEADER or header[1] is None:
+        raise UnsupportedMedia("Not an EBML file")
+    doctype = b''
+    for element_id, payload in _elements(_read_exact(file, header[1])):
+        if element_id == EBML_DOCTYPE:
+            doctype = payload.rstrip(b'\0')
+    if doctype not in (b'webm', b'matroska'):
+        raise UnsupportedMedia("Unsupported EBML document type")
+
+    header = _element_header(read)
+    if header is None or header[0] != MKV_SEGMENT:
+        raise UnsupportedMedia("Matroska file without a segment")
+
+    timecode_scale = 1000000
+    duration = None
+    track_types = set()
+    width = height = None
+    last_timecode = None
+    cluster_timecode = 0
+
+    # Segment children are walked in order without reading payloads we do not need.
+    # Clusters and block groups are entered in place, which also copes with the
+    # unknown sizes live recorders write.
+    while True:
+        header = _element_header(read)
+        if header is None:
+            break
+        element_id, size, _ = header
+        if element_id in (MKV_INFO, MKV_TRACKS):
+            if size is None or size > MAX_HEADER_BYTES:
+                raise UnsupportedMedia("Matroska metadata too large")
+            payload = _read_exact(file, size)
+            if element_id == MKV_INFO:
+                for child_id, value in _elements(payload):
+                    if child_id == MKV_TIMECODE_SCALE:
+                        timecode_scale = _uint(value)
+                    elif child_id == MKV_DURATION:
+                        duration = _float(value)
+            else:
+                for entry_id, entry in _elements(payload):
+                    if entry_id != MKV_TRACK_ENTRY:
+                        continue
+                    for child_id, value in _elements(entry):
+                        if child_id == MKV_TRACK_TYPE:
+                            track_types.add(_uint(value))
+                        elif child_id == MKV_VIDEO and width is None:
+                            for video_id, dimension in _elements(value):
+                                if video_id == MKV_PIXEL_WIDTH:
+                                    width = _uint(dimension)
+                                elif video_id == MKV_PIXEL_HEIGHT:
+                                    height = _uint(dimension)
+        elif element_id == MKV_CLUSTER:
+            if duration is not None:
+                break
+        elif element_id == MKV_BLOCK_GROUP:
+            pass
+        elif element_id == MKV_CLUSTER_TIMECODE:
+            cluster_timecode = _uint(_read_exact(file, size))
+        elif element_id in (MKV_SIMPLE_BLOCK, MKV_BLOCK):
+            _, track_length = _vint(read, keep_marker=False)
+            relative, = struct.unpack('>h', _read_exact(file, 2))
+            last_timecode = max(last_timecode or 0, cluster_timecode + relative)
+            file.seek(size - track_length - 2, io.SEEK_CUR)
+        elif size is None:
+            raise UnsupportedMedia("Corrupt Matroska element")
+        else:
+            file.seek(size, io.SEEK_CUR)
+
+    if duration is None and last_timecode is None:
+        raise UnsupportedMedia("Matroska file without a duration")
+    seconds = (duration if duration is not None else last_timecode) * timecode_scale / 1e9
+    media_type = 'video' if 1 in track_types else 'audio' if 2 in track_types else None
+    if media_type is None:
+        raise UnsupportedMedia("Matroska file without audio or video tracks")
+    return MediaInfo(media_type, doctype.decode(), seconds, width, height)
+
+
+# ---------------------------------------------------------------------------
+# WAV (RIFF)
+# ---------------------------------------------------------------------------
+def probe_wav(file):
+    riff, _, wave = struct.unpack('<4sI4s', _read_exact(file, 12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise UnsupportedMedia("Not a WAV file")
+    byte_rate = None
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, size = struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            fmt = _read_exact(file, size)
+            byte_rate, = struct.unpack_from('<I', fmt, 8)
+            file.seek(size % 2, io.SEEK_CUR)
+        elif chunk_id == b'data':
+            if not byte_rate:
+                raise UnsupportedMedia("WAV data before its format")
+            return MediaInfo('audio', 'wav', size / byte_rate)
+        else:
+            file.seek(size + size % 2, io.SEEK_CUR)
+    raise UnsupportedMedia("WAV file without audio data")
+
+
+# ---------------------------------------------------------------------------
+# MP3 (MPEG audio layer III)
+# ---------------------------------------------------------------------------
+MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000),
+}
+MP3_SCAN_BYTES = 64 * 1024
+
+
+def probe_mp3(file):
+    size = _file_size(file)
+    head = _read_exact(file, 10) if size >= 10 else b''
+    start = 0
+    if head[:3] == b'ID3':
+        tag_size = 0
+        for byte in head[6:10]:
+            tag_size = (tag_size << 7) | (byte & 0x7F)
+        start = 10 + tag_size + (10 if head[5] & 0x10 else 0)
+    file.seek(start)
+    data = file.read(MP3_SCAN_BYTES)
+
+    for offset in range(len(data) - 4):
+        if data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+            continue
+        header, = struct.unpack_from('>I', data, offset)
+        version = {3: 1, 2: 2, 0: 2.5}.get((header >> 19) & 3)
+        layer = (header >> 17) & 3
+        bitrate_index = (header >> 12) & 0xF
+        rate_index = (header >> 10) & 3
+        if version is None or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+        sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+        samples_per_frame = 1152 if version == 1 else 576
+        mono = (header >> 6) & 3 == 3
+
+        # A Xing/Info or VBRI header carries the frame count of VBR files
+        side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+        xing = offset + 4 + side_info
+        frames = None
+        if data[xing:xing + 4] in (b'Xing', b'Info') and len(data) >= xing + 12:
+            flags, = struct.unpack_from('>I', data, xing + 4)
+            if flags & 1:
+                frames, = struct.unpack_from('>I', data, xing + 8)
+        elif data[offset + 36:offset + 40] == b'VBRI' and len(data) >= offset + 54:
+            frames, = struct.unpack_from('>I', data, offset + 50)
+        if frames:
+            return MediaInfo('audio', 'mp3', frames * samples_per_frame / sample_rate)
+        # Constant bitrate: the audio bytes give the duration
+        return MediaInfo('audio', 'mp3', (size - start - offset) * 8 / bitrate)
+    raise UnsupportedMedia("No MPEG audio frame found")
+
+
+# ---------------------------------------------------------------------------
+# Ogg (Vorbis / Opus)
+# ---------------------------------------------------------------------------
+def probe_ogg(file):
+    page = _read_exact(file, 27)
+    if page[:4] != b'OggS':
+        raise UnsupportedMedia("Not an Ogg file")
+    segments = _read_exact(file, page[26])
+    packet = file.read(sum(segments[:1]) or 0)
+    if packet[:7] == b'\x01vorbis':
+        sample_rate, = struct.unpack_from('<I', packet, 12)
+        pre_skip = 0
+        codec = 'vorbis'
+    elif packet[:8] == b'OpusHead':
+        pre_skip, = struct.unpack_from('<H', packet, 10)
+        sample_rate = 48000
+        codec = 'opus'
+    else:
+        raise UnsupportedMedia("Unsupported Ogg codec")
+
+    size = _file_size(file)
+    file.seek(max(size - OGG_TAIL_BYTES, 0))
+    tail = file.read()
+    last_page = tail.rfind(b'OggS')
+    if last_page < 0 or last_page + 14 > len(tail):
+        raise UnsupportedMedia("Ogg file without a final page")
+    granule, = struct.unpack_from('<q', tail, last_page + 6)
+    return MediaInfo('audio', codec, max(granule - pre_skip, 0) / sample_rate)
+
+
+# ---------------------------------------------------------------------------
+# AVI (RIFF)
+# ---------------------------------------------------------------------------
+def probe_avi(file):
+    riff, _, avi = struct.unpack('<4sI4s', _read_exact(file, 12))
+    if riff != b'RIFF' or avi != b'AVI ':
+        raise UnsupportedMedia("Not an AVI file")
+    while True:
+        header = file.read(12)
+        if len(header) < 12:
+            break
+        chunk_id, size, list_type = struct.unpack('<4sI4s', header)
+        if chunk_id == b'LIST' and list_type == b'hdrl':
+            if size > MAX_HEADER_BYTES:
+                raise UnsupportedMedia("AVI header too large")
+            hdrl = _read_exact(file, size - 4)
+            if hdrl[:4] != b'avih':
+                break
+            micro_per_frame, = struct.unpack_from('<I', hdrl, 8)
+            total_frames, = struct.unpack_from('<I', hdrl, 8 + 16)
+            width, height = struct.unpack_from('<II', hdrl, 8 + 32)
+            return MediaInfo('video', 'avi', micro_per_frame * total_frames / 1e6, width, height)
+        file.seek(size - 4 + size % 2, io.SEEK_CUR)
+    raise UnsupportedMedia("AVI file without a main header")
+
+
+# ---------------------------------------------------------------------------
+# FLAC
+# ---------------------------------------------------------------------------
+def probe_flac(file):
+    if _read_exact(file, 4) != b'fLaC':
+        raise UnsupportedMedia("Not a FLAC file")
+    # STREAMINFO is always the first metadata block
+    block = _read_exact(file, 4 + 34)
+    if block[0] & 0x7F != 0:
+        raise UnsupportedMedia("FLAC file without stream info")
+    packed = int.from_bytes(block[4 + 10:4 + 18], 'big')
+    sample_rate = packed >> 44
+    total_samples = packed & ((1 << 36) - 1)
+    return MediaInfo('audio', 'flac', total_samples / sample_rate)
+
+
+# ---------------------------------------------------------------------------
+# AIFF
+# ---------------------------------------------------------------------------
+def _extended(data):
+    """
+    An 80-bit IEEE 754 extended float, as AIFF stores its sample rate
+
+    Only positive values from 1 up to 2**64 can be sample rates; anything
+    else (negative, infinite, NaN, out of range) gives None.
+    """
+    exponent, mantissa = struct.unpack('>HQ', data)
+    unbiased = exponent - 16383
+    if exponent & 0x8000 or not 0 <= unbiased < 64 or not mantissa:
+        return None
+    return mantissa * 2.0 ** (unbiased - 63)
+
+
+def probe_aiff(file):
+    form, _, kind = struct.unpack('>4sI4s', _read_exact(file, 12))
+    if form != b'FORM' or kind not in (b'AIFF', b'AIFC'):
+        raise UnsupportedMedia("Not an AIFF file")
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            break
+        chunk_id, size = struct.unpack('>4sI', header)
+        if chunk_id == b'COMM':
+            comm = _read_exact(file, size)
+            frames, = struct.unpack_from('>I', comm, 2)
+            sample_rate = _extended(comm[8:18])
+            if sample_rate is None:
+                raise UnsupportedMedia("AIFF file with an unknown sample rate")
+            return MediaInfo('audio', 'aiff', frames / sample_rate)
+        file.seek(size + size % 2, io.SEEK_CUR)
+    raise UnsupportedMedia("AIFF file without a common chunk")
+
+
+# ---------------------------------------------------------------------------
+# AAC (ADTS)
+# ---------------------------------------------------------------------------
+ADTS_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+ADTS_READ_BYTES = 1024 * 1024
+
+
+def probe_adts(file):
+    # Raw AAC has no header or index; frames are walked by their 7-byte headers
+    frames = 0
+    sample_rate = None
+    data = b''
+    offset = 0
+    while True:
+        if offset + 7 > len(data):
+            data = data[offset:] + file.read(ADTS_READ_BYTES)
+            offset = 0
+            if len(data) < 7:
+                break
+        if data[offset] != 0xFF or data[offset + 1] & 0xF6 != 0xF0:
+            break
+        rate_index = (data[offset + 2] >> 2) & 0xF
+        length = ((data[offset + 3] & 0x3) << 11) | (data[offset + 4] << 3) | (data[offset + 5] >> 5)
+        if rate_index >= len(ADTS_SAMPLE_RATES) or length < 7:
+            break
+        sample_rate = sample_rate or ADTS_SAMPLE_RATES[rate_index]
+        # Each raw data block holds 1024 samples
+        frames += (data[offset + 6] & 0x3) + 1
+        offset += length
+    if not frames:
+        raise UnsupportedMedia("No AAC frame found")
+    return MediaInfo('audio', 'aac', frames * 1024 / sample_rate)
+
+
+# ---------------------------------------------------------------------------
+# FLV
+# ---------------------------------------------------------------------------
+def probe_flv(file):
+    header = _read_exact(file, 9)
+    if header[:3] != b'FLV':
+        raise UnsupportedMedia("Not an FLV file")
+    media_type = 'video' if header[4] & 0x01 else 'audio' if header[4] & 0x04 else None
+    if media_type is None:
+        raise UnsupportedMedia("FLV file without audio or video")
+    # Every tag is followed by its size, so the last tag (and its timestamp) is found from the end
+    size = _file_size(file)
+    file.seek(size - 4)
+    last_tag_size, = struct.unpack('>I', _read_exact(file, 4))
+    if last_tag_size < 11 or last_tag_size + 4 > size - 9:
+        raise UnsupportedMedia("FLV file without tags")
+    file.seek(size - 4 - last_tag_size)
+    tag = _read_exact(file, 8)
+    timestamp = int.from_bytes(tag[4:7], 'big') | (tag[7] << 24)
+    return MediaInfo(media_type, 'flv', timestamp / 1000)
+
+
+# ---------------------------------------------------------------------------
+# ASF (WMV / WMA)
+# ---------------------------------------------------------------------------
+ASF_HEADER = bytes.fromhex('3026b2758e66cf11a6d900aa0062ce6c')
+ASF_FILE_PROPERTIES = bytes.fromhex('a1dcab8c47a9cf118ee400c00c205365')
+ASF_STREAM_PROPERTIES = bytes.fromhex('9107dcb7b7a9cf118ee600c00c205365')
+ASF_VIDEO_STREAM = bytes.fromhex('c0ef19bc4d5bcf11a8fd00805f5c442b')
+ASF_AUDIO_STREAM = bytes.fromhex('409e69f84d5bcf11a8fd00805f5c442b')
+
+
+def probe_asf(file):
+    guid, size, _ = struct.unpack('<16sQI', _read_exact(file, 28))
+    if guid != ASF_HEADER:
+        raise UnsupportedMedia("Not an ASF file")
+    if size > MAX_HEADER_BYTES:
+        raise UnsupportedMedia("ASF header too large")
+    header = _read_exact(file, size - 28)
+    duration = None
+    streams = set()
+    offset = 2
+    while offset + 24 <= len(header):
+        object_guid, object_size = struct.unpack_from('<16sQ', header, offset)
+        if object_size < 24:
+            raise UnsupportedMedia("Corrupt ASF object")
+        if object_guid == ASF_FILE_PROPERTIES:
+            # Play duration in 100ns units, preroll in milliseconds
+            play_duration, _, preroll = struct.unpack_from('<QQQ', header, offset + 24 + 40)
+            duration = max(play_duration / 1e7 - preroll / 1e3, 0)
+        elif object_guid == ASF_STREAM_PROPERTIES:
+            streams.add(header[offset + 24:offset + 40])
+        offset += object_size
+    if duration is None:
+        raise UnsupportedMedia("ASF file without file properties")
+    media_type = 'video' if ASF_VIDEO_STREAM in streams else 'audio' if ASF_AUDIO_STREAM in streams else None
+    if media_type is None:
+        raise UnsupportedMedia("ASF file without audio or video streams")
+    return MediaInfo(media_type, 'wmv' if media_type == 'video' else 'wma', duration)
+
+
+# ---------------------------------------------------------------------------
+# Images
+# ---------------------------------------------------------------------------
+def probe_image(file):
+    try:
+        image = Image.open(file)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise UnsupportedMedia("Unreadable image")
+    return MediaInfo('image', (image.format or '').lower(), 0.0, image.width, image.height)
+
+
+# Top-level boxes QuickTime files may start with instead of ftyp
+QUICKTIME_BOXES = (b'ftyp', b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot')
+
+
+def _prober(head):
+    if head[4:8] in QUICKTIME_BOXES:
+        return probe_mp4
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return probe_matroska
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return probe_wav
+    if head[:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return probe_avi
+    if head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+        return probe_aiff
+    if head[:4] == b'OggS':
+        return probe_ogg
+    if head[:4] == b'fLaC':
+        return probe_flac
+    if head[:3] == b'FLV':
+        return probe_flv
+    if head[:16] == ASF_HEADER:
+        return probe_asf
+    if len(head) > 1 and head[0] == 0xFF and head[1] & 0xF6 == 0xF0:
+        return probe_adts
+    if head[:3] == b'ID3' or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return probe_mp3
+    return probe_image
+
+
+def probe_media(file):
+    """
+    MediaInfo of an uploaded file, read from its headers
+
+    Raises UnsupportedMedia for anything that is not a readable image, audio
+    or video file. The file is rewound afterwards, ready to be uploaded.
+    """
+    file.seek(0)
+    try:
+        head = file.read(16)
+        file.seek(0)
+        return _prober(head)(file)
+    except UnsupportedMedia:
+        raise
+    except (struct.error, IndexError, ZeroDivisionError, OverflowError, ValueError):
+        raise UnsupportedMedia("Corrupt media file")
+    finally:
+        file.seek(0)
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:25
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 5000
+
+
+def backfill_counters(apps, schema_editor):
+    Ribbit = apps.get_model('ribbits', 'Ribbit')
+    Like = apps.get_model('ribbits', 'Like')
+    Comment = apps.get_model('ribbits', 'Comment')
+
+    def count_of(model):
+        counts = (
+            model.objects.filter(ribbit=OuterRef('pk'))
+            .order_by().values('ribbit').annotate(total=Count('id')).values('total')
+        )
+        return Coalesce(Subquery(counts), Value(0))
+
+    last_id = 0
+    while True:
+        ids = list(
+            Ribbit.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE]
+        )
+        if not ids:
+            break
+        Ribbit.objects.filter(id__gte=ids[0], id__lte=ids[-1]).update(
+            like_count=count_of(Like),
+            comment_count=count_of(Comment),
+        )
+        last_id = ids[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ribbits', '0016_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ribbit',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ribbit',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:29
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# GIN indexes are Postgres-only; other databases use the in-process fallback index
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS ribbits_ribbit_search_gin ON ribbits_ribbit USING gin (search_vector)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS ribbits_ribbit_search_gin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ribbits', '0017_ribbit_like_count_comment_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ribbit',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
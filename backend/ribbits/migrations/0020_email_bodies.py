@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:21
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ribbits', '0019_emailqueue_locking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailBody',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('html', models.BinaryField()),
+                ('text', models.BinaryField()),
+                ('compressed', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='emailqueue',
+            name='body_vars',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='emailqueue',
+            name='body_html',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='emailqueue',
+            name='body_text',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='emailqueue',
+            name='body',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='emails', to='ribbits.emailbody'),
+        ),
+    ]
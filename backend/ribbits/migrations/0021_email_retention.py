@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:27
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ribbits', '0020_email_bodies'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('recipient_id', models.BigIntegerField(db_index=True)),
+                ('email_type', models.CharField(max_length=20)),
+                ('subject', models.CharField(max_length=255)),
+                ('status', models.CharField(max_length=20)),
+                ('retry_count', models.IntegerField(default=0)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='emailqueue',
+            index=models.Index(fields=['status', 'sent_at'], name='ribbits_ema_status_cffef6_idx'),
+        ),
+    ]
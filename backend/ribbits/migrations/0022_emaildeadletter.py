@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:31
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ribbits', '0021_email_retention'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailDeadLetter',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('email_type', models.CharField(max_length=20)),
+                ('subject', models.CharField(max_length=255)),
+                ('body_vars', models.JSONField(blank=True, default=dict)),
+                ('body_html', models.TextField(blank=True)),
+                ('body_text', models.TextField(blank=True)),
+                ('priority', models.IntegerField(default=5)),
+                ('retry_count', models.IntegerField(default=0)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('failed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('body', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='dead_letters', to='ribbits.emailbody')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dead_letter_emails', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-failed_at'],
+            },
+        ),
+    ]
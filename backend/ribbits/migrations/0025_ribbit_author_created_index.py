@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ribbits', '0024_notification_inbox_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ribbit',
+            index=models.Index(fields=['author', '-created_at'], name='ribbits_rib_author__51fec5_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_pending(apps, schema_editor):
+    """Fold rows queued twice by racing events into the oldest one so the constraint can be added"""
+    EmailQueue = apps.get_model('ribbits', 'EmailQueue')
+    pending = EmailQueue.objects.filter(status='pending').exclude(coalesce_key='')
+    duplicated = (
+        pending.order_by().values('recipient_id', 'coalesce_key')
+        .annotate(rows=Count('id')).filter(rows__gt=1)
+    )
+    for group in duplicated:
+        rows = pending.filter(recipient_id=group['recipient_id'], coalesce_key=group['coalesce_key'])
+        keep = rows.order_by('id').first()
+        extra = rows.exclude(id=keep.id)
+        events = extra.aggregate(total=Sum('event_count'))['total'] or 0
+        EmailQueue.objects.filter(id=keep.id).update(event_count=keep.event_count + events)
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ribbits', '0025_ribbit_author_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_pending, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='emailqueue',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending'), models.Q(('coalesce_key', ''), _negated=True)), fields=('recipient', 'coalesce_key'), name='unique_pending_coalesce_key'),
+        ),
+    ]
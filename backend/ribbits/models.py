@@ -4,6 +4,7 @@ from django.conf import settings
 from django.utils import timezone
 from cloudinary.models import CloudinaryField
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 
 User = settings.AUTH_USER_MODEL
 
@@ -20,9 +21,18 @@ class Ribbit(models.Model):
 
     reply_count = models.PositiveIntegerField(default=0)
     reribbit_count = models.PositiveIntegerField(default=0)
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    # Postgres full-text vector over text, GIN indexed (see ribbits.search)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Profile timelines
+            models.Index(fields=['author', '-created_at']),
+        ]
     
     def reribbit(self, user, text):
         repost = Ribbit.objects.create(
@@ -39,6 +49,20 @@ class Ribbit(models.Model):
         original_post.refresh_from_db()
         return repost
 
+class TimelineEntry(models.Model):
+    """Materialized home timeline row: ``ribbit`` shows up in ``user``'s home feed"""
+    user = models.ForeignKey(User, related_name='timeline_entries', on_delete=models.CASCADE)
+    ribbit = models.ForeignKey(Ribbit, related_name='timeline_entries', on_delete=models.CASCADE)
+    created_at = models.DateTimeField()  # copy of ribbit.created_at so reads never touch the ribbit table to sort
+
+    class Meta:
+        ordering = ['-created_at']
+        unique_together = ('user', 'ribbit')
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
+
+
 class Like(models.Model):
     ribbit = models.ForeignKey(Ribbit, related_name="likes", on_delete=models.CASCADE)
     user = models.ForeignKey(User, related_name="likes", on_delete=models.CASCADE)
@@ -80,6 +104,28 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # Inbox listing and unread counts (see ribbits.notifications)
+            models.Index(fields=["receiver", "is_read", "-created_at"]),
+        ]
+
+
+class EmailBody(models.Model):
+    """
+    Content-addressed email body shared by every EmailQueue row that uses it
+    
+    Per-recipient values are left as slots and kept in EmailQueue.body_vars
+    (see ribbits.email_bodies). Large bodies are stored zlib-compressed.
+    """
+    digest = models.CharField(max_length=64, unique=True)  # sha256 of html + text
+    html = models.BinaryField()
+    text = models.BinaryField()
+    compressed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)  # refreshed on reuse, guards GC
+    
+    def __str__(self):
+        return f"Email body {self.digest[:12]}"
 
 
 class EmailQueue(models.Model):
@@ -100,8 +146,15 @@ class EmailQueue(models.Model):
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='email_queue')
     email_type = models.CharField(max_length=20, choices=EMAIL_TYPES)
     subject = models.CharField(max_length=255)
-    body_html = models.TextField()
-    body_text = models.TextField()
+    # Shared body plus this recipient's slot values; body_html/body_text are only set on older rows
+    body = models.ForeignKey(EmailBody, null=True, blank=True, on_delete=models.PROTECT, related_name='emails')
+    body_vars = models.JSONField(default=dict, blank=True)
+    body_html = models.TextField(blank=True)
+    body_text = models.TextField(blank=True)
+    # Instant notifications for the same recipient and target are merged into one
+    # pending row while it waits out the coalescing window (see queue_notification_email)
+    coalesce_key = models.CharField(max_length=255, blank=True)
+    event_count = models.PositiveIntegerField(default=1)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
     priority = models.IntegerField(default=5, db_index=True)  # 1=highest, 10=lowest
     scheduled_for = models.DateTimeField(default=timezone.now, db_index=True)
@@ -110,17 +163,84 @@ class EmailQueue(models.Model):
     retry_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    # Set when a worker claims the row (status 'processing'); stale claims are reclaimed
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    
     class Meta:
         ordering = ['priority', 'scheduled_for']
         indexes = [
             models.Index(fields=['status', 'scheduled_for']),
             models.Index(fields=['recipient', 'email_type']),
+            models.Index(fields=['status', 'locked_at']),
+            models.Index(fields=['status', 'sent_at']),
+            models.Index(fields=['recipient', 'coalesce_key', 'status']),
+        ]
+        constraints = [
+            # One waiting email per recipient and target, so racing events merge instead of doubling up
+            models.UniqueConstraint(
+                fields=['recipient', 'coalesce_key'],
+                condition=models.Q(status='pending') & ~models.Q(coalesce_key=''),
+                name='unique_pending_coalesce_key',
+            ),
         ]
     
     def __str__(self):
         return f"{self.email_type} to {self.recipient.username} - {self.status}"
 
 
+class EmailDeadLetter(models.Model):
+    """
+    Email that used up its send attempts, moved out of EmailQueue
+    
+    Holds everything needed to queue it again (see the replay_dead_letters
+    command).
+    """
+    id = models.BigIntegerField(primary_key=True)  # the original EmailQueue id
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='dead_letter_emails')
+    email_type = models.CharField(max_length=20)
+    subject = models.CharField(max_length=255)
+    body = models.ForeignKey(EmailBody, null=True, blank=True, on_delete=models.PROTECT, related_name='dead_letters')
+    body_vars = models.JSONField(default=dict, blank=True)
+    body_html = models.TextField(blank=True)
+    body_text = models.TextField(blank=True)
+    event_count = models.PositiveIntegerField(default=1)
+    priority = models.IntegerField(default=5)
+    retry_count = models.IntegerField(default=0)
+    error_message = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    failed_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        ordering = ['-failed_at']
+    
+    def __str__(self):
+        return f"{self.email_type} to {self.recipient.username} - dead: {self.error_message[:50]}"
+
+
+class EmailHistory(models.Model):
+    """
+    Compact record of a finished email, archived out of EmailQueue
+    
+    Keeps what is needed for support and stats without the body, locks or a
+    foreign key, so the hot queue table can be purged in small batches
+    (see ribbits.email_retention).
+    """
+    id = models.BigIntegerField(primary_key=True)  # the original EmailQueue id
+    recipient_id = models.BigIntegerField(db_index=True)
+    email_type = models.CharField(max_length=20)
+    subject = models.CharField(max_length=255)
+    status = models.CharField(max_length=20)
+    retry_count = models.IntegerField(default=0)
+    error_message = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    sent_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.email_type} to #{self.recipient_id} - {self.status}"
+
+
 class EmailPreferences(models.Model):
     """User email notification preferences"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='email_preferences')
@@ -0,0 +1,180 @@
+"""
+Notification Pipeline
+Writes in-app notifications for likes, comments, reribbits and follows and
+keeps every user's unread count cached.
+
+Views call notify() and retract() inside their transaction. Both run once it
+commits, off the request thread (see tasks.run_deferred): new rows are
+bulk-inserted and pushed to the receivers' open websockets (see realtime and
+websockets), undone actions are deleted. A like or follow undone before its
+notification was written is caught after the insert, so a quick like/unlike
+never leaves a notification behind.
+
+Unread counts are cached per user. Any change (new, read or retracted
+notifications) drops the cached count and the next lookup recounts through
+the (receiver, is_read, created_at) index, so concurrent writers can never
+leave a wrong count in the cache.
+"""
+from django.core.cache import cache
+
+from users.models import Follow
+
+from .models import Notification, Like
+from .realtime import get_broker, user_channel
+from .serializers import NotificationSerializer
+from .tasks import run_deferred
+
+UNREAD_CACHE_TIMEOUT = 5 * 60
+
+NOTIFICATION_MESSAGES = {
+    'like': "liked your ribbit",
+    'reribbit': "re-ribbited your ribbit",
+    'follow': "followed you",
+    # Comment notifications carry the comment text instead
+}
+
+
+def _unread_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def unread_count(user_id):
+    """Number of unread notifications, counted at most once per cache period"""
+    count = cache.get(_unread_key(user_id))
+    if count is None:
+        count = Notification.objects.filter(receiver_id=user_id, is_read=False).count()
+        cache.set(_unread_key(user_id), count, UNREAD_CACHE_TIMEOUT)
+    return count
+
+
+def invalidate_unread(user_id):
+    cache.delete(_unread_key(user_id))
+
+
+def _invalidate_unread_many(user_ids):
+    cache.delete_many([_unread_key(user_id) for user_id in set(user_ids)])
+
+
+def unread_event(count):
+    return {'type': 'unread_count', 'unread_count': count}
+
+
+def publish_notifications(notifications):
+    """Push new notifications (with sender, receiver and post loaded) to their receivers' connections"""
+    broker = get_broker()
+    for notification in notifications:
+        channel = user_channel(notification.receiver_id)
+        if broker.has_subscribers(channel):
+            broker.publish(channel, {
+                'type': 'notification',
+                'notification': NotificationSerializer(notification).data,
+            })
+
+
+def publish_unread_count(user_id):
+    broker = get_broker()
+    channel = user_channel(user_id)
+    if broker.has_subscribers(channel):
+        broker.publish(channel, unread_event(unread_count(user_id)))
+
+
+def _undone(notifications):
+    """Ids of like and follow notifications whose like or follow no longer exists, in one query per type"""
+    likes = [n for n in notifications if n.notif_type == 'like']
+    follows = [n for n in notifications if n.notif_type == 'follow']
+    existing = set()
+    if likes:
+        existing |= {
+            ('like', user_id, ribbit_id) for user_id, ribbit_id in
+            Like.objects.filter(
+                user_id__in={n.sender_id for n in likes}, ribbit_id__in={n.post_id for n in likes}
+            ).values_list('user_id', 'ribbit_id')
+        }
+    if follows:
+        existing |= {
+            ('follow', from_id, to_id) for from_id, to_id in
+            Follow.objects.filter(
+                from_user_id__in={n.sender_id for n in follows}, to_user_id__in={n.receiver_id for n in follows}
+            ).values_list('from_user_id', 'to_user_id')
+        }
+    undone = {n.id for n in likes if ('like', n.sender_id, n.post_id) not in existing}
+    undone |= {n.id for n in follows if ('follow', n.sender_id, n.receiver_id) not in existing}
+    return undone
+
+
+def create_notifications(notifications):
+    """
+    Insert unsaved Notification rows in one query and push them
+
+    Notifications users would get about their own actions are dropped. The
+    insert comes before the check for undone likes and follows: an undo that
+    committed earlier is seen by the check, a later one's retract() finds
+    the row.
+    """
+    notifications = [
+        notification for notification in notifications
+        if notification.sender_id != notification.receiver_id
+    ]
+    if not notifications:
+        return []
+    for notification in notifications:
+        if not notification.message:
+            notification.message = NOTIFICATION_MESSAGES.get(notification.notif_type, '')
+    created = Notification.objects.bulk_create(notifications)
+    undone = _undone(created)
+    if undone:
+        Notification.objects.filter(id__in=undone).delete()
+        created = [notification for notification in created if notification.id not in undone]
+    _invalidate_unread_many([notification.receiver_id for notification in created])
+    loaded = list(
+        Notification.objects
+        .filter(id__in=[notification.id for notification in created])
+        .select_related('sender', 'receiver', 'post')
+    )
+    publish_notifications(loaded)
+    return created
+
+
+def notify_many(notifications):
+    """Write unsaved Notification rows once the surrounding transaction commits"""
+    if notifications:
+        run_deferred(create_notifications, list(notifications))
+
+
+def notify(sender_id, receiver_id, notif_type, post_id=None, message=''):
+    """Notify ``receiver_id`` about ``sender_id``'s action once the transaction commits"""
+    notify_many([Notification(
+        sender_id=sender_id,
+        receiver_id=receiver_id,
+        notif_type=notif_type,
+        post_id=post_id,
+        message=message,
+    )])
+
+
+def delete_retracted(sender_id, receiver_id, notif_type, post_id=None):
+    deleted = Notification.objects.filter(
+        sender_id=sender_id, receiver_id=receiver_id, notif_type=notif_type, post_id=post_id
+    ).delete()[0]
+    if deleted:
+        invalidate_unread(receiver_id)
+        publish_unread_count(receiver_id)
+    return deleted
+
+
+def retract(sender_id, receiver_id, notif_type, post_id=None):
+    """Remove notifications for an action that was undone (unlike, unfollow) once the transaction commits"""
+    run_deferred(delete_retracted, sender_id, receiver_id, notif_type, post_id)
+
+
+def mark_read(user_id, ids=None):
+    """Mark the user's unread notifications (or only ``ids``) as read with one UPDATE"""
+    unread = Notification.objects.filter(receiver_id=user_id, is_read=False)
+    if ids is not None:
+        unread = unread.filter(id__in=ids)
+    updated = unread.update(is_read=True)
+    if updated:
+        invalidate_unread(user_id)
+        # Other devices of the user update their badge
+        publish_unread_count(user_id)
+    return updated
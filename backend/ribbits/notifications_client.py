@@ -0,0 +1,142 @@
+"""
+Notifications Service Client
+Sends queued emails to the notification service in batches.
+
+Batches are posted to ``/send-queued-emails``; the service answers with one
+result per email. Services that predate the bulk route (404/405) are sent
+one email per request via ``/send-queued-email`` until the next probe.
+Both routes go through the service's circuit breaker: while it is open,
+emails come back with CIRCUIT_OPEN_ERROR without a request being made.
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .email_queue import deliver_email, get_service_url, UNBUILDABLE_EMAIL_ERROR
+from .email_bodies import email_bodies, email_subject
+from .circuit_breaker import breaker_for, CIRCUIT_OPEN_ERROR
+
+BULK_SEND_PATH = "/send-queued-emails"
+DEFAULT_BULK_BATCH_SIZE = 50
+BULK_REPROBE_SECONDS = 3600
+
+_bulk_unsupported = {}  # service url -> time the bulk route was found missing
+_lock = threading.Lock()
+
+
+def get_bulk_batch_size():
+    return getattr(settings, 'NOTIFICATIONS_BULK_BATCH_SIZE', DEFAULT_BULK_BATCH_SIZE)
+
+
+def bulk_supported(url=None):
+    """False while the service is known to lack the bulk route"""
+    url = url or get_service_url()
+    with _lock:
+        missing_since = _bulk_unsupported.get(url)
+        if missing_since is None:
+            return True
+        if time.monotonic() - missing_since > BULK_REPROBE_SECONDS:
+            del _bulk_unsupported[url]
+            return True
+        return False
+
+
+def _mark_bulk_unsupported(url):
+    with _lock:
+        _bulk_unsupported[url] = time.monotonic()
+
+
+def reset_bulk_support():
+    with _lock:
+        _bulk_unsupported.clear()
+
+
+def email_payload(email):
+    html_body, text_body = email_bodies(email)
+    return {
+        "id": email.id,
+        "to": email.recipient.email,
+        "subject": email_subject(email),
+        "html": html_body,
+        "text": text_body,
+    }
+
+
+def _build_payloads(emails):
+    """``(payloads, errors)``: the bulk payload of each email that could be built, the error of each that could not"""
+    payloads, errors = [], {}
+    for email in emails:
+        try:
+            payloads.append(email_payload(email))
+        except Exception as e:
+            errors[email.id] = (False, f"{UNBUILDABLE_EMAIL_ERROR}: {e}")
+    return payloads, errors
+
+
+def _send_one_by_one(emails, session):
+    return {email.id: deliver_email(email, session) for email in emails}
+
+
+def send_batch(emails, session):
+    """
+    Send emails in one request to the bulk route
+
+    Does no database work, so it is safe to call from worker threads.
+    Returns ``{email_id: (ok, error_message)}`` for every email.
+    """
+    if not emails:
+        return {}
+
+    url = get_service_url()
+    if not bulk_supported(url):
+        return _send_one_by_one(emails, session)
+
+    # Built before asking the breaker, so a bad body cannot hold its probe slot
+    payloads, outcomes = _build_payloads(emails)
+    emails = [email for email in emails if email.id not in outcomes]
+    if emails:
+        outcomes.update(_post_bulk(url, emails, payloads, session))
+    return outcomes
+
+
+def _post_bulk(url, emails, payloads, session):
+    breaker = breaker_for(url)
+    if not breaker.allow():
+        return {email.id: (False, CIRCUIT_OPEN_ERROR) for email in emails}
+
+    try:
+        response = session.post(
+            f"{url}{BULK_SEND_PATH}",
+            json={"emails": payloads},
+            timeout=30,
+        )
+    except Exception as e:
+        breaker.record_failure()
+        return {email.id: (False, str(e)) for email in emails}
+
+    breaker.record_response(response.status_code)
+
+    if response.status_code in (404, 405):
+        _mark_bulk_unsupported(url)
+        return _send_one_by_one(emails, session)
+
+    if response.status_code != 200:
+        error = f"Service returned {response.status_code}"
+        return {email.id: (False, error) for email in emails}
+
+    try:
+        reported = {item["id"]: item for item in response.json().get("results", [])}
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return {email.id: (False, "Malformed bulk response") for email in emails}
+
+    outcomes = {}
+    for email in emails:
+        item = reported.get(email.id)
+        if item is None:
+            outcomes[email.id] = (False, "Missing from bulk response")
+        elif item.get("ok"):
+            outcomes[email.id] = (True, '')
+        else:
+            outcomes[email.id] = (False, item.get("error") or "Rejected by service")
+    return outcomes
@@ -0,0 +1,96 @@
+"""
+Notification Service Stub
+A tiny local HTTP server that speaks the notification service's email routes.
+
+Used by the tests and handy for running a worker locally without sending real
+mail:
+
+    with StubNotificationsServer() as stub:
+        with override_settings(NOTIFICATIONS_SERVICE_URL=stub.url):
+            ...
+        stub.received  # every email the service accepted
+
+``bulk=False`` emulates an older service without ``/send-queued-emails``;
+addresses in ``reject`` come back as failures. Setting ``outage`` to a status
+code (e.g. 503) makes every request fail with it, as during a service outage.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        with stub.lock:
+            stub.requests.append(self.path)
+
+        if stub.outage:
+            self._respond(stub.outage, {"detail": "Service Unavailable"})
+        elif self.path == "/send-queued-emails" and stub.bulk:
+            results = [stub.accept(email) for email in payload.get("emails", [])]
+            self._respond(200, {"results": results})
+        elif self.path == "/send-queued-email":
+            result = stub.accept(payload)
+            self._respond(200 if result["ok"] else 500, result)
+        else:
+            self._respond(404, {"detail": "Not Found"})
+
+    def _respond(self, status_code, body):
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubNotificationsServer:
+
+    def __init__(self, bulk=True, reject=(), host="127.0.0.1", port=0):
+        self.bulk = bulk
+        self.reject = set(reject)
+        self.outage = None
+        self.received = []
+        self.requests = []
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def accept(self, email):
+        if email.get("to") in self.reject:
+            return {"id": email.get("id"), "ok": False, "error": "Recipient rejected"}
+        with self.lock:
+            self.received.append(email)
+        return {"id": email.get("id"), "ok": True}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
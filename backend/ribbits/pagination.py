@@ -1,4 +1,14 @@
 from rest_framework.pagination import CursorPagination
 
 class FeedPagination(CursorPagination):
-    ordering = '-created_at'  
+    ordering = '-created_at'
+
+
+class TimelinePagination(CursorPagination):
+    page_size = 10
+    ordering = '-timeline_at'
+
+
+class NotificationPagination(CursorPagination):
+    page_size = 20
+    ordering = '-created_at'
@@ -0,0 +1,48 @@
+"""
+Profile Pages
+A user's profile is served as two requests: a small header (names, bio,
+pictures, follow counts) and the cursor-paginated timeline of their ribbits
+(see views.ProfileRibbitsApiView).
+
+Headers are the same for every viewer, so they are cached by username;
+only ``is_following`` is filled in per viewer from the cached followee set.
+Profile saves and follows drop the cached header.
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from users.follows import are_following
+
+from .serializers import PublicUserSerializer
+
+User = get_user_model()
+
+PROFILE_HEADER_TIMEOUT = 5 * 60
+
+
+def _header_key(username):
+    return f'profiles:header:{username}'
+
+
+def cached_profile_header(username):
+    """Viewer-independent header of ``username``'s profile, or None if there is no such user"""
+    header = cache.get(_header_key(username))
+    if header is None:
+        user = User.objects.filter(username=username).first()
+        if user is None:
+            return None
+        header = dict(PublicUserSerializer(user).data)
+        cache.set(_header_key(username), header, PROFILE_HEADER_TIMEOUT)
+    return header
+
+
+def profile_header(username, viewer):
+    """``username``'s profile header as ``viewer`` sees it, or None"""
+    header = cached_profile_header(username)
+    if header is None:
+        return None
+    return dict(header, is_following=are_following(viewer, [header['id']])[header['id']])
+
+
+def invalidate_profile_header(*usernames):
+    cache.delete_many([_header_key(username) for username in usernames])
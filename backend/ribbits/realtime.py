@@ -0,0 +1,126 @@
+"""
+Realtime Event Brokers
+Carry events from the code that creates them to the websocket connections
+subscribed to their channel: ``user:<id>`` for a user's notifications (see
+user_channel), ``community:<id>`` for a community chat.
+
+The broker is chosen by the REALTIME_BROKER setting. InMemoryBroker only
+reaches connections served by the same process, which is enough for a single
+ASGI node; deployments with several nodes plug in a broker backed by a shared
+pub/sub (Redis, Postgres LISTEN/NOTIFY, ...) implementing the Broker methods.
+"""
+import asyncio
+import threading
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_BROKER = 'ribbits.realtime.InMemoryBroker'
+SUBSCRIPTION_QUEUE_SIZE = 100
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Broker:
+    """Interface for realtime brokers; ``publish`` may be called from any thread"""
+
+    def subscribe(self, channel):
+        """New Subscription delivering the channel's events; call from the event loop"""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+    def publish(self, channel, event):
+        """Send a JSON-serializable event to every subscription of ``channel``"""
+        raise NotImplementedError
+
+    def has_subscribers(self, channel):
+        """False when publishing to ``channel`` is certainly wasted (brokers that cannot tell say True)"""
+        return True
+
+
+class Subscription:
+    """
+    One connection's bounded event queue, owned by the event loop that created it
+
+    A consumer that falls SUBSCRIPTION_QUEUE_SIZE events behind is marked
+    ``lagged`` instead of buffering without limit; the connection then tells
+    the client to resync over the REST API and closes (see websockets).
+    """
+
+    def __init__(self, channel, maxsize=None):
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize or SUBSCRIPTION_QUEUE_SIZE)
+        self.lagged = False
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+    def deliver(self, event):
+        """Queue an event from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The connection's loop is already closed
+            pass
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class InMemoryBroker(Broker):
+    """Process-local broker: events reach connections served by this process only"""
+
+    def __init__(self):
+        self._subscriptions = {}  # channel -> set of Subscription
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = Subscription(channel)
+        with self._lock:
+            self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+    def has_subscribers(self, channel):
+        with self._lock:
+            return channel in self._subscriptions
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The process-wide broker configured by REALTIME_BROKER"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'REALTIME_BROKER', DEFAULT_BROKER))()
+        return _broker
+
+
+def reset_broker():
+    global _broker
+    with _broker_lock:
+        _broker = None
@@ -0,0 +1,327 @@
+"""
+Search
+Full-text search over ribbits and users with ranked, cursor-paginated results.
+
+On Postgres, Ribbit.search_vector and User.search_vector hold tsvectors (GIN
+indexed) refreshed on save and ranked with ts_rank. Other databases, like the
+SQLite test database, fall back to an in-process inverted index.
+
+Ribbits also match on their author's username, weighted below the text, so
+searching for someone still finds what they posted.
+
+The last query term is matched as a prefix so results work while typing.
+"""
+import base64
+import binascii
+import re
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField, OuterRef, Q, Subquery
+from django.db.models.functions import Cast
+
+from .models import Ribbit
+
+User = get_user_model()
+
+PAGE_SIZE = 10
+# How much a token from a document's secondary text (a ribbit's author
+# username) counts next to one from its main text
+SECONDARY_WEIGHT = 0.5
+MAX_QUERY_TERMS = 8
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class InvalidCursor(ValueError):
+    """Raised when a search cursor cannot be decoded"""
+
+
+@dataclass
+class SearchPage:
+    results: list = field(default_factory=list)
+    next_cursor: str = None
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens"""
+    return [token.lower() for token in TOKEN_RE.findall(text or "")]
+
+
+def get_search_config():
+    return getattr(settings, 'SEARCH_CONFIG', 'simple')
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+# ---------- CURSORS ----------
+def encode_cursor(score, pk):
+    return base64.urlsafe_b64encode(f"{score!r}:{pk}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        score, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(score), int(pk)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+
+# ---------- IN-PROCESS INVERTED INDEX ----------
+class InvertedIndex:
+    """
+    Token -> {document id: weighted term frequency} postings kept in memory
+
+    Loaded lazily from the database on first search and kept current by the
+    save/delete signals afterwards.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._postings = {}
+        self._documents = {}
+        self._sorted_tokens = None
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def index(self, doc_id, text, secondary=""):
+        with self._lock:
+            self._remove(doc_id)
+            frequencies = {}
+            for token in tokenize(text):
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token in tokenize(secondary):
+                frequencies[token] = frequencies.get(token, 0) + SECONDARY_WEIGHT
+            for token, count in frequencies.items():
+                if token not in self._postings:
+                    self._sorted_tokens = None
+                self._postings.setdefault(token, {})[doc_id] = count
+            self._documents[doc_id] = set(frequencies)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        for token in self._documents.pop(doc_id, ()):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[token]
+                self._sorted_tokens = None
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._documents = {}
+            self._sorted_tokens = None
+            self._loaded = False
+
+    def load(self, batch_size=2000):
+        with self._lock:
+            for row in self._loader(batch_size):
+                self.index(*row)
+            self._loaded = True
+
+    def _prefix_matches(self, prefix):
+        if self._sorted_tokens is None:
+            self._sorted_tokens = sorted(self._postings)
+        start = bisect_left(self._sorted_tokens, prefix)
+        for token in self._sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def search(self, terms):
+        """Return ``[(score, doc_id)]`` matching every term, best first"""
+        with self._lock:
+            if not self._loaded:
+                self.load()
+
+            scores = None
+            for position, term in enumerate(terms):
+                if position == len(terms) - 1:
+                    tokens = list(self._prefix_matches(term))
+                else:
+                    tokens = [term] if term in self._postings else []
+
+                matched = {}
+                for token in tokens:
+                    for doc_id, count in self._postings[token].items():
+                        matched[doc_id] = matched.get(doc_id, 0) + count
+
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {doc_id: scores[doc_id] + count for doc_id, count in matched.items() if doc_id in scores}
+                if not scores:
+                    return []
+
+        return sorted(((float(score), doc_id) for doc_id, score in scores.items()), reverse=True)
+
+
+def _iter_rows(queryset, batch_size):
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1][0]
+
+
+def _load_ribbits(batch_size):
+    yield from _iter_rows(Ribbit.objects.values_list('id', 'text', 'author__username'), batch_size)
+
+
+def _load_users(batch_size):
+    for user_id, username, bio in _iter_rows(User.objects.values_list('id', 'username', 'bio'), batch_size):
+        yield user_id, f"{username} {bio or ''}"
+
+
+ribbit_index = InvertedIndex(_load_ribbits)
+user_index = InvertedIndex(_load_users)
+
+
+# ---------- INDEX MAINTENANCE ----------
+def ribbit_vector():
+    config = get_search_config()
+    # UPDATE cannot join, so the author's username comes in through a subquery
+    username = Subquery(User.objects.filter(pk=OuterRef('author_id')).values('username')[:1])
+    return SearchVector('text', weight='A', config=config) + SearchVector(username, weight='B', config=config)
+
+
+def user_vector():
+    config = get_search_config()
+    return SearchVector('username', weight='A', config=config) + SearchVector('bio', weight='B', config=config)
+
+
+def index_ribbit(ribbit):
+    if uses_postgres():
+        Ribbit.objects.filter(pk=ribbit.pk).update(search_vector=ribbit_vector())
+    else:
+        ribbit_index.index(ribbit.pk, ribbit.text, ribbit.author.username)
+
+
+def index_author_ribbits(user):
+    """Refresh the search entries of every ribbit by ``user``, after a rename"""
+    if uses_postgres():
+        Ribbit.objects.filter(author=user).update(search_vector=ribbit_vector())
+    else:
+        for ribbit_id, text in Ribbit.objects.filter(author=user).values_list('id', 'text').iterator():
+            ribbit_index.index(ribbit_id, text, user.username)
+
+
+def index_user(user):
+    if uses_postgres():
+        User.objects.filter(pk=user.pk).update(search_vector=user_vector())
+    else:
+        user_index.index(user.pk, f"{user.username} {user.bio or ''}")
+
+
+def rebuild_index(model, batch_size=1000, on_batch=None):
+    """
+    Recompute search vectors for ``model`` ('ribbits' or 'users') in id batches
+
+    Returns the number of rows processed.
+    """
+    if model == 'ribbits':
+        queryset, vector, index = Ribbit.objects.all(), ribbit_vector, ribbit_index
+    else:
+        queryset, vector, index = User.objects.all(), user_vector, user_index
+
+    if not uses_postgres():
+        index.clear()
+        index.load(batch_size)
+        return len(index._documents)
+
+    processed = 0
+    last_id = 0
+    while True:
+        ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        queryset.filter(id__gte=ids[0], id__lte=ids[-1]).update(search_vector=vector())
+        processed += len(ids)
+        last_id = ids[-1]
+        if on_batch:
+            on_batch(last_id, processed)
+    return processed
+
+
+# ---------- QUERIES ----------
+def _search_postgres(queryset, terms, position, limit):
+    # Terms are \w+ tokens, so they are safe to join into a raw tsquery
+    raw = " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+    query = SearchQuery(raw, search_type='raw', config=get_search_config())
+
+    results = (
+        queryset
+        .filter(search_vector=query)
+        .annotate(search_rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+        .order_by('-search_rank', '-id')
+    )
+    if position:
+        rank, pk = position
+        results = results.filter(Q(search_rank__lt=rank) | Q(search_rank=rank, id__lt=pk))
+
+    rows = list(results[:limit + 1])
+    return [(row.search_rank, row) for row in rows]
+
+
+def _search_fallback(queryset, index, terms, position, limit):
+    ranked = index.search(terms)
+    if position:
+        ranked = [(score, pk) for score, pk in ranked if (score, pk) < position]
+
+    hits = []
+    offset = 0
+    while len(hits) <= limit and offset < len(ranked):
+        chunk = ranked[offset:offset + limit + 1]
+        offset += len(chunk)
+        objects = queryset.in_bulk([pk for _, pk in chunk])
+        for score, pk in chunk:
+            if pk in objects:
+                hits.append((score, objects[pk]))
+            else:
+                # Row is gone (deleted without signals, or a rolled back transaction)
+                index.remove(pk)
+    return hits[:limit + 1]
+
+
+def _search(queryset, index, query, cursor, limit):
+    terms = tokenize(query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return SearchPage()
+
+    position = decode_cursor(cursor) if cursor else None
+    if uses_postgres():
+        hits = _search_postgres(queryset, terms, position, limit)
+    else:
+        hits = _search_fallback(queryset, index, terms, position, limit)
+
+    page = SearchPage(results=[obj for _, obj in hits[:limit]])
+    if len(hits) > limit:
+        score, last = hits[limit - 1]
+        page.next_cursor = encode_cursor(score, last.pk)
+    return page
+
+
+def search_ribbits(query, cursor=None, limit=PAGE_SIZE, queryset=None):
+    """Ranked ribbits whose text or author username matches ``query``"""
+    queryset = Ribbit.objects.all() if queryset is None else queryset
+    return _search(queryset, ribbit_index, query, cursor, limit)
+
+
+def search_users(query, cursor=None, limit=PAGE_SIZE, queryset=None):
+    """Ranked users whose username or bio matches ``query``"""
+    queryset = User.objects.all() if queryset is None else queryset
+    return _search(queryset, user_index, query, cursor, limit)
@@ -1,11 +1,19 @@
+import math
 from rest_framework import serializers
 from .models import Ribbit, Comment, Notification, Reply
 from users.serializers import UserSerializer
+from users.follows import are_following
 from django.contrib.auth import get_user_model
-import cloudinary
+from django.db import models
+from django.core.files.uploadedfile import UploadedFile
+from .loaders import load_repost_map
+from .media_probe import probe_media, UnsupportedMedia
 
 User = get_user_model()
 
+# Longest audio or video a ribbit may carry, in seconds
+MAX_MEDIA_DURATION = 30
+
 
 # ---------- USER ----------
 class MinimalUserSerializer(serializers.ModelSerializer):
@@ -21,6 +29,16 @@ class MinimalUserSerializer(serializers.ModelSerializer):
 
 
 # ---------- POSTS ----------
+class PostListSerializer(serializers.ListSerializer):
+    """Loads the repost chains of the whole page once before rendering it"""
+
+    def to_representation(self, data):
+        ribbits = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        request = self.context.get("request")
+        self.context["repost_map"] = load_repost_map(ribbits, getattr(request, "user", None))
+        return super().to_representation(ribbits)
+
+
 class PostSerializer(serializers.ModelSerializer):
     author = MinimalUserSerializer(read_only=True)
     likes_count = serializers.SerializerMethodField()
@@ -33,6 +51,7 @@ class PostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ribbit
+        list_serializer_class = PostListSerializer
         fields = [
             "id",
             "author",
@@ -68,39 +87,31 @@ class PostSerializer(serializers.ModelSerializer):
         media = attrs.get('media', None)
         if not text and not media:
             raise serializers.ValidationError("Either text or media must be provided.")
+        if media:
+            attrs['media_type'] = self.media_info.media_type
         return attrs
 
     def validate_media(self, file):
-        print("VALIDATE MEDIA:", file, file.content_type if hasattr(file, "content_type") else None)
-
+        """Checks the file from its own headers; the model field then uploads it once on save"""
         if not file:
             return file
-
-        upload = cloudinary.uploader.upload(
-            file,
-            resource_type="video",
-            folder="ribbit_media_temp",
-        )
-
-        print("UPLOAD RESPONSE:", upload)
-
-        duration = upload.get("duration", 0)
-
-        if duration > 30:
-            cloudinary.uploader.destroy(upload["public_id"], resource_type="video")
-            raise serializers.ValidationError("Video must be 15 seconds or shorter.")
-
-        cloudinary.uploader.destroy(upload["public_id"], resource_type="video")
-
+        if not isinstance(file, UploadedFile):
+            raise serializers.ValidationError("Media must be an uploaded file.")
+        try:
+            self.media_info = probe_media(file)
+        except UnsupportedMedia:
+            raise serializers.ValidationError("Unsupported or unreadable media file.")
+        duration = self.media_info.duration
+        if not math.isfinite(duration) or duration < 0:
+            # Broken or crafted headers (a NaN or negative Duration) would slip past the limit
+            raise serializers.ValidationError("Unsupported or unreadable media file.")
+        if duration > MAX_MEDIA_DURATION:
+            kind = "Audio" if self.media_info.media_type == 'audio' else "Video"
+            raise serializers.ValidationError(f"{kind} must be {MAX_MEDIA_DURATION} seconds or shorter.")
         return file
 
-
-
     def get_likes_count(self, obj):
-        annotated = getattr(obj, "likes_count", None)
-        if annotated is not None:
-            return annotated
-        return obj.likes.count()
+        return obj.like_count
 
     def get_is_liked(self, obj):
         annotated = getattr(obj, "is_liked", None)
@@ -113,20 +124,26 @@ class PostSerializer(serializers.ModelSerializer):
         return False
 
     def get_comment_count(self, obj):
-        annotated = getattr(obj, "comment_count", None)
-        if annotated is not None:
-            return annotated
-        return obj.comments.count()
+        return obj.comment_count
 
     def get_repost(self, obj):
-        if obj.parent:
-            return PostSerializer(obj.parent, context=self.context).data
-        return None
+        if not obj.parent_id:
+            return None
+
+        # Nested reposts render from the page-wide map built by PostListSerializer
+        repost_map = self.context.get("repost_map")
+        if repost_map is None or obj.parent_id not in repost_map:
+            request = self.context.get("request")
+            repost_map = load_repost_map([obj], getattr(request, "user", None))
+
+        parent = repost_map.get(obj.parent_id)
+        if parent is None:
+            return None
+        return PostSerializer(parent, context={**self.context, "repost_map": repost_map}).data
 
 
     def get_reribbit_count(self, obj):
-        # Use the annotated value if available, otherwise fall back to the model field
-        return getattr(obj, "reribbit_count_annotated", getattr(obj, "reribbit_count", 0))
+        return obj.reribbit_count
 
     def get_media_url(self, obj):
         if obj.media:
@@ -170,8 +187,18 @@ class replyserializer(serializers.ModelSerializer):
         read_only_fields = ["comment", "author", "created_at"]
 
 # ---------- PUBLIC USER ----------
+class PublicUserListSerializer(serializers.ListSerializer):
+    """Looks up whether the viewer follows each user of the page at once"""
+
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        request = self.context.get("request")
+        if request:
+            self.context["follow_state"] = are_following(request.user, [user.id for user in users])
+        return super().to_representation(users)
+
+
 class PublicUserSerializer(serializers.ModelSerializer):
-    ribbits = PostSerializer(many=True, read_only=True)
     followers_count = serializers.SerializerMethodField()
     following_count = serializers.SerializerMethodField()
     is_following = serializers.SerializerMethodField()
@@ -181,6 +208,7 @@ class PublicUserSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
+        list_serializer_class = PublicUserListSerializer
         fields = [
             "id",
             "email",
@@ -194,20 +222,22 @@ class PublicUserSerializer(serializers.ModelSerializer):
             "followers_count",
             "following_count",
             "is_following",
-            "ribbits",
         ]
 
     def get_followers_count(self, obj):
-        return obj.followers.count()
+        return obj.followers_count
 
     def get_following_count(self, obj):
-        return obj.following.count()
+        return obj.following_count
 
     def get_is_following(self, obj):
         request = self.context.get("request")
-        if request and request.user.is_authenticated:
-            return request.user.following.filter(id=obj.id).exists()
-        return False
+        if not (request and request.user.is_authenticated):
+            return False
+        follow_state = self.context.get("follow_state")
+        if follow_state is None or obj.id not in follow_state:
+            follow_state = are_following(request.user, [obj.id])
+        return follow_state[obj.id]
 
     def get_profile_pic_url(self, obj):
         if obj.profile_pic:
@@ -2,10 +2,21 @@
 Django Signals for Ribbits App
 Automatically trigger email notifications for certain events
 """
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
-from .models import Ribbit
+from django.db import transaction
+from copy import copy
+from .models import Ribbit, Like, Comment, EmailPreferences
 from .email_queue import queue_new_post_notification
+from .counters import adjust_ribbit_counter, release_user_counters
+from .tasks import run_deferred
+from .email_prefs import cache_prefs, invalidate_prefs
+from .search import index_author_ribbits, index_ribbit, index_user, ribbit_index, user_index
+from .profiles import invalidate_profile_header
+from django.contrib.auth import get_user_model
+from users.follows import forget_follows
+
+User = get_user_model()
 
 
 @receiver(post_save, sender=Ribbit)
@@ -16,6 +27,9 @@ def notify_followers_on_new_post(sender, instance, created, **kwargs):
     Only triggers for:
     - New posts (not updates)
     - Original posts (not replies or reribbits)
+
+    The fan-out runs after commit in the background so posting stays fast
+    no matter how many followers the author has.
     """
     # Only trigger for new posts, not updates
     if not created:
@@ -25,13 +39,95 @@ def notify_followers_on_new_post(sender, instance, created, **kwargs):
     if instance.parent or instance.is_reribbit:
         return
     
-    # Get all followers of the post author
-    followers = instance.author.followers.all()
-    
-    if followers.exists():
-        # Queue email notifications to all followers
-        queued_count = queue_new_post_notification(instance, followers)
-        
-        # Optional: log the action (useful for debugging)
-        if queued_count > 0:
-            print(f"Queued {queued_count} email notifications for new post by @{instance.author.username}")
+    run_deferred(queue_new_post_notification, instance.id)
+
+
+@receiver(post_save, sender=Like)
+def increment_like_count(sender, instance, created, **kwargs):
+    """Keep Ribbit.like_count current when a like is added"""
+    if created:
+        adjust_ribbit_counter(instance.ribbit_id, 'like_count', 1)
+
+
+@receiver(post_save, sender=Comment)
+def increment_comment_count(sender, instance, created, **kwargs):
+    """Keep Ribbit.comment_count current when a comment is added"""
+    if created:
+        adjust_ribbit_counter(instance.ribbit_id, 'comment_count', 1)
+
+
+
+def _touches(update_fields, *fields):
+    return update_fields is None or any(name in update_fields for name in fields)
+
+
+@receiver(post_save, sender=Ribbit)
+def update_ribbit_search_index(sender, instance, update_fields=None, **kwargs):
+    """Refresh the ribbit's search vector when its text may have changed"""
+    if _touches(update_fields, 'text'):
+        index_ribbit(instance)
+
+
+@receiver(post_delete, sender=Ribbit)
+def remove_ribbit_from_search_index(sender, instance, **kwargs):
+    ribbit_index.remove(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def update_user_search_index(sender, instance, update_fields=None, **kwargs):
+    """Refresh the user's search vector when username or bio may have changed, and their ribbits' on a rename"""
+    if _touches(update_fields, 'username', 'bio'):
+        index_user(instance)
+    previous = getattr(instance, '_previous_username', None)
+    if previous is not None and previous != instance.username:
+        index_author_ribbits(instance)
+
+
+@receiver(post_delete, sender=User)
+def remove_user_from_search_index(sender, instance, **kwargs):
+    user_index.remove(instance.pk)
+
+
+@receiver(pre_save, sender=User)
+def remember_previous_username(sender, instance, update_fields=None, **kwargs):
+    """Note the stored username before a save that may rename the user, so its cached header goes too"""
+    instance._previous_username = None
+    if instance.pk is not None and _touches(update_fields, 'username'):
+        instance._previous_username = (
+            User.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    usernames = {instance.username, getattr(instance, '_previous_username', None)} - {None}
+    invalidate_profile_header(*usernames)
+    transaction.on_commit(lambda: invalidate_profile_header(*usernames))
+
+
+@receiver(pre_delete, sender=User)
+def release_follow_counters(sender, instance, **kwargs):
+    """Keep other users' follower/following counts right when a user's follow edges cascade away"""
+    forget_follows(instance)
+
+
+@receiver(pre_delete, sender=User)
+def release_ribbit_counters(sender, instance, **kwargs):
+    """Take a deleted user's likes and comments off other ribbits' counters in bulk; the rows then cascade as fast deletes"""
+    release_user_counters(instance)
+
+
+@receiver(post_save, sender=EmailPreferences)
+def write_through_email_prefs(sender, instance, **kwargs):
+    """Drop the stale copy now and cache the new row once it is committed"""
+    invalidate_prefs(instance.user_id)
+    saved = copy(instance)
+    transaction.on_commit(lambda: cache_prefs(saved))
+
+
+@receiver(post_delete, sender=EmailPreferences)
+def invalidate_email_prefs(sender, instance, **kwargs):
+    user_id = instance.user_id
+    invalidate_prefs(user_id)
+    transaction.on_commit(lambda: invalidate_prefs(user_id))
@@ -0,0 +1,80 @@
+"""
+Deferred Tasks
+Run work after the current transaction commits, off the request thread
+
+Tasks go to one long-lived worker thread per process through an in-memory
+queue, so a write costs a queue put instead of a new thread and a new
+database connection. The worker runs tasks in the order they were
+committed, keeps its connection between tasks (close_old_connections drops
+it when it is too old or broken), logs failures, and is given a few seconds
+to drain the queue when the process exits.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# How long an exiting process waits for queued tasks to finish
+DRAIN_TIMEOUT_SECONDS = 5
+
+_tasks = queue.Queue()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _work():
+    while True:
+        func, args, kwargs = _tasks.get()
+        try:
+            close_old_connections()
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception("Deferred task %s failed", getattr(func, '__name__', func))
+        finally:
+            _tasks.task_done()
+
+
+def _ensure_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name='deferred-tasks', daemon=True)
+            _worker.start()
+
+
+def drain(timeout=DRAIN_TIMEOUT_SECONDS):
+    """Wait up to ``timeout`` seconds for queued tasks to finish; True if the queue emptied"""
+    deadline = time.monotonic() + timeout
+    while _tasks.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            logger.warning("Exiting with %d deferred tasks unfinished", _tasks.unfinished_tasks)
+            return False
+        time.sleep(0.01)
+    return True
+
+
+atexit.register(drain)
+
+
+def run_deferred(func, *args, **kwargs):
+    """
+    Schedule ``func(*args, **kwargs)`` to run once the surrounding transaction commits
+
+    The task is handed to the background worker so the request returns
+    immediately. With DEFERRED_TASKS_INLINE (used by the test suite) it runs
+    synchronously in the committing thread instead.
+    """
+    def start():
+        if getattr(settings, 'DEFERRED_TASKS_INLINE', False):
+            func(*args, **kwargs)
+            return
+        _ensure_worker()
+        _tasks.put((func, args, kwargs))
+
+    transaction.on_commit(start)
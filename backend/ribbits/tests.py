@@ -3,12 +3,17 @@ Tests for the Ribbits app.
 Covers: Post creation/deletion, Feed, Likes, Comments, Reposts,
         Search, Notifications.
 """
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from .models import Ribbit, Like, Comment, Notification
+from io import BytesIO, StringIO
+from .models import Ribbit, Like, Comment, Notification, TimelineEntry, EmailQueue, EmailPreferences, EmailBody, EmailHistory
+from .email_bodies import email_bodies
 
 User = get_user_model()
 
@@ -32,6 +37,14 @@ def create_ribbit(user, text="Hello pond!"):
     return Ribbit.objects.create(author=user, text=text)
 
 
+def reset_email_prefs_cache():
+    # User ids are reused after each test's rollback, so cached preferences would leak
+    from django.core.cache import cache
+    from .email_prefs import clear_local_prefs_cache
+    clear_local_prefs_cache()
+    cache.clear()
+
+
 # ---------------------------------------------------------------------------
 # Post (Ribbit) Creation Tests
 # ---------------------------------------------------------------------------
@@ -125,6 +138,73 @@ class FeedTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+# ---------------------------------------------------------------------------
+# Home Timeline Tests
+# ---------------------------------------------------------------------------
+class HomeTimelineTests(TestCase):
+
+    def setUp(self):
+        from django.core.cache import cache
+        from users.follows import follow
+        cache.clear()
+        self.user = create_user()
+        self.followed = create_user(username="followed", email="followed@test.com")
+        self.stranger = create_user(username="stranger", email="stranger@test.com")
+        follow(self.user, self.followed)
+        self.client = get_auth_client(self.user)
+        self.url = reverse("home-timeline")
+
+    def _texts(self, response):
+        return [r["text"] for r in response.data["results"]]
+
+    def test_post_fans_out_to_followers(self):
+        get_auth_client(self.followed).post(reverse("post"), {"text": "Fanned out"})
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("Fanned out", self._texts(response))
+
+    def test_home_excludes_unfollowed_authors(self):
+        get_auth_client(self.stranger).post(reverse("post"), {"text": "Not for you"})
+        response = self.client.get(self.url)
+        self.assertNotIn("Not for you", self._texts(response))
+
+    def test_own_posts_and_reposts_appear(self):
+        self.client.post(reverse("post"), {"text": "My own"})
+        original = create_ribbit(self.stranger, "Original")
+        self.client.post(reverse("repost-with-opinion", kwargs={"pk": original.pk}), {}, format="json")
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user).count(), 2)
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0)
+    def test_high_fanout_author_merged_at_read_time(self):
+        get_auth_client(self.followed).post(reverse("post"), {"text": "Celebrity post"})
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+        response = self.client.get(self.url)
+        self.assertIn("Celebrity post", self._texts(response))
+
+    @override_settings(TIMELINE_FANOUT_MAX_FOLLOWERS=0)
+    def test_high_fanout_checks_read_the_follower_counter(self):
+        from users.follows import followee_ids
+        from .timeline import merge_high_fanout_authors
+        followee_ids(self.user.id)  # Followee sets are cached; only a cold cache reads edges
+        with CaptureQueriesContext(connection) as queries:
+            get_auth_client(self.followed).post(reverse("post"), {"text": "Celebrity post"})
+            merge_high_fanout_authors(self.user)
+        self.assertFalse(any('users_follow' in query['sql'] for query in queries))
+
+    def test_follow_and_unfollow_update_timeline(self):
+        create_ribbit(self.stranger, "Old stranger post")
+        follow_url = reverse("follow", kwargs={"username": self.stranger.username})
+        self.client.post(follow_url)
+        self.assertIn("Old stranger post", self._texts(self.client.get(self.url)))
+        self.client.post(follow_url)
+        self.assertNotIn("Old stranger post", self._texts(self.client.get(self.url)))
+
+    def test_backfill_command(self):
+        create_ribbit(self.followed, "Before the store existed")
+        call_command("backfill_timelines", stdout=StringIO())
+        self.assertIn("Before the store existed", self._texts(self.client.get(self.url)))
+
+
 # ---------------------------------------------------------------------------
 # My Ribbits Tests
 # ---------------------------------------------------------------------------
@@ -179,6 +259,47 @@ class LikeTests(TestCase):
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_toggle_answers_with_state_only(self):
+        response = self.client.post(self.url)
+        self.assertEqual(response.data, {"status": "liked", "likes_count": 1, "is_liked": True})
+        response = self.client.post(self.url)
+        self.assertEqual(response.data, {"status": "unliked", "likes_count": 0, "is_liked": False})
+
+    def test_toggle_query_count(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        def statements(queries):
+            return [q["sql"].split()[0] for q in queries if "SAVEPOINT" not in q["sql"]]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url)
+        # Ribbit lookup, delete that finds nothing to unlike, insert and counter update
+        self.assertEqual(statements(queries), ["SELECT", "DELETE", "INSERT", "UPDATE"])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url)
+        # Ribbit lookup, delete, counter update, then the notification retraction
+        self.assertEqual(statements(queries)[:3], ["SELECT", "DELETE", "UPDATE"])
+
+    def test_like_state_for_many_ribbits(self):
+        others = [create_ribbit(self.user, f"Croak {i}") for i in range(3)]
+        Like.objects.create(ribbit=others[1], user=self.other)
+        Like.objects.create(ribbit=others[2], user=self.user)
+        ids = ",".join(str(ribbit.id) for ribbit in others)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("like-state"), {"ids": ids})
+        self.assertEqual(response.data["is_liked"], {
+            str(others[0].id): False, str(others[1].id): True, str(others[2].id): False,
+        })
+
+    def test_like_state_rejects_bad_ids(self):
+        from .likes import LIKE_STATE_MAX_IDS
+        url = reverse("like-state")
+        self.assertEqual(self.client.get(url, {"ids": "1,frog"}).status_code, status.HTTP_400_BAD_REQUEST)
+        too_many = ",".join(str(i) for i in range(LIKE_STATE_MAX_IDS + 1))
+        self.assertEqual(self.client.get(url, {"ids": too_many}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url).data, {"is_liked": {}})
+
 
 # ---------------------------------------------------------------------------
 # Comment Tests
@@ -214,6 +335,85 @@ class CommentTests(TestCase):
         self.assertEqual(Comment.objects.count(), 0)
 
 
+# ---------------------------------------------------------------------------
+# Denormalized Counter Tests
+# ---------------------------------------------------------------------------
+class RibbitCounterTests(TestCase):
+
+    def setUp(self):
+        self.author = create_user()
+        self.fan = create_user(username="fan", email="fan@test.com")
+        self.ribbit = create_ribbit(self.author)
+        self.client = get_auth_client(self.fan)
+
+    def test_like_toggle_updates_like_count(self):
+        url = reverse("like-ribbit", kwargs={"pk": self.ribbit.pk})
+        response = self.client.post(url)
+        self.assertEqual(response.data["likes_count"], 1)
+        self.ribbit.refresh_from_db()
+        self.assertEqual(self.ribbit.like_count, 1)
+        self.client.post(url)
+        self.ribbit.refresh_from_db()
+        self.assertEqual(self.ribbit.like_count, 0)
+
+    def test_comment_create_and_delete_update_comment_count(self):
+        self.client.post(reverse("comments", kwargs={"pk": self.ribbit.pk}), {"text": "Ribbit!"})
+        self.ribbit.refresh_from_db()
+        self.assertEqual(self.ribbit.comment_count, 1)
+        comment = Comment.objects.get()
+        self.client.delete(reverse("delete_comment", kwargs={"ribbit_id": self.ribbit.pk, "comment_id": comment.pk}))
+        self.ribbit.refresh_from_db()
+        self.assertEqual(self.ribbit.comment_count, 0)
+
+    def test_cascade_delete_of_user_decrements_counts(self):
+        Like.objects.create(ribbit=self.ribbit, user=self.fan)
+        Comment.objects.create(ribbit=self.ribbit, author=self.fan, text="Hi")
+        self.fan.delete()
+        self.ribbit.refresh_from_db()
+        self.assertEqual((self.ribbit.like_count, self.ribbit.comment_count), (0, 0))
+
+    def test_cascades_are_fast_deletes(self):
+        readers = [create_user(username=f"reader{i}", email=f"reader{i}@test.com") for i in range(5)]
+        other = create_ribbit(self.author, "Other")
+        for reader in readers:
+            Like.objects.create(ribbit=self.ribbit, user=reader)
+            Comment.objects.create(ribbit=self.ribbit, author=self.fan, text="Hi")
+        Like.objects.create(ribbit=other, user=self.fan)
+
+        # A deleted ribbit's likes and comments are not loaded or counted down one by one
+        def counter_updates(queries):
+            return [q['sql'] for q in queries if q['sql'].startswith('UPDATE') and '_count"' in q['sql']]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.ribbit.delete()
+        self.assertEqual(counter_updates(queries), [])
+        self.assertFalse(any('FROM "ribbits_like"' in q['sql'] and q['sql'].startswith('SELECT') for q in queries))
+
+        # A deleted user's likes and comments come off other ribbits' counters in bulk
+        ribbit = create_ribbit(self.author, "Third")
+        for _ in range(3):
+            Comment.objects.create(ribbit=ribbit, author=self.fan, text="Again")
+        with CaptureQueriesContext(connection) as queries:
+            self.fan.delete()
+        # One grouped UPDATE per ribbit counter
+        self.assertEqual(len([sql for sql in counter_updates(queries) if 'ribbits_ribbit' in sql]), 2)
+        other.refresh_from_db()
+        ribbit.refresh_from_db()
+        self.assertEqual((other.like_count, ribbit.comment_count), (0, 0))
+
+    def test_feed_reads_counters_without_aggregating(self):
+        Like.objects.create(ribbit=self.ribbit, user=self.fan)
+        response = self.client.get(reverse("feed"))
+        self.assertEqual(response.data["results"][0]["likes_count"], 1)
+
+    def test_recount_command_repairs_drift(self):
+        Like.objects.create(ribbit=self.ribbit, user=self.fan)
+        Ribbit.objects.filter(pk=self.ribbit.pk).update(like_count=42, comment_count=7)
+        call_command("recount_ribbit_counters", "--batch-size", "1", stdout=StringIO())
+        self.ribbit.refresh_from_db()
+        self.assertEqual((self.ribbit.like_count, self.ribbit.comment_count), (1, 0))
+
+
 # ---------------------------------------------------------------------------
 # Search Tests
 # ---------------------------------------------------------------------------
@@ -228,10 +428,68 @@ class SearchTests(TestCase):
         create_ribbit(self.user, "Unique pond phrase")
         response = self.client.get(self.url, {"q": "Unique pond phrase"})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["text"] for r in response.data["ribbits"]], ["Unique pond phrase"])
 
     def test_search_user_by_username(self):
         response = self.client.get(self.url, {"q": "ribbituser"})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([u["username"] for u in response.data["users"]], ["ribbituser"])
+
+    def test_last_term_matches_as_prefix(self):
+        create_ribbit(self.user, "Lilypad gossip")
+        response = self.client.get(self.url, {"q": "lilyp"})
+        self.assertEqual(len(response.data["ribbits"]), 1)
+
+    def test_results_are_ranked(self):
+        create_ribbit(self.user, "frog")
+        create_ribbit(self.user, "frog frog frog")
+        response = self.client.get(self.url, {"q": "frog"})
+        self.assertEqual(response.data["ribbits"][0]["text"], "frog frog frog")
+
+    def test_search_ribbit_by_author_username(self):
+        other = create_user(username="pondkeeper", email="keeper@example.com")
+        create_ribbit(other, "Morning on the lily pads")
+        create_ribbit(self.user, "Say hi to pondkeeper")
+        response = self.client.get(self.url, {"q": "pondkeeper"})
+        # A mention in the text ranks above a match on the author alone
+        self.assertEqual(
+            [r["text"] for r in response.data["ribbits"]],
+            ["Say hi to pondkeeper", "Morning on the lily pads"],
+        )
+
+    def test_renamed_author_ribbits_are_reindexed(self):
+        create_ribbit(self.user, "Morning on the lily pads")
+        self.user.username = "bullfrog"
+        self.user.save()
+        self.assertEqual(len(self.client.get(self.url, {"q": "ribbituser"}).data["ribbits"]), 0)
+        self.assertEqual(len(self.client.get(self.url, {"q": "bullfrog"}).data["ribbits"]), 1)
+
+    def test_edited_ribbit_is_reindexed(self):
+        ribbit = create_ribbit(self.user, "Before edit")
+        ribbit.text = "Tadpole"
+        ribbit.save()
+        self.assertEqual(len(self.client.get(self.url, {"q": "before"}).data["ribbits"]), 0)
+        self.assertEqual(len(self.client.get(self.url, {"q": "tadpole"}).data["ribbits"]), 1)
+
+    def test_cursor_pagination(self):
+        for i in range(12):
+            create_ribbit(self.user, f"croak number {i}")
+        first = self.client.get(self.url, {"q": "croak"})
+        self.assertEqual(len(first.data["ribbits"]), 10)
+        second = self.client.get(self.url, {"q": "croak", "type": "ribbits", "cursor": first.data["ribbits_next"]})
+        self.assertEqual(len(second.data["ribbits"]), 2)
+        self.assertNotIn("users", second.data)
+        seen = {r["id"] for r in first.data["ribbits"]} | {r["id"] for r in second.data["ribbits"]}
+        self.assertEqual(len(seen), 12)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {"q": "croak", "type": "ribbits", "cursor": "???"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_rebuild_command(self):
+        create_ribbit(self.user, "Rebuilt entry")
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(len(self.client.get(self.url, {"q": "rebuilt"}).data["ribbits"]), 1)
 
     def test_empty_search_returns_results(self):
         response = self.client.get(self.url, {"q": ""})
@@ -249,6 +507,7 @@ class SearchTests(TestCase):
 class UserDetailTests(TestCase):
 
     def setUp(self):
+        reset_email_prefs_cache()
         self.user = create_user()
         self.client = get_auth_client(self.user)
 
@@ -263,6 +522,63 @@ class UserDetailTests(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_profile_header_is_cached_until_the_profile_changes(self):
+        other = create_user(username="other", email="other@test.com")
+        create_ribbit(other, "Not in the header")
+        url = reverse("search-user", kwargs={"username": other.username})
+        response = self.client.get(url)
+        self.assertNotIn("ribbits", response.data)
+        self.assertFalse(response.data["is_following"])
+
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("follow", kwargs={"username": other.username}))
+        response = self.client.get(url)
+        self.assertEqual(response.data["followers_count"], 1)
+        self.assertTrue(response.data["is_following"])
+
+        other.bio = "Lives under a lily pad"
+        other.save()
+        self.assertEqual(self.client.get(url).data["bio"], "Lives under a lily pad")
+
+    def test_rename_drops_the_old_username_header(self):
+        other = create_user(username="other", email="other@test.com")
+        old_url = reverse("search-user", kwargs={"username": "other"})
+        self.assertEqual(self.client.get(old_url).status_code, status.HTTP_200_OK)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.username = "renamed"
+            other.save()
+        self.assertEqual(self.client.get(old_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(
+            self.client.get(reverse("profile-ribbits", kwargs={"username": "other"})).status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+        response = self.client.get(reverse("search-user", kwargs={"username": "renamed"}))
+        self.assertEqual(response.data["id"], other.id)
+
+    def test_profile_ribbits_are_paginated(self):
+        other = create_user(username="other", email="other@test.com")
+        for i in range(12):
+            create_ribbit(other, f"Croak {i}")
+        create_ribbit(self.user, "Someone else's")
+        Like.objects.create(ribbit=Ribbit.objects.get(text="Croak 11"), user=self.user)
+        url = reverse("profile-ribbits", kwargs={"username": other.username})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertEqual(response.data["results"][0]["text"], "Croak 11")
+        self.assertTrue(response.data["results"][0]["is_liked"])
+        second = self.client.get(response.data["next"])
+        self.assertEqual([r["text"] for r in second.data["results"]], ["Croak 1", "Croak 0"])
+
+    def test_profile_ribbits_of_unknown_user(self):
+        url = reverse("profile-ribbits", kwargs={"username": "nobody9999"})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
 
 # ---------------------------------------------------------------------------
 # Repost Tests
@@ -286,12 +602,58 @@ class RepostTests(TestCase):
         self.assertGreaterEqual(self.ribbit.reribbit_count, 1)
 
 
+# ---------------------------------------------------------------------------
+# Nested Repost Serialization Tests
+# ---------------------------------------------------------------------------
+class RepostChainSerializationTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = get_auth_client(self.user)
+
+    def _make_chains(self, count, depth):
+        Ribbit.objects.all().delete()
+        for i in range(count):
+            post = create_ribbit(self.user, f"Original {i}")
+            for level in range(depth):
+                post = Ribbit.objects.create(
+                    author=self.user, text=f"Quote {i}.{level}", parent=post,
+                    is_reribbit=True, reribbit_of=post,
+                )
+
+    def _feed_query_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("feed"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(queries), response
+
+    def test_query_count_independent_of_chain_depth(self):
+        self._make_chains(10, depth=2)
+        shallow, _ = self._feed_query_count()
+        self._make_chains(10, depth=6)
+        deep, _ = self._feed_query_count()
+        self.assertEqual(shallow, deep)
+
+    def test_nested_reposts_render_full_chain(self):
+        original = create_ribbit(self.user, "Root")
+        Like.objects.create(ribbit=original, user=self.user)
+        quote = Ribbit.objects.create(author=self.user, text="Quote", parent=original, is_reribbit=True)
+        Ribbit.objects.create(author=self.user, text="Quote of quote", parent=quote, is_reribbit=True)
+        _, response = self._feed_query_count()
+        top = response.data["results"][0]
+        self.assertEqual(top["repost"]["text"], "Quote")
+        self.assertEqual(top["repost"]["repost"]["text"], "Root")
+        self.assertTrue(top["repost"]["repost"]["is_liked"])
+        self.assertEqual(top["repost"]["repost"]["likes_count"], 1)
+
+
 # ---------------------------------------------------------------------------
 # Notification Tests
 # ---------------------------------------------------------------------------
 class NotificationTests(TestCase):
 
     def setUp(self):
+        reset_email_prefs_cache()
         self.user = create_user()
         self.sender = create_user(username="sender", email="sender@test.com")
         self.client = get_auth_client(self.user)
@@ -325,3 +687,1150 @@ class NotificationTests(TestCase):
             print("ERROR: Unauthenticated user got 200 on notifications:")
             print(response.data)
         self.assertIn(response.status_code, [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+
+    def _like(self, ribbit):
+        with self.captureOnCommitCallbacks(execute=True):
+            return get_auth_client(self.sender).post(reverse("like-ribbit", kwargs={"pk": ribbit.pk}))
+
+    def test_like_notifies_author_and_unlike_retracts(self):
+        from .notifications import unread_count
+        ribbit = create_ribbit(self.user)
+        self.assertEqual(unread_count(self.user.id), 0)
+        self._like(ribbit)
+        notification = Notification.objects.get(receiver=self.user)
+        self.assertEqual((notification.sender, notification.notif_type, notification.post), (self.sender, "like", ribbit))
+        # The cached count is dropped and recounted once
+        self.assertEqual(unread_count(self.user.id), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(unread_count(self.user.id), 1)
+        # In-app only: no instant email is queued
+        self.assertFalse(EmailQueue.objects.exists())
+
+        self._like(ribbit)
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(unread_count(self.user.id), 0)
+
+    def test_unlike_before_the_notification_is_written_leaves_none(self):
+        from .likes import toggle_like
+        from .notifications import unread_count
+        ribbit = create_ribbit(self.user)
+        self.assertEqual(unread_count(self.user.id), 0)
+        # Both deferred writes run only after the unlike has committed
+        with self.captureOnCommitCallbacks() as callbacks:
+            toggle_like(self.sender, ribbit.id)
+            toggle_like(self.sender, ribbit.id)
+        self.assertFalse(Notification.objects.exists())
+        for callback in callbacks:
+            callback()
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(unread_count(self.user.id), 0)
+
+    def test_comment_notification_carries_text(self):
+        ribbit = create_ribbit(self.user)
+        client = get_auth_client(self.sender)
+        with self.captureOnCommitCallbacks(execute=True):
+            client.post(reverse("comments", kwargs={"pk": ribbit.pk}), {"text": "Nice one"}, format="json")
+        notification = Notification.objects.get(receiver=self.user)
+        self.assertEqual((notification.notif_type, notification.message), ("comment", "Nice one"))
+
+    def test_own_actions_are_not_notified(self):
+        ribbit = create_ribbit(self.sender)
+        self._like(ribbit)
+        self.assertFalse(Notification.objects.exists())
+
+    def test_list_query_count_does_not_grow_with_rows(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        ribbit = create_ribbit(self.user)
+        Notification.objects.create(sender=self.sender, receiver=self.user, notif_type="like", post=ribbit)
+        baseline = count_queries()
+        for i in range(10):
+            other = create_user(username=f"fan{i}", email=f"fan{i}@test.com")
+            Notification.objects.create(sender=other, receiver=self.user, notif_type="like", post=ribbit)
+        self.assertEqual(count_queries(), baseline)
+
+    def test_unread_filter_and_mark_read(self):
+        from .notifications import unread_count
+        notifications = [
+            Notification.objects.create(sender=self.sender, receiver=self.user, notif_type="follow")
+            for _ in range(3)
+        ]
+        response = self.client.post(reverse("notifications-mark-read"), {"ids": [notifications[0].id]}, format="json")
+        self.assertEqual(response.data, {"marked": 1, "unread_count": 2})
+        response = self.client.get(self.url, {"unread": "true"})
+        self.assertEqual(len(response.data["results"]), 2)
+
+        response = self.client.post(reverse("notifications-mark-read"), {"all": True}, format="json")
+        self.assertEqual(response.data, {"marked": 2, "unread_count": 0})
+        response = self.client.get(reverse("notifications-unread-count"))
+        self.assertEqual(response.data, {"unread_count": 0})
+        self.assertEqual(unread_count(self.user.id), 0)
+
+    def test_mark_read_rejects_bad_ids(self):
+        response = self.client.post(reverse("notifications-mark-read"), {"ids": "all"}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+# ---------------------------------------------------------------------------
+# Notification Websocket Tests
+# ---------------------------------------------------------------------------
+class NotificationWebsocketTests(TestCase):
+
+    def setUp(self):
+        from .realtime import reset_broker
+        reset_email_prefs_cache()
+        reset_broker()
+        self.addCleanup(reset_broker)
+        self.user = create_user()
+        self.sender = create_user(username="sender", email="sender@test.com")
+
+    async def _connect(self, query_string=b"", path="/ws/notifications/"):
+        import asyncio
+        from croak.asgi import application
+        inbox, outbox = asyncio.Queue(), asyncio.Queue()
+        scope = {"type": "websocket", "path": path, "query_string": query_string, "headers": []}
+        task = asyncio.ensure_future(application(scope, inbox.get, outbox.put))
+        await inbox.put({"type": "websocket.connect"})
+        return task, inbox, outbox
+
+    async def _next(self, outbox):
+        import asyncio
+        import json
+        message = await asyncio.wait_for(outbox.get(), timeout=5)
+        if message["type"] == "websocket.send":
+            return json.loads(message["text"])
+        return message
+
+    async def test_rejects_missing_or_bad_token(self):
+        for query_string in (b"", b"token=not-a-jwt"):
+            task, _, outbox = await self._connect(query_string)
+            self.assertEqual(await self._next(outbox), {"type": "websocket.close", "code": 4401})
+            await task
+
+    async def test_unknown_path_is_closed(self):
+        task, _, outbox = await self._connect(path="/ws/other/")
+        self.assertEqual((await self._next(outbox))["type"], "websocket.close")
+        await task
+
+    async def test_pushes_new_notifications(self):
+        from asgiref.sync import sync_to_async
+        from rest_framework_simplejwt.tokens import AccessToken
+        from users.models import Follow
+        from .notifications import create_notifications, mark_read
+        from .realtime import get_broker, user_channel
+        token = str(AccessToken.for_user(self.user))
+        task, inbox, outbox = await self._connect(f"token={token}".encode())
+        self.assertEqual(await self._next(outbox), {"type": "websocket.accept"})
+        self.assertEqual(await self._next(outbox), {"type": "unread_count", "unread_count": 0})
+
+        await sync_to_async(Follow.objects.create)(from_user=self.sender, to_user=self.user)
+        await sync_to_async(create_notifications)([
+            Notification(sender_id=self.sender.id, receiver_id=self.user.id, notif_type="follow")
+        ])
+        event = await self._next(outbox)
+        self.assertEqual(event["type"], "notification")
+        self.assertEqual(event["notification"]["sender_username"], "sender")
+        self.assertEqual(event["notification"]["message"], "followed you")
+
+        await sync_to_async(mark_read)(self.user.id)
+        self.assertEqual(await self._next(outbox), {"type": "unread_count", "unread_count": 0})
+
+        await inbox.put({"type": "websocket.disconnect", "code": 1000})
+        await task
+        self.assertFalse(get_broker().has_subscribers(user_channel(self.user.id)))
+
+
+# ---------------------------------------------------------------------------
+# Deferred Task Tests
+# ---------------------------------------------------------------------------
+@override_settings(DEFERRED_TASKS_INLINE=False)
+class DeferredTaskTests(TestCase):
+
+    def test_tasks_run_in_order_on_one_worker_and_failures_are_logged(self):
+        import threading
+        from .tasks import run_deferred, drain
+        ran = []
+
+        def record(value):
+            ran.append((value, threading.current_thread().name))
+
+        def fail():
+            raise RuntimeError("boom")
+
+        with self.assertLogs('ribbits.tasks', level='ERROR') as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                run_deferred(record, 1)
+                run_deferred(fail)
+                run_deferred(record, 2)
+            self.assertTrue(drain(timeout=5))
+        self.assertEqual(ran, [(1, 'deferred-tasks'), (2, 'deferred-tasks')])
+        self.assertIn("Deferred task fail failed", logs.output[0])
+        self.assertIn("RuntimeError: boom", logs.output[0])
+
+
+# ---------------------------------------------------------------------------
+# New Post Email Fan-out Tests
+# ---------------------------------------------------------------------------
+class NewPostEmailFanoutTests(TestCase):
+
+    def setUp(self):
+        reset_email_prefs_cache()
+        self.author = create_user()
+
+    def _add_followers(self, count, start=0):
+        followers = [
+            create_user(username=f"fan{i}", email=f"fan{i}@test.com")
+            for i in range(start, start + count)
+        ]
+        for follower in followers:
+            follower.following.add(self.author)
+        return followers
+
+    def test_fanout_runs_after_commit(self):
+        self._add_followers(2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            create_ribbit(self.author, "Deferred")
+        self.assertEqual(EmailQueue.objects.count(), 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(EmailQueue.objects.count(), 2)
+
+    def test_opted_out_followers_are_skipped_and_names_personalized(self):
+        fan, muted = self._add_followers(2)
+        EmailPreferences.objects.create(user=muted, email_on_new_post_from_following=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_ribbit(self.author, "Hello followers")
+        email = EmailQueue.objects.get()
+        self.assertEqual(email.recipient, fan)
+        html_body, text_body = email_bodies(email)
+        self.assertIn(f"Hey {fan.first_name},", text_body)
+        self.assertNotIn("\x1a", html_body)
+
+    def test_query_count_does_not_grow_with_followers(self):
+        from .email_queue import queue_new_post_notification
+        self._add_followers(3)
+        post = Ribbit.objects.create(author=self.author, text="Few", is_reribbit=True)
+        queue_new_post_notification(post.id, chunk_size=50)  # stores the shared body
+        reset_email_prefs_cache()
+        with CaptureQueriesContext(connection) as few:
+            queue_new_post_notification(post.id, chunk_size=50)
+        self._add_followers(12, start=3)
+        reset_email_prefs_cache()
+        with CaptureQueriesContext(connection) as many:
+            queue_new_post_notification(post.id, chunk_size=50)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(EmailQueue.objects.count(), 3 + 3 + 15)
+        self.assertEqual(EmailBody.objects.count(), 1)
+
+
+# ---------------------------------------------------------------------------
+# Email Preferences Cache Tests
+# ---------------------------------------------------------------------------
+class EmailPreferencesCacheTests(TestCase):
+
+    def setUp(self):
+        reset_email_prefs_cache()
+        self.user = create_user()
+        self.client = get_auth_client(self.user)
+        self.url = reverse('email-preferences')
+
+    def test_default_users_cost_no_queries_once_cached(self):
+        from .email_prefs import get_many_prefs
+        other = create_user(username="other", email="other@test.com")
+        with self.assertNumQueries(1):
+            get_many_prefs([self.user.id, other.id])
+        with self.assertNumQueries(0):
+            prefs = get_many_prefs([self.user.id, other.id])
+        self.assertTrue(prefs[other.id].email_on_like)
+        self.assertFalse(EmailPreferences.objects.exists())
+
+    def test_reading_preferences_does_not_create_a_row(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['email_enabled'])
+        self.assertFalse(EmailPreferences.objects.exists())
+
+    def test_updates_write_through(self):
+        from .email_prefs import get_prefs
+        self.assertTrue(get_prefs(self.user.id).email_on_like)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(self.url, {'email_on_like': False}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            self.assertFalse(get_prefs(self.user.id).email_on_like)
+
+
+# ---------------------------------------------------------------------------
+# Email Template Tests
+# ---------------------------------------------------------------------------
+class EmailTemplateTests(TestCase):
+
+    def test_slots_are_filled_without_reinterpreting_values(self):
+        from .email_templates import CompiledTemplate
+        template = CompiledTemplate("{braces} 100% $$ ${name}: $value")
+        self.assertEqual(template.render({'name': "a", 'value': "$other {x}"}), "{braces} 100% $ a: $other {x}")
+
+    def test_like_email_uses_base_shell(self):
+        from .email_templates import get_like_email
+        subject, html_body, text_body = get_like_email({'sender': "Ada", 'post_text': "Hi", 'recipient_name': "Grace"})
+        self.assertEqual(subject, "👍 Ada liked your post")
+        self.assertIn("<p>Hey Grace,</p>", html_body)
+        self.assertIn("<strong>Ada</strong> liked your post:", html_body)
+        self.assertTrue(text_body.endswith("Croak - Free Voices. Real Connections.\n"))
+
+    def test_identical_contexts_are_rendered_once(self):
+        from unittest import mock
+        from .email_templates import clear_render_cache, render_email, LIKE_EMAIL
+        clear_render_cache()
+        context = {'sender': "Ada", 'post_text': "Hi", 'recipient_name': "Grace"}
+        with mock.patch.object(LIKE_EMAIL, 'render', wraps=LIKE_EMAIL.render) as render:
+            first = render_email('like', context)
+            self.assertIs(render_email('like', dict(context)), first)
+            # Key order does not matter
+            self.assertIs(render_email('like', dict(reversed(list(context.items())))), first)
+            render_email('daily_digest', {'trending_posts': []})
+        self.assertEqual(render.call_count, 1)
+
+    def test_contexts_with_containers_are_not_cached(self):
+        from .email_templates import clear_render_cache, render_email, _render_cache
+        clear_render_cache()
+        posts = [{'author': 'ada', 'text': 'Hi', 'likes': 1, 'comments': 0}]
+        render_email('daily_digest', {'trending_posts': posts, 'recipient_name': "Grace"})
+        render_email('daily_digest', {'trending_posts': (), 'recipient_name': "Grace"})
+        self.assertEqual(len(_render_cache), 0)
+
+    def test_template_source_is_never_executed(self):
+        from .email_templates import CompiledTemplate
+        source = '"""{__import__("os")}\\" $name'
+        self.assertEqual(CompiledTemplate(source).render({'name': "Ada"}), source.replace('$name', "Ada"))
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_email_templates', '--iterations', '10', '--type', 'like', stdout=out)
+        self.assertIn("like", out.getvalue())
+
+
+# ---------------------------------------------------------------------------
+# Email Body Store Tests
+# ---------------------------------------------------------------------------
+class EmailBodyStoreTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user()
+
+    def test_bodies_are_deduplicated_and_compressed(self):
+        from .email_bodies import store_body, store_bodies, decode_body
+        html_body = "<p>Hello pond!</p>" * 100
+        first = store_body(html_body, "Hello pond!")
+        self.assertEqual(store_body(html_body, "Hello pond!"), first)
+        self.assertTrue(first.compressed)
+        self.assertLess(len(bytes(first.html)), len(html_body))
+        self.assertEqual(decode_body(first), (html_body, "Hello pond!"))
+        bodies = store_bodies([(html_body, "Hello pond!"), ("<p>a</p>", "a"), ("<p>a</p>", "a")])
+        self.assertEqual(bodies[0], first)
+        self.assertEqual(bodies[1], bodies[2])
+        self.assertFalse(bodies[1].compressed)
+        self.assertEqual(EmailBody.objects.count(), 2)
+
+    def test_vars_are_merged_at_send_time(self):
+        from .email_bodies import body_slot, store_body
+        body = store_body(f"<p>Hey {body_slot('name')}</p>", f"Hey {body_slot('name')}")
+        email = EmailQueue.objects.create(
+            recipient=self.user, email_type='instant', subject="Hi",
+            body=body, body_vars={'name': "Ribbit $1"},
+        )
+        self.assertEqual(email_bodies(email), ("<p>Hey Ribbit $1</p>", "Hey Ribbit $1"))
+
+    def test_cleanup_collects_unreferenced_bodies(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .email_bodies import store_body
+        from .email_queue import cleanup_old_emails
+        old, live = store_body("<p>old</p>", "old"), store_body("<p>live</p>", "live")
+        EmailQueue.objects.create(
+            recipient=self.user, email_type='instant', subject="Old", body=old,
+            status='sent', sent_at=timezone.now() - timedelta(days=40),
+        )
+        EmailQueue.objects.create(recipient=self.user, email_type='instant', subject="Live", body=live)
+        EmailBody.objects.update(last_used_at=timezone.now() - timedelta(days=40))
+        fresh = store_body("<p>fresh</p>", "fresh")  # not referenced yet, but inside the grace period
+        self.assertEqual(cleanup_old_emails(days=30), 1)
+        self.assertEqual(set(EmailBody.objects.all()), {live, fresh})
+
+
+    def test_body_collection_is_batched_and_rechecked_by_the_delete(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .email_bodies import store_body, collect_unused_bodies, _delete_unused
+        bodies = [store_body(f"<p>{i}</p>", str(i)) for i in range(5)]
+        EmailBody.objects.update(last_used_at=timezone.now() - timedelta(days=2))
+
+        # Reused between the scan and the delete: the DELETE itself leaves it alone
+        EmailQueue.objects.create(recipient=self.user, email_type='instant', subject="Reused", body=bodies[0])
+        self.assertEqual(_delete_unused([bodies[0].id], timezone.now()), 0)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(collect_unused_bodies(batch_size=2), 4)
+        self.assertEqual(sum(q['sql'].lstrip().startswith('DELETE') for q in queries), 2)
+        self.assertEqual(list(EmailBody.objects.all()), [bodies[0]])
+
+# ---------------------------------------------------------------------------
+# Email Retention Tests
+# ---------------------------------------------------------------------------
+class EmailRetentionTests(TestCase):
+
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        self.user = create_user()
+        old = timezone.now() - timedelta(days=40)
+        self.sent = self._queue('sent', sent_at=old)
+        self.failed = self._queue('failed')
+        self.pending = self._queue('pending')
+        self.recent = self._queue('sent', sent_at=timezone.now())
+        EmailQueue.objects.exclude(id=self.recent.id).update(created_at=old)
+
+    def _queue(self, status, **fields):
+        return EmailQueue.objects.create(
+            recipient=self.user, email_type='instant', subject=f"{status} email",
+            body_html="<p>hi</p>", body_text="hi", status=status, **fields
+        )
+
+    def test_finished_rows_are_archived_and_purged_in_batches(self):
+        from .email_retention import archive_and_purge
+        with CaptureQueriesContext(connection) as queries:
+            result = archive_and_purge(days=30, batch_size=1)
+        self.assertEqual((result.purged, result.archived, result.batches), (2, 2, 2))
+        self.assertEqual(set(EmailQueue.objects.all()), {self.pending, self.recent})
+        history = EmailHistory.objects.get(id=self.sent.id)
+        self.assertEqual((history.recipient_id, history.status, history.subject), (self.user.id, 'sent', "sent email"))
+        self.assertTrue(EmailHistory.objects.filter(id=self.failed.id, status='failed').exists())
+        # Deletes go straight to DELETE by id; rows are never reloaded with their bodies
+        selects = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertFalse(any('body_html' in sql for sql in selects))
+
+    def test_max_batches_and_no_archive(self):
+        from .email_retention import archive_and_purge
+        result = archive_and_purge(days=30, batch_size=1, max_batches=1, archive=False)
+        self.assertEqual((result.purged, result.archived), (1, 0))
+        self.assertFalse(EmailHistory.objects.exists())
+
+    def test_purge_command(self):
+        out = StringIO()
+        call_command('purge_email_queue', '--pause', '0', stdout=out)
+        self.assertIn("Purged: 2", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+
+
+# ---------------------------------------------------------------------------
+# Notification Email Coalescing Tests
+# ---------------------------------------------------------------------------
+class NotificationEmailCoalescingTests(TestCase):
+
+    def setUp(self):
+        reset_email_prefs_cache()
+        self.author = create_user()
+        self.context = {
+            'sender': "Alice",
+            'post_text': "A very popular post",
+            'post_url': "https://croak.com/post/1",
+            'recipient_name': "Ribbit",
+        }
+
+    def _like(self, sender, post_url="https://croak.com/post/1"):
+        from .email_queue import queue_notification_email
+        return queue_notification_email(self.author, 'like', dict(self.context, sender=sender, post_url=post_url))
+
+    def test_likes_on_one_post_share_one_email(self):
+        from .email_bodies import email_subject
+        first = self._like("Alice")
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(240):
+                self.assertEqual(self._like(f"fan{i}").id, first.id)
+        # One UPDATE and one read per merged event, no inserts
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('INSERT')])
+
+        email = EmailQueue.objects.get()
+        self.assertEqual(email.event_count, 241)
+        self.assertEqual(email_subject(email), "👍 Alice and 240 others liked your post")
+        html, text = email_bodies(email)
+        self.assertIn("<strong>Alice and 240 others</strong> liked your post", html)
+        self.assertIn("Alice and 240 others liked your post", text)
+
+    def test_single_event_reads_like_before(self):
+        from .email_bodies import email_subject
+        from .email_templates import render_email
+        email = self._like("Alice")
+        self.assertEqual(
+            (email_subject(email), *email_bodies(email)),
+            render_email('like', self.context),
+        )
+
+    def test_other_posts_and_claimed_emails_are_not_merged(self):
+        from django.utils import timezone
+        first = self._like("Alice")
+        self.assertNotEqual(self._like("Bob", post_url="https://croak.com/post/2").id, first.id)
+        # A due row nobody has claimed yet still takes the event
+        EmailQueue.objects.filter(id=first.id).update(scheduled_for=timezone.now())
+        self.assertEqual(self._like("Carol").id, first.id)
+        # Once a worker has claimed it a new one starts
+        EmailQueue.objects.filter(id=first.id).update(status='processing')
+        self.assertNotEqual(self._like("Dave").id, first.id)
+        self.assertEqual(EmailQueue.objects.count(), 3)
+
+    def test_racing_first_events_share_one_email(self):
+        from unittest import mock
+        from django.db.models.query import QuerySet
+        first = self._like("Alice")
+        real_update = QuerySet.update
+        missed = []
+
+        def update_before_alice_committed(queryset, **kwargs):
+            # The first merge attempt runs before the other event's row is visible
+            if not missed:
+                missed.append(True)
+                return 0
+            return real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update_before_alice_committed):
+            self.assertEqual(self._like("Bob").id, first.id)
+        self.assertEqual(EmailQueue.objects.get().event_count, 2)
+
+    def test_failed_send_does_not_clash_with_the_next_email(self):
+        from .email_queue import mark_emails_failed
+        from .email_worker import claim_pending_emails
+        first = self._like("Alice")
+        EmailQueue.objects.filter(id=first.id).update(scheduled_for=first.created_at)
+        claim_pending_emails(worker_id="w")
+        second = self._like("Bob")
+        self.assertEqual(mark_emails_failed({first.id: "boom"}, worker_id="w"), 1)
+        self.assertEqual(self._like("Carol").id, second.id)
+
+    def test_one_pending_row_per_coalesce_key(self):
+        from django.db import IntegrityError
+        first = self._like("Alice")
+        with self.assertRaises(IntegrityError):
+            EmailQueue.objects.create(
+                recipient=self.author, email_type='instant', subject="Dup", coalesce_key=first.coalesce_key,
+            )
+
+    def test_mentions_are_not_coalesced(self):
+        from .email_queue import queue_notification_email
+        for sender in ("Alice", "Bob"):
+            queue_notification_email(self.author, 'mention', dict(self.context, sender=sender))
+        self.assertEqual(EmailQueue.objects.filter(event_count=1).count(), 2)
+
+
+# ---------------------------------------------------------------------------
+# Email Worker Tests
+# ---------------------------------------------------------------------------
+class EmailWorkerTests(TestCase):
+
+    def setUp(self):
+        from .circuit_breaker import reset_breakers
+        reset_breakers()
+        self.addCleanup(reset_breakers)
+        self.user = create_user()
+
+    def _queue(self, count):
+        return [
+            EmailQueue.objects.create(
+                recipient=self.user, email_type='instant',
+                subject=f"Email {i}", body_html="<p>hi</p>", body_text="hi",
+            )
+            for i in range(count)
+        ]
+
+    def test_claim_marks_rows_processing_once(self):
+        from .email_worker import claim_pending_emails
+        self._queue(3)
+        claimed = claim_pending_emails(batch_size=2, worker_id="a")
+        self.assertEqual(len(claimed), 2)
+        self.assertTrue(all(email.status == 'processing' and email.locked_by == "a" for email in claimed))
+        self.assertEqual(len(claim_pending_emails(batch_size=10, worker_id="b")), 1)
+        self.assertEqual(claim_pending_emails(batch_size=10, worker_id="c"), [])
+
+    def test_stale_claims_are_reclaimed(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .email_worker import reclaim_stale_emails
+        stale, fresh = self._queue(2)
+        EmailQueue.objects.filter(id=stale.id).update(
+            status='processing', locked_by="dead", locked_at=timezone.now() - timedelta(minutes=10))
+        EmailQueue.objects.filter(id=fresh.id).update(
+            status='processing', locked_by="alive", locked_at=timezone.now())
+        self.assertEqual(reclaim_stale_emails(lease_seconds=60), 1)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'pending')
+        self.assertEqual(stale.locked_by, '')
+        self.assertEqual(stale.retry_count, 1)
+
+    def test_stale_claim_on_last_attempt_is_dead_lettered(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .email_worker import reclaim_stale_emails, LEASE_EXPIRED_ERROR
+        from .models import EmailDeadLetter
+        (poison,) = self._queue(1)
+        EmailQueue.objects.filter(id=poison.id).update(
+            status='processing', locked_by="dead", retry_count=2,
+            locked_at=timezone.now() - timedelta(minutes=10))
+        self.assertEqual(reclaim_stale_emails(lease_seconds=60), 1)
+        self.assertFalse(EmailQueue.objects.filter(id=poison.id).exists())
+        dead = EmailDeadLetter.objects.get(id=poison.id)
+        self.assertEqual((dead.error_message, dead.retry_count), (LEASE_EXPIRED_ERROR, 3))
+
+    def test_late_results_do_not_overwrite_a_reclaimed_row(self):
+        from .email_queue import mark_emails_sent, mark_emails_failed, mark_emails_deferred
+        from .email_worker import claim_pending_emails
+        from django.utils import timezone
+        sent, failed, deferred = self._queue(3)
+        claim_pending_emails(batch_size=10, worker_id="slow")
+        # The lease ran out and another worker took the rows over
+        EmailQueue.objects.update(locked_by="fast")
+        self.assertEqual(mark_emails_sent([sent.id], worker_id="slow"), 0)
+        self.assertEqual(mark_emails_failed({failed.id: "boom"}, worker_id="slow"), 0)
+        self.assertEqual(mark_emails_deferred([deferred.id], timezone.now(), worker_id="slow"), 0)
+        self.assertTrue(all(
+            (email.status, email.retry_count, email.locked_by) == ('processing', 0, "fast")
+            for email in EmailQueue.objects.all()
+        ))
+        self.assertEqual(mark_emails_sent([sent.id], worker_id="fast"), 1)
+
+    def test_batch_marks_results(self):
+        from unittest import mock
+        from .email_worker import process_queue_batch
+        ok, bad = self._queue(2)
+        outcomes = {ok.id: (True, ''), bad.id: (False, "boom")}
+        fake_send = lambda emails, session: {email.id: outcomes[email.id] for email in emails}
+        with mock.patch('ribbits.email_worker.send_batch', side_effect=fake_send):
+            with CaptureQueriesContext(connection) as queries:
+                result = process_queue_batch(batch_size=10, concurrency=2)
+        self.assertEqual((result.claimed, result.sent, result.failed), (2, 1, 1))
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 4)  # reclaim, claim, sent, failed
+        ok.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual(ok.status, 'sent')
+        self.assertIsNone(ok.locked_at)
+        self.assertEqual(bad.status, 'pending')
+        self.assertEqual(bad.retry_count, 1)
+        self.assertEqual(bad.error_message, "boom")
+
+    def test_mark_emails_failed_backs_off_then_dead_letters(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .email_queue import mark_emails_failed, RETRY_BASE_DELAY
+        from .models import EmailDeadLetter
+        first, last = self._queue(2)
+        EmailQueue.objects.filter(id=last.id).update(retry_count=2)
+        now = timezone.now()
+        mark_emails_failed({first.id: "timeout", last.id: "rejected"}, now=now)
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.error_message, first.retry_count), ('pending', "timeout", 1))
+        # First retry waits between half and all of the base delay
+        self.assertGreaterEqual(first.scheduled_for, now + timedelta(seconds=RETRY_BASE_DELAY / 2))
+        self.assertLessEqual(first.scheduled_for, now + timedelta(seconds=RETRY_BASE_DELAY))
+
+        self.assertFalse(EmailQueue.objects.filter(id=last.id).exists())
+        dead = EmailDeadLetter.objects.get(id=last.id)
+        self.assertEqual((dead.error_message, dead.retry_count, dead.subject), ("rejected", 3, last.subject))
+
+    def test_retry_delay_grows_and_is_capped(self):
+        from .email_queue import retry_delay, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+        for retry_count, full in [(0, RETRY_BASE_DELAY), (3, RETRY_BASE_DELAY * 8), (20, RETRY_MAX_DELAY)]:
+            delay = retry_delay(retry_count).total_seconds()
+            self.assertTrue(full / 2 <= delay <= full, (retry_count, delay))
+
+    def test_replay_dead_letters_command(self):
+        from .email_queue import mark_emails_failed
+        from .models import EmailDeadLetter
+        emails = self._queue(3)
+        EmailQueue.objects.update(retry_count=2)
+        mark_emails_failed({email.id: "down" for email in emails})
+        self.assertEqual(EmailDeadLetter.objects.count(), 3)
+
+        out = StringIO()
+        call_command('replay_dead_letters', '--id', str(emails[0].id), stdout=out)
+        self.assertIn("Replayed: 1", out.getvalue())
+        call_command('replay_dead_letters', '--all', stdout=StringIO())
+        self.assertFalse(EmailDeadLetter.objects.exists())
+        replayed = list(EmailQueue.objects.all())
+        self.assertEqual(len(replayed), 3)
+        self.assertTrue(all(email.status == 'pending' and email.retry_count == 0 for email in replayed))
+        self.assertEqual(email_bodies(replayed[0]), ("<p>hi</p>", "hi"))
+
+    def test_run_email_worker_once(self):
+        from .notifications_stub import StubNotificationsServer
+        self._queue(2)
+        out = StringIO()
+        with StubNotificationsServer() as stub, override_settings(NOTIFICATIONS_SERVICE_URL=stub.url):
+            call_command('run_email_worker', '--once', stdout=out)
+        self.assertEqual(EmailQueue.objects.filter(status='sent').count(), 2)
+        self.assertIn("2 sent", out.getvalue())
+
+
+# ---------------------------------------------------------------------------
+# Notifications Client Tests
+# ---------------------------------------------------------------------------
+class NotificationsClientTests(TestCase):
+
+    def setUp(self):
+        from .circuit_breaker import reset_breakers
+        from .notifications_client import reset_bulk_support
+        reset_bulk_support()
+        reset_breakers()
+        self.addCleanup(reset_bulk_support)
+        self.addCleanup(reset_breakers)
+        self.good = create_user()
+        self.bounced = create_user(username="bounced", email="bounced@test.com")
+        for i in range(5):
+            EmailQueue.objects.create(
+                recipient=self.bounced if i == 0 else self.good, email_type='instant',
+                subject=f"Email {i}", body_html="<p>hi</p>", body_text="hi",
+            )
+
+    def _run(self, stub, **kwargs):
+        from .email_worker import process_queue_batch
+        with override_settings(NOTIFICATIONS_SERVICE_URL=stub.url):
+            return process_queue_batch(batch_size=10, **kwargs)
+
+    def test_emails_are_sent_in_bulk(self):
+        from .notifications_stub import StubNotificationsServer
+        with StubNotificationsServer(reject={"bounced@test.com"}) as stub:
+            with override_settings(NOTIFICATIONS_BULK_BATCH_SIZE=2):
+                result = self._run(stub)
+        self.assertEqual((result.sent, result.failed), (4, 1))
+        self.assertEqual(stub.requests, ["/send-queued-emails"] * 3)
+        self.assertEqual(len(stub.received), 4)
+        failed = EmailQueue.objects.get(recipient=self.bounced)
+        self.assertEqual((failed.status, failed.error_message), ('pending', "Recipient rejected"))
+
+    def test_falls_back_to_single_sends_without_bulk_route(self):
+        from django.utils import timezone
+        from .notifications_stub import StubNotificationsServer
+        with StubNotificationsServer(bulk=False, reject={"bounced@test.com"}) as stub:
+            result = self._run(stub, concurrency=1)
+            self.assertEqual((result.sent, result.failed), (4, 1))
+            self.assertEqual(stub.requests, ["/send-queued-emails"] + ["/send-queued-email"] * 5)
+
+            # The missing route is remembered, so the next batch skips the probe
+            stub.requests.clear()
+            EmailQueue.objects.filter(recipient=self.bounced).update(
+                status='pending', scheduled_for=timezone.now())
+            self._run(stub)
+            self.assertEqual(stub.requests, ["/send-queued-email"])
+
+    def test_circuit_opens_after_repeated_server_errors(self):
+        from django.utils import timezone
+        from .notifications_stub import StubNotificationsServer
+        with StubNotificationsServer() as stub, override_settings(NOTIFICATIONS_CIRCUIT_THRESHOLD=2):
+            stub.outage = 503
+            with override_settings(NOTIFICATIONS_BULK_BATCH_SIZE=2):
+                result = self._run(stub, concurrency=1)
+            # Two failed requests open the circuit; the last chunk is held back without a request
+            self.assertEqual(stub.requests, ["/send-queued-emails"] * 2)
+            self.assertEqual((result.failed, result.deferred), (4, 1))
+            deferred = EmailQueue.objects.get(retry_count=0)
+            self.assertEqual(deferred.status, 'pending')
+            self.assertGreater(deferred.scheduled_for, timezone.now())
+
+            # Nothing is claimed while the circuit stays open
+            EmailQueue.objects.update(scheduled_for=timezone.now())
+            result = self._run(stub)
+            self.assertTrue(result.paused)
+            self.assertEqual(result.claimed, 0)
+            self.assertEqual(len(stub.requests), 2)
+
+    def test_unreadable_body_does_not_hold_the_probe_slot(self):
+        import time
+        from django.utils import timezone
+        from .circuit_breaker import breaker_for
+        from .models import EmailBody
+        from .notifications_stub import StubNotificationsServer
+        corrupt = EmailBody.objects.create(digest="0" * 64, html=b"not zlib", text=b"", compressed=True)
+        broken = EmailQueue.objects.create(
+            recipient=self.good, email_type='instant', subject="Broken", body=corrupt,
+        )
+        for bulk in (True, False):
+            with self.subTest(bulk=bulk), StubNotificationsServer(bulk=bulk) as stub:
+                # Half-open: the cooldown is over and the next send is the probe
+                breaker = breaker_for(stub.url)
+                breaker.opened_at = time.monotonic() - breaker.cooldown - 1
+                EmailQueue.objects.update(status='pending', retry_count=0, error_message='', scheduled_for=timezone.now())
+                EmailQueue.objects.filter(pk=broken.pk).update(priority=0)
+                result = self._run(stub, concurrency=1)
+                broken.refresh_from_db()
+                self.assertTrue(broken.error_message.startswith("Could not build email"))
+                self.assertEqual(broken.retry_count, 1)
+                # The rest of the batch went out as the probe and closed the circuit
+                self.assertEqual(result.sent, 5)
+                self.assertIsNone(breaker.opened_at)
+                self.assertFalse(breaker.probing)
+
+
+# ---------------------------------------------------------------------------
+# Daily Digest Tests
+# ---------------------------------------------------------------------------
+class DailyDigestTests(TestCase):
+
+    def setUp(self):
+        from datetime import datetime, timedelta, timezone as dt_timezone
+        # Inside the 09:00 UTC bucket (the default digest time)
+        self.now = datetime(2026, 3, 10, 9, 5, tzinfo=dt_timezone.utc)
+        self.yesterday = self.now - timedelta(days=1)
+        self.author = create_user()
+        EmailPreferences.objects.create(user=self.author)
+        self.post = create_ribbit(self.author, "Popular")
+
+    def _add_readers(self, count, start=0):
+        readers = []
+        for i in range(start, start + count):
+            reader = create_user(username=f"reader{i}", email=f"reader{i}@test.com")
+            EmailPreferences.objects.create(user=reader)
+            Like.objects.create(ribbit=self.post, user=reader)
+            readers.append(reader)
+        Like.objects.update(created_at=self.yesterday)
+        return readers
+
+    def test_stats_are_aggregated_and_quiet_users_skipped(self):
+        from .digests import queue_daily_digests
+        quiet, muted = self._add_readers(2)
+        EmailPreferences.objects.filter(user=muted).update(daily_digest=False)
+        result = queue_daily_digests(now=self.now)
+        self.assertEqual((result.total_users, result.queued, result.skipped), (2, 1, 1))
+        email = EmailQueue.objects.get()
+        self.assertEqual((email.recipient, email.email_type), (self.author, 'digest'))
+        html_body, text_body = email_bodies(email)
+        self.assertIn("- 2 likes received", text_body)
+        self.assertIn(f"Hey {self.author.first_name},", text_body)
+
+    def test_new_followers_are_counted_by_follow_time(self):
+        from datetime import timedelta
+        from users.models import Follow
+        from .digests import get_digest_stats
+        old_fan, new_fan = (
+            create_user(username=f"fan{i}", email=f"fan{i}@test.com") for i in range(2)
+        )
+        Follow.objects.create(from_user=old_fan, to_user=self.author, created_at=self.now - timedelta(days=30))
+        Follow.objects.create(from_user=new_fan, to_user=self.author, created_at=self.yesterday)
+        # Joining date no longer matters, only when the follow happened
+        User.objects.filter(id=old_fan.id).update(created_at=self.yesterday)
+        stats = get_digest_stats([self.author.id], self.now - timedelta(days=1, hours=1), self.now)
+        self.assertEqual(stats[self.author.id], (1, 0, 0))
+
+    def test_trending_posts_reach_everyone(self):
+        from .digests import queue_daily_digests
+        self._add_readers(2)
+        Ribbit.objects.filter(id=self.post.id).update(created_at=self.yesterday, like_count=2)
+        result = queue_daily_digests(now=self.now)
+        self.assertEqual(result.queued, 3)
+        html_body, text_body = email_bodies(EmailQueue.objects.get(recipient__username="reader0"))
+        self.assertIn("@ribbituser: Popular", text_body)
+        # Both readers have the same stats, so they share a body
+        self.assertEqual(EmailBody.objects.count(), 2)
+
+    def test_only_buckets_due_in_local_time_are_queued(self):
+        from datetime import datetime, timedelta, timezone as dt_timezone
+        from .digests import queue_daily_digests
+        self._add_readers(1)
+        EmailPreferences.objects.filter(user=self.author).update(timezone='Asia/Kolkata')
+
+        # 09:00 in Kolkata is 03:30 UTC, so the 09:00 UTC run leaves the author out
+        self.assertEqual(queue_daily_digests(now=self.now).queued, 0)
+
+        now = datetime(2026, 3, 10, 3, 10, tzinfo=dt_timezone.utc)
+        slot = datetime(2026, 3, 10, 3, 30, tzinfo=dt_timezone.utc)
+        Like.objects.update(created_at=now - timedelta(hours=2))
+        self.assertEqual(queue_daily_digests(now=now, spread_seconds=600).queued, 1)
+        email = EmailQueue.objects.get()
+        self.assertEqual(email.recipient, self.author)
+        self.assertTrue(slot <= email.scheduled_for < slot + timedelta(seconds=600))
+
+    def test_users_without_preferences_get_the_default_digest(self):
+        from datetime import timedelta
+        from .digests import queue_daily_digests
+        EmailPreferences.objects.all().delete()
+        self._add_readers(1)
+        EmailPreferences.objects.all().delete()
+        # Defaults are 09:00 UTC: the author is in this run and in no other hour of the day
+        result = queue_daily_digests(now=self.now)
+        self.assertEqual((result.total_users, result.queued), (2, 1))
+        self.assertEqual(EmailQueue.objects.get().recipient, self.author)
+        for hours in range(1, 24):
+            self.assertEqual(queue_daily_digests(now=self.now + timedelta(hours=hours)).total_users, 0)
+
+    def test_rerun_in_the_same_hour_queues_once(self):
+        from datetime import timedelta
+        from .digests import queue_daily_digests
+        self._add_readers(1)
+        self.assertEqual(queue_daily_digests(now=self.now).queued, 1)
+        self.assertEqual(queue_daily_digests(now=self.now + timedelta(minutes=30)).queued, 0)
+        self.assertEqual(EmailQueue.objects.count(), 1)
+
+        # Once sent and archived it still counts; the next day's run queues again
+        from .email_retention import finished_emails, purge_batch
+        EmailQueue.objects.update(status='sent', sent_at=self.now + timedelta(minutes=20))
+        purge_batch(finished_emails(days=0, now=self.now + timedelta(hours=1)))
+        self.assertEqual(queue_daily_digests(now=self.now + timedelta(minutes=40)).queued, 0)
+        self.assertEqual(EmailHistory.objects.count(), 1)
+        Like.objects.update(created_at=self.now + timedelta(hours=1))
+        self.assertEqual(queue_daily_digests(now=self.now + timedelta(days=1)).queued, 1)
+
+    def test_reminders_are_not_queued_twice(self):
+        from unittest import mock
+        from .digests import get_run_window
+        from .management.commands import send_daily_reminders
+        reset_email_prefs_cache()
+        with mock.patch.object(send_daily_reminders, 'get_run_window', return_value=get_run_window(self.now)):
+            for _ in range(2):
+                call_command('send_daily_reminders', stdout=StringIO())
+        self.assertEqual(EmailQueue.objects.count(), 1)
+
+    def test_reminders_reach_users_without_preferences(self):
+        from unittest import mock
+        from .digests import get_run_window
+        from .management.commands import send_daily_reminders
+        EmailPreferences.objects.all().delete()
+        reset_email_prefs_cache()
+        with mock.patch.object(send_daily_reminders, 'get_run_window', return_value=get_run_window(self.now)):
+            call_command('send_daily_reminders', stdout=StringIO())
+        self.assertEqual(EmailQueue.objects.get().recipient, self.author)
+
+    def test_next_digest_slot_follows_daylight_saving(self):
+        from datetime import datetime, time, timezone as dt_timezone
+        from .email_queue import next_digest_slot
+        winter = datetime(2026, 1, 15, 20, 0, tzinfo=dt_timezone.utc)
+        summer = datetime(2026, 7, 15, 20, 0, tzinfo=dt_timezone.utc)
+        self.assertEqual(next_digest_slot(time(9), 'America/New_York', after=winter),
+                         datetime(2026, 1, 16, 14, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(next_digest_slot(time(9), 'America/New_York', after=summer),
+                         datetime(2026, 7, 16, 13, 0, tzinfo=dt_timezone.utc))
+        self.assertEqual(next_digest_slot('09:00:00', 'Not/AZone', after=winter),
+                         datetime(2026, 1, 16, 9, 0, tzinfo=dt_timezone.utc))
+
+    def test_query_count_does_not_grow_with_users(self):
+        from .digests import queue_daily_digests
+        self._add_readers(3)
+        with CaptureQueriesContext(connection) as few:
+            queue_daily_digests(now=self.now, chunk_size=50)
+        # Same slot again, so clear the first run's digests rather than have them skipped
+        EmailQueue.objects.all().delete()
+        self._add_readers(12, start=3)
+        with CaptureQueriesContext(connection) as many:
+            queue_daily_digests(now=self.now, chunk_size=50)
+        self.assertEqual(len(few), len(many))
+
+    def test_command_for_single_user(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        self._add_readers(1)
+        Like.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        out = StringIO()
+        call_command('send_daily_digests', '--user', self.author.username, stdout=out)
+        self.assertEqual(EmailQueue.objects.get().recipient, self.author)
+        self.assertIn("Queued: 1", out.getvalue())
+
+
+# ---------------------------------------------------------------------------
+# Media Probing
+# ---------------------------------------------------------------------------
+def make_wav(seconds, rate=8000):
+    import wave
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as out:
+        out.setnchannels(1)
+        out.setsampwidth(1)
+        out.setframerate(rate)
+        out.writeframes(b'\x80' * int(seconds * rate))
+    return buffer.getvalue()
+
+
+def make_mp4(seconds, width=640, height=360, handler=b'vide', timescale=1000):
+    import struct
+
+    def box(kind, payload):
+        return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+    mvhd = box(b'mvhd', b'\0' * 12 + struct.pack('>II', timescale, int(seconds * timescale)) + b'\0' * 80)
+    tkhd = box(b'tkhd', b'\0' * 76 + struct.pack('>II', width << 16, height << 16))
+    hdlr = box(b'hdlr', b'\0' * 8 + handler + b'\0' * 12)
+    moov = box(b'moov', mvhd + box(b'trak', tkhd + box(b'mdia', hdlr)))
+    return box(b'ftyp', b'isom\0\0\0\0isom') + box(b'mdat', b'\0' * 64) + moov
+
+
+def make_webm(seconds=None, blocks=(), width=320, height=240):
+    import struct
+
+    def element(element_id, payload):
+        size = len(payload)
+        return element_id + bytes([0x40 | size >> 8, size & 0xFF]) + payload
+
+    ebml = element(b'\x1a\x45\xdf\xa3', element(b'\x42\x82', b'webm'))
+    info = element(b'\x2a\xd7\xb1', struct.pack('>I', 1000000))
+    if seconds is not None:
+        info += element(b'\x44\x89', struct.pack('>d', seconds * 1000))
+    video = element(b'\xb0', bytes([width >> 8, width & 0xFF])) + element(b'\xba', bytes([height >> 8, height & 0xFF]))
+    tracks = element(b'\x16\x54\xae\x6b', element(b'\xae', element(b'\x83', b'\x01') + element(b'\xe0', video)))
+    cluster = element(b'\xe7', struct.pack('>H', 0))
+    for timecode in blocks:
+        cluster += element(b'\xa3', b'\x81' + struct.pack('>h', timecode) + b'\x80' + b'\0' * 4)
+    segment = element(b'\x15\x49\xa9\x66', info) + tracks + element(b'\x1f\x43\xb6\x75', cluster)
+    return ebml + element(b'\x18\x53\x80\x67', segment)
+
+
+class MediaProbeTests(TestCase):
+    def probe(self, data):
+        from .media_probe import probe_media
+        return probe_media(BytesIO(data))
+
+    def test_wav_duration(self):
+        info = self.probe(make_wav(2.5))
+        self.assertEqual((info.media_type, info.format), ('audio', 'wav'))
+        self.assertAlmostEqual(info.duration, 2.5)
+
+    def test_mp4_duration_and_dimensions(self):
+        info = self.probe(make_mp4(12.5))
+        self.assertEqual((info.media_type, info.format), ('video', 'mp4'))
+        self.assertAlmostEqual(info.duration, 12.5)
+        self.assertEqual((info.width, info.height), (640, 360))
+        self.assertEqual(self.probe(make_mp4(3, handler=b'soun')).media_type, 'audio')
+
+    def test_webm_duration_from_info_or_blocks(self):
+        info = self.probe(make_webm(seconds=4))
+        self.assertEqual((info.media_type, info.format), ('video', 'webm'))
+        self.assertAlmostEqual(info.duration, 4)
+        self.assertEqual((info.width, info.height), (320, 240))
+        # Recorders that never write Duration still get one from the block timecodes
+        self.assertAlmostEqual(self.probe(make_webm(blocks=(0, 1500, 3200))).duration, 3.2)
+
+    def test_mp3_vbr_frame_count(self):
+        import struct
+        frame = bytearray(417)
+        frame[:4] = b'\xff\xfb\x90\x64'  # MPEG-1 layer III, 128 kbps, 44.1 kHz, stereo
+        frame[36:48] = b'Xing' + struct.pack('>II', 1, 1000)
+        info = self.probe(bytes(frame) * 3)
+        self.assertEqual(info.media_type, 'audio')
+        self.assertAlmostEqual(info.duration, 1000 * 1152 / 44100)
+
+    def test_other_containers_cloudinary_accepted(self):
+        import struct
+        avih = struct.pack('<10I', 40000, 0, 0, 0, 250, 0, 1, 0, 320, 240) + b'\0' * 16
+        hdrl = b'hdrl' + b'avih' + struct.pack('<I', len(avih)) + avih
+        avi = b'RIFF\0\0\0\0AVI ' + b'LIST' + struct.pack('<I', len(hdrl)) + hdrl
+
+        streaminfo = b'\0' * 10 + ((44100 << 44) | (1 << 41) | (15 << 36) | 441000).to_bytes(8, 'big') + b'\0' * 16
+        flac = b'fLaC' + bytes([0x80, 0, 0, 34]) + streaminfo
+
+        rate = struct.pack('>HQ', 16383 + 15, 44100 << 48)  # 44100 as an 80-bit float
+        comm = struct.pack('>hIh', 1, 88200, 16) + rate
+        aiff = b'FORM\0\0\0\0AIFF' + b'COMM' + struct.pack('>I', len(comm)) + comm
+
+        tag = bytes([9]) + (4).to_bytes(3, 'big') + (7500).to_bytes(3, 'big') + b'\0' * 4 + b'\0' * 4
+        flv = b'FLV\x01\x05' + struct.pack('>I', 9) + struct.pack('>I', 0) + tag + struct.pack('>I', len(tag))
+
+        from .media_probe import ASF_HEADER, ASF_FILE_PROPERTIES, ASF_STREAM_PROPERTIES, ASF_VIDEO_STREAM
+        properties = ASF_FILE_PROPERTIES + struct.pack('<Q', 104) + b'\0' * 40 + struct.pack('<QQQ', 65_000_000, 0, 500) + b'\0' * 16
+        stream = ASF_STREAM_PROPERTIES + struct.pack('<Q', 40) + ASF_VIDEO_STREAM
+        body = b'\x01\x02' + properties + stream
+        asf = ASF_HEADER + struct.pack('<QI', 28 + len(body), 2) + body
+
+        frame = bytes([0xFF, 0xF1, 0x50, 0x80, 0x01, 0x1F, 0xFC]) + b'\0' * 1  # 44.1 kHz, 8-byte frames
+        adts = frame * 430
+
+        probes = {name: self.probe(data) for name, data in
+                  (('avi', avi), ('flac', flac), ('aiff', aiff), ('flv', flv), ('wmv', asf), ('aac', adts))}
+        self.assertEqual({name: (info.media_type, info.format) for name, info in probes.items()}, {
+            'avi': ('video', 'avi'), 'flac': ('audio', 'flac'), 'aiff': ('audio', 'aiff'),
+            'flv': ('video', 'flv'), 'wmv': ('video', 'wmv'), 'aac': ('audio', 'aac'),
+        })
+        for name, seconds in (('avi', 10), ('flac', 10), ('aiff', 2), ('flv', 7.5), ('wmv', 6), ('aac', 430 * 1024 / 44100)):
+            self.assertAlmostEqual(probes[name].duration, seconds, places=3, msg=name)
+        self.assertEqual((probes['avi'].width, probes['avi'].height), (320, 240))
+
+    def test_image_dimensions(self):
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new('RGB', (30, 20)).save(buffer, 'PNG')
+        info = self.probe(buffer.getvalue())
+        self.assertEqual((info.media_type, info.format, info.width, info.height), ('image', 'png', 30, 20))
+
+    def test_unreadable_file_rejected(self):
+        from .media_probe import UnsupportedMedia
+        for data in (b'just some text', make_mp4(5)[:40], b'RIFF\0\0\0\0WAVE'):
+            with self.assertRaises(UnsupportedMedia):
+                self.probe(data)
+
+    def test_malformed_aiff_sample_rate_rejected(self):
+        import struct
+        from .media_probe import UnsupportedMedia
+        for exponent in (0x7FFF, 0xFFFF, 16383 + 200, 0):
+            comm = struct.pack('>hIh', 1, 88200, 16) + struct.pack('>HQ', exponent, 1 << 63)
+            aiff = b'FORM\0\0\0\0AIFF' + b'COMM' + struct.pack('>I', len(comm)) + comm
+            with self.assertRaises(UnsupportedMedia):
+                self.probe(aiff)
+
+    def test_file_rewound_after_probe(self):
+        from .media_probe import probe_media
+        file = BytesIO(make_wav(1))
+        probe_media(file)
+        self.assertEqual(file.tell(), 0)
+
+
+class MediaUploadTests(TestCase):
+    def setUp(self):
+        self.client = get_auth_client(create_user())
+        self.url = reverse("post")
+
+    def upload(self, name, data, content_type):
+        from unittest import mock
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        media = SimpleUploadedFile(name, data, content_type=content_type)
+        with mock.patch('cloudinary.uploader.upload') as upload:
+            response = self.client.post(self.url, {"text": "Listen", "media": media}, format='multipart')
+        return response, upload
+
+    def test_long_media_rejected_without_uploading(self):
+        response, upload = self.upload("long.wav", make_wav(31), "audio/wav")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("30 seconds", str(response.data["media"]))
+        upload.assert_not_called()
+        self.assertFalse(Ribbit.objects.exists())
+
+    def test_long_audio_gets_its_own_message(self):
+        response, upload = self.upload("long.wav", make_wav(31), "audio/wav")
+        self.assertEqual(response.data["media"], ["Audio must be 30 seconds or shorter."])
+        response, upload = self.upload("long.mp4", make_mp4(31), "video/mp4")
+        self.assertEqual(response.data["media"], ["Video must be 30 seconds or shorter."])
+
+    def test_nan_and_negative_durations_rejected(self):
+        for seconds in (float('nan'), -50):
+            response, upload = self.upload("clip.webm", make_webm(seconds=seconds), "video/webm")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, seconds)
+            self.assertEqual(response.data["media"], ["Unsupported or unreadable media file."])
+            upload.assert_not_called()
+        self.assertFalse(Ribbit.objects.exists())
+
+    def test_unsupported_media_rejected_without_uploading(self):
+        response, upload = self.upload("notes.txt", b"not media at all", "text/plain")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        upload.assert_not_called()
+
+    def test_media_uploaded_once_with_probed_type(self):
+        from unittest import mock
+        from .serializers import PostSerializer
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        media = SimpleUploadedFile("clip.mp4", make_mp4(10), content_type="video/mp4")
+        serializer = PostSerializer(data={"text": "Watch", "media": media})
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data["media_type"], "video")
+        with mock.patch('cloudinary.uploader.upload', return_value={
+            'public_id': 'ribbit_media/clip', 'version': '1', 'type': 'upload',
+            'resource_type': 'video', 'format': 'mp4',
+        }) as upload:
+            ribbit = serializer.save(author=User.objects.get())
+        upload.assert_called_once()
+        self.assertEqual(ribbit.media_type, "video")
@@ -0,0 +1,158 @@
+"""
+Home Timeline (fan-out on write)
+Materializes every user's home feed into TimelineEntry rows so reading a page
+is a single range scan on (user, -created_at).
+
+Authors with more than TIMELINE_FANOUT_MAX_FOLLOWERS followers are not fanned
+out on write; their posts are merged into a reader's timeline when the reader
+opens the first page (hybrid mode). Both checks read the denormalized
+User.followers_count, never the follow table.
+"""
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.utils import timezone
+
+from users.follows import followee_ids
+
+from .models import Ribbit, TimelineEntry
+
+User = get_user_model()
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def get_fanout_follower_limit():
+    """Follower count above which an author is merged at read time instead of fanned out"""
+    return getattr(settings, 'TIMELINE_FANOUT_MAX_FOLLOWERS', 5000)
+
+
+def get_merge_window():
+    """How far back read-time merging looks for posts from high-fanout authors"""
+    return timedelta(days=getattr(settings, 'TIMELINE_MERGE_WINDOW_DAYS', 7))
+
+
+def _follow_edges():
+    # from_user follows to_user
+    return User.following.through.objects
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _entries_for(user_ids, ribbit):
+    return [
+        TimelineEntry(user_id=user_id, ribbit_id=ribbit.id, created_at=ribbit.created_at)
+        for user_id in user_ids
+    ]
+
+
+def is_high_fanout_author(author_id):
+    """True if the author has too many followers to fan out on write"""
+    return User.objects.filter(pk=author_id, followers_count__gt=get_fanout_follower_limit()).exists()
+
+
+def fan_out_ribbit(ribbit):
+    """
+    Push a freshly created ribbit into its author's and followers' timelines
+
+    Followers are streamed in batches so a large follower list is never held in
+    memory at once. Returns the number of timelines written.
+    """
+    TimelineEntry.objects.bulk_create(_entries_for([ribbit.author_id], ribbit), ignore_conflicts=True)
+
+    if is_high_fanout_author(ribbit.author_id):
+        # Merged into followers' timelines at read time instead
+        return 1
+
+    follower_ids = (
+        _follow_edges()
+        .filter(to_user_id=ribbit.author_id)
+        .values_list('from_user_id', flat=True)
+        .iterator(chunk_size=FANOUT_BATCH_SIZE)
+    )
+
+    written = 1
+    for batch in _batched(follower_ids, FANOUT_BATCH_SIZE):
+        TimelineEntry.objects.bulk_create(_entries_for(batch, ribbit), ignore_conflicts=True)
+        written += len(batch)
+
+    return written
+
+
+def pull_author_into_timeline(user, author_ids, since=None, limit=None):
+    """
+    Copy recent ribbits by ``author_ids`` into ``user``'s timeline
+
+    Used when following someone, for read-time merging of high-fanout authors,
+    and by the backfill command. Already present entries are left untouched.
+    """
+    ribbits = Ribbit.objects.filter(author_id__in=author_ids)
+    if since is not None:
+        ribbits = ribbits.filter(created_at__gte=since)
+    ribbits = ribbits.exclude(timeline_entries__user=user).order_by('-created_at')
+    if limit is not None:
+        ribbits = ribbits[:limit]
+
+    entries = [
+        TimelineEntry(user_id=user.id, ribbit_id=ribbit_id, created_at=created_at)
+        for ribbit_id, created_at in ribbits.values_list('id', 'created_at')
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=FANOUT_BATCH_SIZE, ignore_conflicts=True)
+    return len(entries)
+
+
+def remove_author_from_timeline(user, author_id):
+    """Drop an author's ribbits from a user's timeline (after unfollowing)"""
+    return TimelineEntry.objects.filter(user=user, ribbit__author_id=author_id).delete()[0]
+
+
+def merge_high_fanout_authors(user):
+    """Merge recent posts from followed high-fanout authors into the user's timeline"""
+    followees = followee_ids(user.id)
+    if not followees:
+        return 0
+    high_fanout_ids = list(
+        User.objects
+        .filter(pk__in=followees, followers_count__gt=get_fanout_follower_limit())
+        .values_list('id', flat=True)
+    )
+    if not high_fanout_ids:
+        return 0
+
+    return pull_author_into_timeline(
+        user,
+        high_fanout_ids,
+        since=timezone.now() - get_merge_window(),
+        limit=getattr(settings, 'TIMELINE_MERGE_LIMIT', 200),
+    )
+
+
+def backfill_timeline(user, since=None, limit=None):
+    """Rebuild a user's timeline from their own posts and everyone they follow"""
+    author_ids = list(_follow_edges().filter(from_user_id=user.id).values_list('to_user_id', flat=True))
+    author_ids.append(user.id)
+    return pull_author_into_timeline(user, author_ids, since=since, limit=limit)
+
+
+def home_timeline_queryset(user):
+    """
+    Ribbits in the user's home timeline, annotated with ``timeline_at``
+
+    The annotation reuses the timeline join so pagination orders and seeks on
+    the (user, -created_at) index rather than on the ribbit table.
+    """
+    return (
+        Ribbit.objects
+        .filter(timeline_entries__user=user)
+        .annotate(timeline_at=F('timeline_entries__created_at'))
+    )
@@ -2,7 +2,9 @@ from django.urls import path
 from .views import (PostApiView, RetrieveMyRibbitView, 
                     ListRibbitApiView, DeleteUpdateRibbitApiView, 
                     LikeApiView, LikedRibbitsApiView, SearchApiView,
-                    CommentApiView, UserDetailApiView, NotificationListView, RepostApiView, CommentDeleteView, replyApiView, announce_update
+                    CommentApiView, UserDetailApiView, NotificationListView, RepostApiView, CommentDeleteView, replyApiView, announce_update,
+                    HomeTimelineApiView, NotificationUnreadCountView, NotificationMarkReadView, ProfileRibbitsApiView,
+                    LikeStateApiView
                     )
 from .email_serializers import EmailPreferencesViewSet
 from .cron_views import process_email_queue_endpoint, send_daily_digests_endpoint, email_queue_stats
@@ -13,14 +15,19 @@ urlpatterns = [
     path("update/<int:pk>/", DeleteUpdateRibbitApiView.as_view(), name='edit'),
     path("my-ribbits/", RetrieveMyRibbitView.as_view(), name="my-ribbits"),
     path("ribbits/<int:pk>/like/", LikeApiView.as_view(), name="like-ribbit"),
+    path("ribbits/likes/state/", LikeStateApiView.as_view(), name="like-state"),
     path("feed/" , ListRibbitApiView.as_view(), name='feed'),
+    path("home/", HomeTimelineApiView.as_view(), name='home-timeline'),
     path("liked/", LikedRibbitsApiView.as_view(), name="liked-ribbits"),
     path("ribbits/<int:pk>/comment/", CommentApiView.as_view(), name='comments'),
     path("comments/<int:comment_id>/replies/", replyApiView.as_view(), name="comment-replies"),
     path("ribbits/<int:ribbit_id>/comment/<int:comment_id>/", CommentDeleteView.as_view(), name='delete_comment'),
     path("search/", SearchApiView.as_view(), name='search'),
     path('search/<str:username>/', UserDetailApiView.as_view(), name='search-user'),
+    path('users/<str:username>/ribbits/', ProfileRibbitsApiView.as_view(), name='profile-ribbits'),
     path("notifications/", NotificationListView.as_view(), name="notifications"),
+    path("notifications/unread-count/", NotificationUnreadCountView.as_view(), name="notifications-unread-count"),
+    path("notifications/mark-read/", NotificationMarkReadView.as_view(), name="notifications-mark-read"),
     path('<int:pk>/repost/', RepostApiView.as_view(), name='repost-with-opinion'),
     path('announce-update/', announce_update, name='announce-update'),
     path('email-preferences/', EmailPreferencesViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update'}), name='email-preferences'),
@@ -5,11 +5,11 @@ from rest_framework import permissions
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
+from rest_framework.exceptions import NotFound
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Exists, OuterRef
-from django.db import models
-from django.db.models import Q
+from django.db.models import Exists, OuterRef
+from django.db import models, transaction
 from users.serializers import UserSerializer
 from django.conf import settings
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -17,6 +17,13 @@ from rest_framework.pagination import CursorPagination
 import requests
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAdminUser
+from .pagination import TimelinePagination, NotificationPagination
+from .timeline import fan_out_ribbit, home_timeline_queryset, merge_high_fanout_authors
+from .search import search_ribbits, search_users, InvalidCursor
+from .notifications import notify, unread_count, mark_read
+from .profiles import cached_profile_header, profile_header
+from .likes import toggle_like, liked_ribbit_ids, LIKE_STATE_MAX_IDS
+from .counters import adjust_ribbit_counter
 
 
 
@@ -34,7 +41,8 @@ class PostApiView(generics.CreateAPIView):
     parser_classes = [MultiPartParser, FormParser] 
     
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        ribbit = serializer.save(author=self.request.user)
+        fan_out_ribbit(ribbit)
     
     
 
@@ -46,11 +54,8 @@ class RetrieveMyRibbitView(generics.ListAPIView):
         user = self.request.user
         return (
             Ribbit.objects.filter(author=user)
-            .select_related("author", "parent", "parent__author", "reribbit_of", "reribbit_of__author")
+            .select_related("author")
             .annotate(
-                likes_count=Count("likes", distinct=True),
-                comment_count=Count("comments", distinct=True),
-                reribbit_count_annotated=Count("replies", distinct=True), 
                 is_liked=Exists(
                     Like.objects.filter(ribbit=OuterRef("pk"), user=user)
                 )
@@ -88,28 +93,43 @@ class DeleteUpdateRibbitApiView(generics.RetrieveUpdateDestroyAPIView):
         
 
 class LikeApiView(APIView):
+    """Toggle the user's like; answers with the new state only"""
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk):
-        ribbit = get_object_or_404(Ribbit, pk=pk)
-        like, created = Like.objects.get_or_create(ribbit=ribbit, user=request.user)
-
-        if not created: 
-            like.delete()
-
-        serializer = PostSerializer(ribbit, context={"request": request})
-
+        with transaction.atomic():
+            toggled = toggle_like(request.user, pk)
+        if toggled is None:
+            return Response({"error": "Ribbit not found"}, status=status.HTTP_404_NOT_FOUND)
+        liked, likes_count = toggled
         return Response(
             {
-                "status": "liked" if created else "unliked",
-                "likes_count": ribbit.likes.count(),
-                "is_liked": created, 
-                "ribbit": serializer.data,  
+                "status": "liked" if liked else "unliked",
+                "likes_count": likes_count,
+                "is_liked": liked,
             },
             status=status.HTTP_200_OK
         )
 
 
+class LikeStateApiView(APIView):
+    """``?ids=1,2,3``: whether the user likes each of up to LIKE_STATE_MAX_IDS ribbits"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            ribbit_ids = {int(value) for value in request.query_params.get("ids", "").split(",") if value.strip()}
+        except ValueError:
+            return Response({"error": "ids must be a comma-separated list of ribbit ids"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ribbit_ids) > LIKE_STATE_MAX_IDS:
+            return Response(
+                {"error": f"At most {LIKE_STATE_MAX_IDS} ids can be checked at once"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        liked = liked_ribbit_ids(request.user, ribbit_ids)
+        return Response({"is_liked": {str(ribbit_id): ribbit_id in liked for ribbit_id in sorted(ribbit_ids)}})
+
+
         
 class ListRibbitApiView(generics.ListAPIView):
     serializer_class = PostSerializer
@@ -125,12 +145,8 @@ class ListRibbitApiView(generics.ListAPIView):
 
         return (
             queryset
-            .select_related("author", "parent", "parent__author", "reribbit_of", "reribbit_of__author")
-            .prefetch_related("likes", "comments")
+            .select_related("author")
             .annotate(
-                likes_count=Count("likes", distinct=True),
-                comment_count=Count("comments", distinct=True),
-                reribbit_count_annotated=Count("replies", distinct=True),
                 is_liked=Exists(
                     Like.objects.filter(ribbit=OuterRef("pk"), user=user)
                 ) if user.is_authenticated else models.Value(False, output_field=models.BooleanField())
@@ -144,6 +160,35 @@ class ListRibbitApiView(generics.ListAPIView):
         return context
     
 
+class HomeTimelineApiView(generics.ListAPIView):
+    """Home feed served from the materialized timeline of the requesting user"""
+    serializer_class = PostSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = TimelinePagination
+
+    def get_queryset(self):
+        user = self.request.user
+
+        # High-fanout authors are merged in when the first page is opened
+        if not self.request.query_params.get(self.pagination_class.cursor_query_param):
+            merge_high_fanout_authors(user)
+
+        return (
+            home_timeline_queryset(user)
+            .select_related("author")
+            .annotate(
+                is_liked=Exists(
+                    Like.objects.filter(ribbit=OuterRef("pk"), user=user)
+                )
+            )
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context.update({"request": self.request})
+        return context
+
+
 class LikedRibbitsApiView(generics.ListAPIView):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -152,11 +197,9 @@ class LikedRibbitsApiView(generics.ListAPIView):
         user = self.request.user
         return (
             Ribbit.objects.filter(likes__user=user)
-            .select_related("author", "parent", "parent__author", "reribbit_of", "reribbit_of__author")
+            .select_related("author")
             .annotate(
-                likes_count=Count("likes", distinct=True),
-                comment_count=Count("comments", distinct=True),
-                reribbit_count_annotated=Count("replies", distinct=True)
+                is_liked=models.Value(True, output_field=models.BooleanField())
             )
             .order_by("-created_at")
         )
@@ -168,27 +211,48 @@ class LikedRibbitsApiView(generics.ListAPIView):
 
 
 class SearchApiView(generics.RetrieveAPIView):
+    """
+    Ranked search over ribbits and users
+
+    ``?q=`` returns the first page of both; ``?type=ribbits|users&cursor=``
+    continues one of them using the ``ribbits_next`` / ``users_next`` cursor.
+    """
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
         query = request.query_params.get('q','').strip()
         if not query:
             return Response({'results': []})
-        
-        ribbits = Ribbit.objects.filter(
-            Q(text__icontains=query) | Q(author__username__icontains=query)
-        )
-        ribbit_serializer = PostSerializer(ribbits, many=True,context={"request": request})
 
-        users = User.objects.filter(
-            Q(username__icontains=query) | Q(bio__icontains=query)
-        )
-        user_serializer = UserSerializer(users, many=True,context={"request": request})
+        search_type = request.query_params.get('type')
+        cursor = request.query_params.get('cursor') if search_type else None
+        if search_type not in (None, 'ribbits', 'users'):
+            return Response({'error': 'type must be "ribbits" or "users"'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        context = {"request": request}
+        data = {}
+
+        try:
+            if search_type in (None, 'ribbits'):
+                ribbits = search_ribbits(
+                    query,
+                    cursor=cursor,
+                    queryset=Ribbit.objects.select_related("author").annotate(
+                        is_liked=Exists(Like.objects.filter(ribbit=OuterRef("pk"), user=user))
+                    ),
+                )
+                data["ribbits"] = PostSerializer(ribbits.results, many=True, context=context).data
+                data["ribbits_next"] = ribbits.next_cursor
 
-        return Response({
-            "ribbits": ribbit_serializer.data,
-            "users": user_serializer.data,
-        })
+            if search_type in (None, 'users'):
+                users = search_users(query, cursor=cursor)
+                data["users"] = UserSerializer(users.results, many=True, context=context).data
+                data["users_next"] = users.next_cursor
+        except InvalidCursor:
+            return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(data)
 
 class CommentApiView(generics.ListCreateAPIView):
     serializer_class = CommentSerializer
@@ -198,9 +262,12 @@ class CommentApiView(generics.ListCreateAPIView):
         ribbit_id = self.kwargs.get('pk')
         return Comment.objects.filter(ribbit_id=ribbit_id).order_by('-created_at')
 
+    @transaction.atomic
     def perform_create(self, serializer):
         ribbit_id = self.kwargs.get('pk')
-        serializer.save(author=self.request.user, ribbit_id=ribbit_id)
+        comment = serializer.save(author=self.request.user, ribbit_id=ribbit_id)
+        author_id = Ribbit.objects.filter(pk=ribbit_id).values_list('author_id', flat=True).first()
+        notify(self.request.user.id, author_id, 'comment', post_id=ribbit_id, message=comment.text)
 
 class CommentDeleteView(generics.DestroyAPIView):
     queryset = Comment.objects.all()
@@ -208,7 +275,9 @@ class CommentDeleteView(generics.DestroyAPIView):
 
     def delete(self, request, ribbit_id, comment_id):
         comment = get_object_or_404(Comment, id=comment_id, ribbit_id=ribbit_id)
-        comment.delete()
+        with transaction.atomic():
+            comment.delete()
+            adjust_ribbit_counter(comment.ribbit_id, 'comment_count', -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
     
 class replyApiView(generics.ListCreateAPIView):
@@ -226,24 +295,81 @@ class replyApiView(generics.ListCreateAPIView):
         
        
 class UserDetailApiView(generics.RetrieveAPIView):
-    queryset = User.objects.all()
-    serializer_class = PublicUserSerializer
+    """Profile header of a user; their ribbits are paged by ProfileRibbitsApiView"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def retrieve(self, request, username):
+        header = profile_header(username, request.user)
+        if header is None:
+            return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(header)
+
+
+class ProfileRibbitsApiView(generics.ListAPIView):
+    """A user's ribbits, newest first, cursor-paginated over the (author, created_at) index"""
+    serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
-    parser_classes = [MultiPartParser, FormParser] 
-    lookup_field = 'username'
+
+    def get_queryset(self):
+        user = self.request.user
+        # The cached profile header resolves the username without a query
+        header = cached_profile_header(self.kwargs["username"])
+        if header is None:
+            raise NotFound("User not found")
+        return (
+            Ribbit.objects.filter(author_id=header["id"])
+            .select_related("author")
+            .annotate(
+                is_liked=Exists(
+                    Like.objects.filter(ribbit=OuterRef("pk"), user=user)
+                )
+            )
+            .order_by("-created_at")
+        )
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
-        context['request'] = self.request
+        context.update({"request": self.request})
         return context
 
 
 class NotificationListView(generics.ListAPIView):
+    """The user's notifications, newest first; ``?unread=true`` lists only unread ones"""
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotificationPagination
 
     def get_queryset(self):
-        return Notification.objects.filter(receiver=self.request.user)
+        queryset = Notification.objects.filter(receiver=self.request.user)
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            queryset = queryset.filter(is_read=False)
+        return queryset.select_related('sender', 'receiver', 'post')
+
+
+class NotificationUnreadCountView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response({"unread_count": unread_count(request.user.id)})
+
+
+class NotificationMarkReadView(APIView):
+    """Mark notifications as read: ``{"ids": [...]}`` for some, ``{"all": true}`` for every one"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        ids = request.data.get('ids')
+        if not request.data.get('all'):
+            if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+                return Response(
+                    {"error": "Pass a list of notification ids or all=true"},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        else:
+            ids = None
+
+        marked = mark_read(request.user.id, ids)
+        return Response({"marked": marked, "unread_count": unread_count(request.user.id)})
 
 
 class RepostApiView(generics.CreateAPIView):
@@ -268,6 +394,8 @@ class RepostApiView(generics.CreateAPIView):
         original_post.reribbit_count = models.F('reribbit_count') + 1
         original_post.save(update_fields=['reribbit_count'])
         original_post.refresh_from_db()
+        fan_out_ribbit(new_post)
+        notify(self.request.user.id, original_post.author_id, 'reribbit', post_id=original_post.id)
         
         self.instance = new_post
 
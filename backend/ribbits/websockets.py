@@ -0,0 +1,169 @@
+"""
+Notification Websocket
+ASGI websocket endpoint that pushes a user's notifications as they are created,
+so clients no longer poll the notifications list.
+
+Clients connect to ``/ws/notifications/?token=<access token>`` with the same
+SimpleJWT access token the REST API uses (non-browser clients may send an
+``Authorization: Bearer`` header instead). Once connected they receive the
+current unread count, then one JSON message per event:
+
+    {"type": "unread_count", "unread_count": 3}
+    {"type": "notification", "notification": {...same fields as the list...}}
+
+plus ``{"type": "ping"}`` after KEEPALIVE_SECONDS without events. Messages sent
+by the client are ignored. Events come from the configured realtime broker
+(see realtime); croak/asgi.py routes the path here.
+
+A client that falls too far behind gets ``{"type": "resync"}`` and the
+connection is closed (code 4008); it should refetch over the REST API and
+reconnect. The helpers here are shared with the community chat socket.
+"""
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .notifications import unread_count, unread_event
+from .realtime import get_broker, user_channel
+
+NOTIFICATIONS_WS_PATH = '/ws/notifications/'
+KEEPALIVE_SECONDS = 30
+CLOSE_LAGGING = 4008
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+
+
+def _raw_token(scope):
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    if token:
+        return token[0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            scheme, _, credentials = value.decode().partition(' ')
+            if scheme.lower() == 'bearer':
+                return credentials.strip()
+    return None
+
+
+@sync_to_async
+def authenticate(raw_token):
+    """Active user for a SimpleJWT access token, or None"""
+    if not raw_token:
+        return None
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+
+
+async def send_json(send, payload):
+    await send({'type': 'websocket.send', 'text': json.dumps(payload, cls=DjangoJSONEncoder)})
+
+
+async def close(send, code=1000):
+    await send({'type': 'websocket.close', 'code': code})
+
+
+async def connect_user(scope, receive, send):
+    """
+    Take the handshake and authenticate it
+
+    Returns the user, or None after refusing the connection. The caller
+    sends ``websocket.accept`` once any further checks pass.
+    """
+    if (await receive())['type'] != 'websocket.connect':
+        return None
+    user = await authenticate(_raw_token(scope))
+    if user is None:
+        await close(send, CLOSE_UNAUTHORIZED)
+    return user
+
+
+async def stream_events(receive, send, channel, initial=None, ends=None):
+    """
+    Relay a broker channel to an accepted connection until the client leaves
+
+    Args:
+        channel: realtime channel to subscribe to
+        initial: optional coroutine function returning events to send once subscribed
+        ends: optional predicate; the connection is closed after an event it accepts
+    """
+    broker = get_broker()
+    subscription = broker.subscribe(channel)
+    receiving = asyncio.ensure_future(receive())
+    event = None
+    try:
+        for payload in (await initial() if initial else ()):
+            await send_json(send, payload)
+        while True:
+            if subscription.lagged:
+                # Too far behind: have the client refetch what it missed and reconnect
+                await send_json(send, {'type': 'resync'})
+                await close(send, CLOSE_LAGGING)
+                break
+            event = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait(
+                {receiving, event}, timeout=KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED
+            )
+            if event in done:
+                payload = event.result()
+                await send_json(send, payload)
+                if ends and ends(payload):
+                    await close(send)
+                    break
+            else:
+                event.cancel()
+            if receiving in done:
+                if receiving.result()['type'] == 'websocket.disconnect':
+                    break
+                receiving = asyncio.ensure_future(receive())
+            if not done:
+                await send_json(send, {'type': 'ping'})
+    finally:
+        broker.unsubscribe(subscription)
+        for task in (receiving, event):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+async def notifications_websocket(scope, receive, send):
+    """Stream the connecting user's notification events until they disconnect"""
+    user = await connect_user(scope, receive, send)
+    if user is None:
+        return
+    await send({'type': 'websocket.accept'})
+
+    async def initial():
+        return [unread_event(await sync_to_async(unread_count)(user.id))]
+
+    await stream_events(receive, send, user_channel(user.id), initial=initial)
+
+
+def websocket_router(http_application, routes):
+    """
+    ASGI app sending websocket connections to their endpoint and everything else to Django
+
+    Args:
+        routes: ``(path regex, handler)`` pairs; named groups are passed to the handler
+    """
+    routes = [(re.compile(pattern), handler) for pattern, handler in routes]
+
+    async def application(scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await http_application(scope, receive, send)
+        for pattern, handler in routes:
+            match = pattern.fullmatch(scope['path'])
+            if match:
+                return await handler(scope, receive, send, **match.groupdict())
+        await receive()
+        await close(send, CLOSE_NOT_FOUND)
+    return application
@@ -0,0 +1,130 @@
+"""
+Follow Graph
+Writes follow edges and keeps User.followers_count / User.following_count in
+step with them.
+
+follow() and unfollow() change the Follow row and both users' counters in
+one transaction, so profiles read the counters instead of counting edges.
+
+Every user's followee ids are cached as one set, so follow state for a whole
+page of users (are_following) is a single cache lookup. follow() and
+unfollow() write through to the cached set once their transaction commits.
+"""
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import Follow
+
+User = get_user_model()
+
+FOLLOWEES_CACHE_TIMEOUT = 60 * 60
+
+
+def _followees_key(user_id):
+    return f'follows:followees:{user_id}'
+
+
+def followee_ids(user_id):
+    """Set of ids ``user_id`` follows, loaded at most once per cache period"""
+    followees = cache.get(_followees_key(user_id))
+    if followees is None:
+        followees = set(Follow.objects.filter(from_user_id=user_id).values_list('to_user_id', flat=True))
+        cache.set(_followees_key(user_id), followees, FOLLOWEES_CACHE_TIMEOUT)
+    return followees
+
+
+def invalidate_followees(user_id):
+    cache.delete(_followees_key(user_id))
+
+
+def _write_through(user_id, target_id, following):
+    def update():
+        followees = cache.get(_followees_key(user_id))
+        if followees is not None:
+            if following:
+                followees.add(target_id)
+            else:
+                followees.discard(target_id)
+            cache.set(_followees_key(user_id), followees, FOLLOWEES_CACHE_TIMEOUT)
+    transaction.on_commit(update)
+
+
+def are_following(viewer, user_ids):
+    """``{user id: bool}``: whether ``viewer`` follows each of ``user_ids``, in one cache lookup"""
+    if not viewer.is_authenticated:
+        return dict.fromkeys(user_ids, False)
+    followees = followee_ids(viewer.id)
+    return {user_id: user_id in followees for user_id in user_ids}
+
+
+def _adjust(user_ids, field, delta):
+    """Atomically add ``delta`` to a counter column, never going below zero"""
+    if delta >= 0:
+        expression = F(field) + delta
+    else:
+        expression = Greatest(F(field) + delta, Value(0))
+    User.objects.filter(pk__in=user_ids).update(**{field: expression})
+
+
+def follow(user, target):
+    """Make ``user`` follow ``target``; False if they already did"""
+    try:
+        with transaction.atomic():
+            Follow.objects.create(from_user=user, to_user=target)
+            _adjust([user.id], 'following_count', 1)
+            _adjust([target.id], 'followers_count', 1)
+    except IntegrityError:
+        return False
+    _write_through(user.id, target.id, True)
+    return True
+
+
+def unfollow(user, target):
+    """Stop ``user`` following ``target``; False if they did not"""
+    with transaction.atomic():
+        deleted = Follow.objects.filter(from_user=user, to_user=target).delete()[0]
+        if deleted:
+            _adjust([user.id], 'following_count', -1)
+            _adjust([target.id], 'followers_count', -1)
+            _write_through(user.id, target.id, False)
+    return bool(deleted)
+
+
+def toggle_follow(user, target):
+    """
+    Follow ``target``, or stop following them if ``user`` already does
+
+    Returns True if ``user`` follows ``target`` afterwards. The current state
+    comes from the cached followee set; if that turns out stale the write
+    reveals it and the other direction is taken.
+    """
+    if target.id in followee_ids(user.id):
+        if unfollow(user, target):
+            return False
+        invalidate_followees(user.id)
+        return follow(user, target)
+    if follow(user, target):
+        return True
+    invalidate_followees(user.id)
+    return not unfollow(user, target)
+
+
+def forget_follows(user):
+    """Drop a user that is about to be deleted from the counters of everyone they are linked to"""
+    followees = Follow.objects.filter(from_user=user).values('to_user_id')
+    followers = Follow.objects.filter(to_user=user).values('from_user_id')
+    _adjust(followees, 'followers_count', -1)
+    _adjust(followers, 'following_count', -1)
+    invalidate_followees(user.id)
+
+
+def follow_counts(*user_ids):
+    """``{user id: (followers_count, following_count)}`` read in one query"""
+    return {
+        user_id: (followers, following)
+        for user_id, followers, following in
+        User.objects.filter(pk__in=user_ids).values_list('id', 'followers_count', 'following_count')
+    }
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:29
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+# GIN indexes are Postgres-only; other databases use the in-process fallback index
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS users_user_search_gin ON users_user USING gin (search_vector)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS users_user_search_gin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0021_rename_is_verfied_otp_is_verified_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,109 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 5000
+
+
+def backfill_follows(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+    Edge = User.following.through
+
+    # The old edges carry no timestamp; a follow cannot predate either account
+    last_id = 0
+    while True:
+        edges = list(
+            Edge.objects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'from_user_id', 'to_user_id', 'from_user__created_at', 'to_user__created_at'
+            )[:BATCH_SIZE]
+        )
+        if not edges:
+            break
+        Follow.objects.bulk_create([
+            Follow(from_user_id=from_user_id, to_user_id=to_user_id, created_at=max(followed_at, joined_at))
+            for _, from_user_id, to_user_id, followed_at, joined_at in edges
+        ], ignore_conflicts=True)
+        last_id = edges[-1][0]
+
+    def count_of(field):
+        counts = (
+            Follow.objects.filter(**{field: OuterRef('pk')})
+            .order_by().values(field).annotate(total=Count('id')).values('total')
+        )
+        return Coalesce(Subquery(counts), Value(0))
+
+    last_id = 0
+    while True:
+        ids = list(
+            User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:BATCH_SIZE]
+        )
+        if not ids:
+            break
+        User.objects.filter(id__gte=ids[0], id__lte=ids[-1]).update(
+            followers_count=count_of('to_user'),
+            following_count=count_of('from_user'),
+        )
+        last_id = ids[-1]
+
+
+def restore_follows(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+    Edge = User.following.through
+
+    last_id = 0
+    while True:
+        follows = list(
+            Follow.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'from_user_id', 'to_user_id')[:BATCH_SIZE]
+        )
+        if not follows:
+            break
+        Edge.objects.bulk_create([
+            Edge(from_user_id=from_user_id, to_user_id=to_user_id)
+            for _, from_user_id, to_user_id in follows
+        ], ignore_conflicts=True)
+        last_id = follows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0022_user_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='Follow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('from_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='following_edges', to=settings.AUTH_USER_MODEL)),
+                ('to_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='follower_edges', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [
+                    models.Index(fields=['from_user', '-created_at'], name='users_follo_from_us_c813da_idx'),
+                    models.Index(fields=['to_user', '-created_at'], name='users_follo_to_user_74b25b_idx'),
+                ],
+                'unique_together': {('from_user', 'to_user')},
+            },
+        ),
+        migrations.RunPython(backfill_follows, restore_follows),
+    ]
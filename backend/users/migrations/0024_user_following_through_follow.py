@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Point User.following at Follow (backfilled by 0023) and drop the old edge table"""
+
+    dependencies = [
+        ('users', '0023_follow'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='user',
+            name='following',
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following',
+            field=models.ManyToManyField(blank=True, related_name='followers', through='users.Follow', through_fields=('from_user', 'to_user'), to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils import timezone
 from cloudinary.models import CloudinaryField
+from django.contrib.postgres.search import SearchVectorField
 import uuid
 from datetime import timedelta
 
@@ -12,8 +13,16 @@ class User(AbstractUser):
     bio = models.TextField(blank=True, null=True)
     profile_pic = CloudinaryField('media', folder='profiles', blank=True, null=True)
     location = models.CharField(max_length=255, blank=True, null=True)
-    following = models.ManyToManyField('self', symmetrical=False, related_name="followers", blank=True)
+    following = models.ManyToManyField(
+        'self', through='Follow', through_fields=('from_user', 'to_user'),
+        symmetrical=False, related_name="followers", blank=True,
+    )
+    # Denormalized from Follow (see users.follows)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
     banner = CloudinaryField('media', folder='banners', blank=True, null=True)
+    # Postgres full-text vector over username and bio, GIN indexed (see ribbits.search)
+    search_vector = SearchVectorField(null=True, editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name']
@@ -21,6 +30,24 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+
+class Follow(models.Model):
+    """``from_user`` follows ``to_user``"""
+    from_user = models.ForeignKey(User, related_name='following_edges', on_delete=models.CASCADE)
+    to_user = models.ForeignKey(User, related_name='follower_edges', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('from_user', 'to_user')
+        indexes = [
+            models.Index(fields=['from_user', '-created_at']),
+            models.Index(fields=['to_user', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.from_user_id} follows {self.to_user_id}"
+
+
 def get_expiration():
     return timezone.now() + timedelta(minutes=5)
 
@@ -81,10 +81,10 @@ class UserSerializer(serializers.ModelSerializer):
         return instance
 
     def get_followers_count(self, obj):
-        return obj.followers.count()
+        return obj.followers_count
 
     def get_following_count(self, obj):
-        return obj.following.count()
+        return obj.following_count
 
 
 class RequestPasswordResetSerializer(serializers.Serializer):
@@ -155,6 +155,8 @@ class UserListTests(TestCase):
 class FollowUnfollowTests(TestCase):
 
     def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
         self.user = create_user()
         self.target = create_user(username="target", email="target@test.com")
         self.client = get_auth_client(self.user)
@@ -165,12 +167,86 @@ class FollowUnfollowTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn(self.target, self.user.following.all())
 
+    def test_follow_notifies_target_and_unfollow_retracts(self):
+        from ribbits.models import Notification
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+        self.assertTrue(Notification.objects.filter(sender=self.user, receiver=self.target, notif_type="follow").exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+        self.assertFalse(Notification.objects.exists())
+
     def test_unfollow_user(self):
         self.user.following.add(self.target)
         response = self.client.post(self.url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertNotIn(self.target, self.user.following.all())
 
+    def test_follow_counters_track_follows(self):
+        response = self.client.post(self.url)
+        self.assertEqual((response.data["following_count"], response.data["followers_count"]), (1, 1))
+        self.client.post(self.url)
+        self.client.post(self.url)
+        self.client.post(self.url)
+        self.user.refresh_from_db()
+        self.target.refresh_from_db()
+        self.assertEqual((self.user.following_count, self.target.followers_count), (0, 0))
+        self.assertEqual(self.user.following_edges.count(), 0)
+
+    def test_profile_counts_are_read_from_counters(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.client.post(self.url)
+        self.user.refresh_from_db()
+        self.client.force_authenticate(user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("user-profile"))
+        self.assertEqual(response.data["following_count"], 1)
+        self.assertFalse(any("users_follow" in query["sql"] for query in queries))
+
+    def test_deleting_a_user_releases_counters(self):
+        fan = create_user(username="fan", email="fan@test.com")
+        get_auth_client(fan).post(self.url)
+        self.client.post(self.url)
+        self.user.delete()
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.followers_count, 1)
+
+    def test_follow_state_is_written_through(self):
+        from users.follows import are_following, followee_ids
+        self.assertEqual(followee_ids(self.user.id), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+        self.assertEqual(are_following(self.user, [self.target.id]), {self.target.id: True})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url)
+        with self.assertNumQueries(0):
+            self.assertEqual(are_following(self.user, [self.target.id]), {self.target.id: False})
+
+    def test_stale_follow_state_still_toggles(self):
+        from users.follows import followee_ids
+        followee_ids(self.user.id)
+        # Edge written behind the cache's back
+        self.user.following.add(self.target)
+        response = self.client.post(self.url)
+        self.assertEqual(response.data["status"], "unfollowed")
+        self.assertFalse(self.user.following.exists())
+
+    def test_user_lists_check_follow_state_once(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from rest_framework.test import APIRequestFactory
+        from ribbits.serializers import PublicUserSerializer
+        others = [create_user(username=f"other{i}", email=f"other{i}@test.com") for i in range(3)]
+        self.user.following.add(others[1])
+        request = APIRequestFactory().get("/")
+        request.user = self.user
+        users = User.objects.filter(id__in=[other.id for other in others]).order_by("id")
+        with CaptureQueriesContext(connection) as queries:
+            data = PublicUserSerializer(users, many=True, context={"request": request}).data
+        self.assertEqual(sum("users_follow" in query["sql"] for query in queries), 1)
+        self.assertEqual([item["is_following"] for item in data], [False, True, False])
+
     def test_cannot_follow_self(self):
         url = reverse("follow", kwargs={"username": self.user.username})
         response = self.client.post(url)
@@ -23,9 +23,16 @@ from .serializers import (
     GoogleLoginSerializer,
 )
 from .models import OTP
+from .follows import toggle_follow, follow_counts
+from ribbits.timeline import pull_author_into_timeline, remove_author_from_timeline
+from ribbits.notifications import notify, retract
+from ribbits.profiles import invalidate_profile_header
 
 User = get_user_model()
 
+# Recent ribbits copied into the home timeline when following someone
+TIMELINE_FOLLOW_BACKFILL = 50
+
 
 # ---------------- UTILITIES ----------------
 def generate_otp():
@@ -363,15 +370,21 @@ class FollowUnfollowView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        if target_user in user.following.all():
-            user.following.remove(target_user)
+        following = toggle_follow(user, target_user)
+        # Both profiles show follow counts
+        invalidate_profile_header(user.username, target_user.username)
+        if not following:
+            remove_author_from_timeline(user, target_user.id)
+            retract(user.id, target_user.id, 'follow')
             return Response({"status": "unfollowed"})
         else:
-            user.following.add(target_user)
+            pull_author_into_timeline(user, [target_user.id], limit=TIMELINE_FOLLOW_BACKFILL)
+            notify(user.id, target_user.id, 'follow')
+            counts = follow_counts(user.id, target_user.id)
             return Response(
                 {
                     "status": "followed",
-                    "following_count": user.following.count(),
-                    "followers_count": target_user.followers.count(),
+                    "following_count": counts[user.id][1],
+                    "followers_count": counts[target_user.id][0],
                 }
             )